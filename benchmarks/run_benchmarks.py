@@ -0,0 +1,272 @@
+"""
+Times and memory-profiles the verification functions, the pixel difference statistics and the scrubbers on
+synthetic GeoTIFF, NetCDF and Zarr data, for passing as well as failing verifications. `import_plugin` times the
+cold start of a Python process importing the pytest plugin, which every pytest run pays.
+
+    python benchmarks/run_benchmarks.py --scale 1mb --compare benchmarks/baselines.json
+    python benchmarks/run_benchmarks.py --scale 1mb --save benchmarks/baselines.json
+
+Every case runs `--repeat` times; the fastest run is its time. Its peak memory is the peak of traced Python and
+numpy allocations of one additional run, which does not include GDAL's or HDF5's own buffers. Generated data is
+kept in `--data-dir` and reused by later runs.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from approvaltests.approval_exception import ApprovalException
+from approvaltests.file_approver import FileApprover
+from approvaltests.namer import NamerBase
+from xarray import DataArray
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_data import SCALES, RasterSpec, synthetic_values, write_geo_tif, write_geo_nc, \
+    write_geo_zarr  # noqa: E402
+from pytest_approvaltests_geo import verify_geo_tif, verify_geo_nc, verify_geo_zarr  # noqa: E402
+from pytest_approvaltests_geo.differs.difference import calculate_pixel_diff_stats  # noqa: E402
+from pytest_approvaltests_geo.geo_options import GeoOptions  # noqa: E402
+from pytest_approvaltests_geo.scrubbers import make_scrubber_recurse, make_scrubber_sequential, \
+    scrub_xarray_coordinates, yeoda_datacube_metadata_scrubber  # noqa: E402
+
+DEFAULT_DATA_DIR = Path(".benchmark_data")
+DEFAULT_THRESHOLD = 1.5
+
+TIF_SPECS = [
+    dict(bands=1, dtype="float32", compress=None, block_size=256),
+    dict(bands=1, dtype="float32", compress="deflate", block_size=256),
+    dict(bands=1, dtype="int16", compress="deflate", block_size=None),
+    dict(bands=4, dtype="uint8", compress="lzw", block_size=512),
+    dict(bands=2, dtype="float64", compress="deflate", block_size=512),
+]
+DATASET_SPECS = [
+    dict(bands=1, dtype="float32", compress=None, block_size=256),
+    dict(bands=1, dtype="float32", compress="deflate", block_size=512),
+    dict(bands=3, dtype="int16", compress="deflate", block_size=None),
+]
+FORMATS = {
+    "tif": (".tif", write_geo_tif, verify_geo_tif, TIF_SPECS),
+    "nc": (".nc", write_geo_nc, verify_geo_nc, DATASET_SPECS),
+    "zarr": (".zarr", write_geo_zarr, verify_geo_zarr, DATASET_SPECS),
+}
+
+Run = Callable[[], None]
+
+
+@dataclass
+class Case:
+    name: str
+    setup: Callable[[Path], Run]
+
+
+class BenchmarkNamer(NamerBase):
+    def __init__(self, directory: Path, file_name: str, extension: str):
+        super().__init__(extension)
+        self._directory = directory
+        self._file_name = file_name
+
+    def get_file_name(self) -> str:
+        return self._file_name
+
+    def get_directory(self) -> str:
+        return self._directory.as_posix()
+
+    def config_directory(self) -> str:
+        return self.get_directory()
+
+
+def verify_case(format_name: str, spec: RasterSpec, passing: bool) -> Case:
+    suffix, write, verify, _ = FORMATS[format_name]
+    name = f"{format_name}-{spec.name}"
+
+    def setup(data_dir: Path) -> Run:
+        approved_dir = data_dir / "approved"
+        approved_dir.mkdir(parents=True, exist_ok=True)
+        namer = BenchmarkNamer(approved_dir, name, suffix)
+        approved_path = Path(namer.get_approved_filename())
+        received_path = Path(namer.get_received_filename())
+        input_path = data_dir / f"{name}.{'same' if passing else 'perturbed'}{suffix}"
+        for path, perturbed in [(approved_path, False), (input_path, not passing)]:
+            if not path.exists():
+                write(spec, path, perturbed)
+        options = GeoOptions.from_options(GeoOptions().with_namer(namer))
+
+        def run() -> None:
+            FileApprover.previous_approved.clear()
+            try:
+                with redirect_stdout(io.StringIO()):
+                    verify(input_path, options=options)
+                if not passing:
+                    raise AssertionError(f"verifying {input_path} was expected to fail")
+            except ApprovalException:
+                if passing:
+                    raise
+            finally:
+                _remove(received_path)
+
+        return run
+
+    return Case(f"verify_geo_{format_name}[{spec.name}-{'pass' if passing else 'fail'}]", setup)
+
+
+def pixel_diff_stats_case(spec: RasterSpec, passing: bool) -> Case:
+    def setup(_: Path) -> Run:
+        _, height, width = spec.shape
+        approved = synthetic_values(spec, 0, 0, height, width)
+        received = synthetic_values(spec, 0, 0, height, width, perturbed=not passing)
+        return lambda: calculate_pixel_diff_stats(approved, received)
+
+    return Case(f"calculate_pixel_diff_stats[{spec.name}-{'pass' if passing else 'fail'}]", setup)
+
+
+def tags_scrubber_case(n_bytes: int) -> Case:
+    n_tags = max(n_bytes >> 12, 16)
+
+    def setup(_: Path) -> Run:
+        scrubber = make_scrubber_recurse(yeoda_datacube_metadata_scrubber)
+        tags = {f"tag_{i}": _yeoda_metadata(i) for i in range(n_tags)}
+        tags["nested"] = [dict(id=_yeoda_metadata(i), plain="no metadata") for i in range(n_tags)]
+        return lambda: scrubber(tags)
+
+    return Case(f"scrub_tags[{n_tags}]", setup)
+
+
+def coords_scrubber_case(n_bytes: int) -> Case:
+    n_values = max(n_bytes >> 8, 16)
+
+    def setup(_: Path) -> Run:
+        scrubber = make_scrubber_sequential(yeoda_datacube_metadata_scrubber)
+        array = DataArray(np.zeros(n_values, dtype=np.uint8), dims=["time"],
+                          coords=dict(time=[_yeoda_metadata(i % 256) for i in range(n_values)]))
+        return lambda: scrub_xarray_coordinates(array, scrubber)
+
+    return Case(f"scrub_coordinates[{n_values}]", setup)
+
+
+def plugin_import_case() -> Case:
+    def setup(_: Path) -> Run:
+        command = [sys.executable, "-c", "import pytest_approvaltests_geo"]
+        return lambda: subprocess.run(command, check=True)
+
+    return Case("import_plugin", setup)
+
+
+def make_cases(n_bytes: int, formats: List[str]) -> List[Case]:
+    cases = []
+    for format_name in formats:
+        for spec_fields in FORMATS[format_name][3]:
+            spec = RasterSpec(n_bytes, **spec_fields)
+            cases += [verify_case(format_name, spec, True), verify_case(format_name, spec, False)]
+    stats_spec = RasterSpec(n_bytes)
+    cases += [pixel_diff_stats_case(stats_spec, True), pixel_diff_stats_case(stats_spec, False)]
+    cases += [tags_scrubber_case(n_bytes), coords_scrubber_case(n_bytes), plugin_import_case()]
+    return cases
+
+
+def run_case(case: Case, data_dir: Path, repeat: int) -> Dict[str, float]:
+    run = case.setup(data_dir)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(seconds=min(seconds), median_seconds=statistics.median(seconds), peak_mb=peak / 2 ** 20)
+
+
+def find_regressions(results: Dict[str, Dict[str, float]], baselines: Dict[str, Dict[str, float]],
+                     threshold: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        for metric in ["seconds", "peak_mb"]:
+            if result[metric] > baseline[metric] * threshold and result[metric] - baseline[metric] > _noise(metric):
+                regressions.append(f"{name}: {metric} {result[metric]:.4g} > {threshold} x {baseline[metric]:.4g}")
+    return regressions
+
+
+def environment() -> Dict[str, str]:
+    return dict(python=platform.python_version(), platform=platform.platform(), machine=platform.machine(),
+                cpus=str(os.cpu_count()))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=sorted(SCALES, key=SCALES.get), action="append",
+                        help="uncompressed size of the synthetic rasters, may be given several times (default: 1mb)")
+    parser.add_argument("--format", choices=list(FORMATS), action="append", dest="formats",
+                        help="restrict verification cases to these formats (default: all)")
+    parser.add_argument("-k", "--select", default="*", help="glob pattern for the case names to run")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case")
+    parser.add_argument("--data-dir", type=Path, default=DEFAULT_DATA_DIR, help="directory for generated data")
+    parser.add_argument("--compare", type=Path, help="baselines to report regressions against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="factor by which time or memory may exceed the baseline")
+    parser.add_argument("--save", type=Path, help="write the results as new baselines, keeping other scales")
+    args = parser.parse_args(argv)
+    warnings.filterwarnings("ignore", message="Consolidated metadata")
+
+    results = {}
+    for scale in args.scale or ["1mb"]:
+        data_dir = args.data_dir / scale
+        for case in make_cases(SCALES[scale], args.formats or list(FORMATS)):
+            name = f"{scale}/{case.name}"
+            if not fnmatch(name, args.select):
+                continue
+            results[name] = run_case(case, data_dir, args.repeat)
+            print(f"{name:<72} {results[name]['seconds']:>9.4f} s {results[name]['peak_mb']:>9.1f} MB", flush=True)
+
+    status = 0
+    if args.compare is not None:
+        baselines = json.loads(args.compare.read_text())["results"]
+        regressions = find_regressions(results, baselines, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        status = 1 if regressions else 0
+    if args.save is not None:
+        saved = json.loads(args.save.read_text())["results"] if args.save.exists() else {}
+        saved.update(results)
+        args.save.write_text(json.dumps(dict(environment=environment(), results=dict(sorted(saved.items()))),
+                                        indent=1) + "\n")
+    return status
+
+
+def _noise(metric: str) -> float:
+    return 0.005 if metric == "seconds" else 1.0
+
+
+def _yeoda_metadata(i: int) -> str:
+    return f"2018-09-12 12:{i % 60:02d}:00;20220101T{i % 24:02d}5959;ae2df{i % 100:02d};v1.0.{i % 10};band {i}"
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
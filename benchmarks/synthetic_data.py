@@ -0,0 +1,131 @@
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import rasterio
+import xarray as xr
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+try:
+    import dask.array as da
+except ImportError:  # pragma: no cover
+    da = None
+
+SCALES = {
+    "1mb": 1 << 20,
+    "64mb": 64 << 20,
+    "1gb": 1 << 30,
+    "4gb": 4 << 30,
+}
+PERTURBED_PIXELS = 16
+CRS = "EPSG:27704"
+PIXEL_SIZE = 20.0
+TAGS = dict(creator="benchmarks", creation_datetime="2024-01-01 00:00:00", processing_software="{'gdal': '3.6'}")
+
+
+@dataclass(frozen=True)
+class RasterSpec:
+    """
+    Describes one synthetic raster. Its side length is chosen so all bands together take about `n_bytes`
+    uncompressed. `block_size` is the tile or chunk size; None means a striped GeoTIFF and chunks of whole rows
+    in datasets.
+    """
+    n_bytes: int
+    bands: int = 1
+    dtype: str = "float32"
+    compress: Optional[str] = None
+    block_size: Optional[int] = 256
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        side = math.isqrt(self.n_bytes // (self.bands * np.dtype(self.dtype).itemsize))
+        side = max(side // 16 * 16, 16)
+        return self.bands, side, side
+
+    @property
+    def name(self) -> str:
+        layout = f"tiled{self.block_size}" if self.block_size else "striped"
+        return f"{self.bands}b-{self.dtype}-{self.compress or 'raw'}-{layout}"
+
+    @property
+    def chunks(self) -> Tuple[int, int, int]:
+        _, height, width = self.shape
+        block_size = self.block_size or 256
+        return 1, min(block_size, height), (min(block_size, width) if self.block_size else width)
+
+
+def synthetic_values(spec: RasterSpec, row_off: int, col_off: int, height: int, width: int,
+                     perturbed: bool = False, bands: Optional[range] = None) -> np.ndarray:
+    """
+    Smooth, deterministic values of a window which compress like typical geo data. Perturbed rasters differ by
+    one in the top left `PERTURBED_PIXELS` square of every band.
+    """
+    rows = np.arange(row_off, row_off + height, dtype=np.float64)[:, np.newaxis]
+    cols = np.arange(col_off, col_off + width, dtype=np.float64)[np.newaxis, :]
+    bands = np.array(bands or range(spec.bands), dtype=np.float64)[:, np.newaxis, np.newaxis]
+    values = 50 * (np.sin(rows / 97) + np.cos(cols / 89)) + 100 + 10 * bands + (rows * cols) % 7
+    if perturbed:
+        values[:, :max(PERTURBED_PIXELS - row_off, 0), :max(PERTURBED_PIXELS - col_off, 0)] += 1
+    return values.astype(spec.dtype)
+
+
+def write_geo_tif(spec: RasterSpec, file_path: Path, perturbed: bool = False) -> Path:
+    bands, height, width = spec.shape
+    profile = dict(driver="GTiff", count=bands, height=height, width=width, dtype=spec.dtype, crs=CRS,
+                   transform=from_origin(4_800_000, 1_800_000, PIXEL_SIZE, PIXEL_SIZE))
+    if spec.compress:
+        profile["compress"] = spec.compress
+    if spec.block_size:
+        profile.update(tiled=True, blockxsize=spec.block_size, blockysize=spec.block_size)
+    if spec.n_bytes > (2 << 30):
+        profile["BIGTIFF"] = "YES"
+    rows_per_write = spec.block_size or 256
+    with rasterio.open(file_path, "w", **profile) as rds:
+        rds.update_tags(**TAGS)
+        for row_off in range(0, height, rows_per_write):
+            window = Window(0, row_off, width, min(rows_per_write, height - row_off))
+            rds.write(synthetic_values(spec, row_off, 0, window.height, width, perturbed), window=window)
+    return file_path
+
+
+def make_dataset(spec: RasterSpec, perturbed: bool = False) -> xr.Dataset:
+    bands, height, width = spec.shape
+    if da is not None:
+        values = da.map_blocks(_synthetic_block, spec, perturbed, dtype=spec.dtype,
+                               chunks=da.core.normalize_chunks(spec.chunks, spec.shape))
+    else:
+        values = synthetic_values(spec, 0, 0, height, width, perturbed)
+    coords = dict(band=np.arange(1, bands + 1),
+                  y=1_800_000 - PIXEL_SIZE * (np.arange(height) + 0.5),
+                  x=4_800_000 + PIXEL_SIZE * (np.arange(width) + 0.5))
+    return xr.Dataset(dict(values=(("band", "y", "x"), values)), coords=coords, attrs=TAGS)
+
+
+def write_geo_zarr(spec: RasterSpec, store_path: Path, perturbed: bool = False) -> Path:
+    ds = make_dataset(spec, perturbed)
+    encoding = dict(values=dict(chunks=spec.chunks))
+    if not spec.compress:
+        encoding["values"]["compressors" if _zarr_major_version() >= 3 else "compressor"] = None
+    ds.to_zarr(store_path, encoding=encoding, mode="w")
+    return store_path
+
+
+def write_geo_nc(spec: RasterSpec, file_path: Path, perturbed: bool = False) -> Path:
+    ds = make_dataset(spec, perturbed)
+    encoding = dict(values=dict(chunksizes=spec.chunks, zlib=bool(spec.compress)))
+    ds.to_netcdf(file_path, encoding=encoding)
+    return file_path
+
+
+def _zarr_major_version() -> int:
+    import zarr
+    return int(zarr.__version__.split(".")[0])
+
+
+def _synthetic_block(spec: RasterSpec, perturbed: bool, block_info=None) -> np.ndarray:
+    (band_start, band_stop), (row_start, row_stop), (col_start, col_stop) = block_info[None]["array-location"]
+    return synthetic_values(spec, row_start, col_start, row_stop - row_start, col_stop - col_start, perturbed,
+                            range(band_start, band_stop))
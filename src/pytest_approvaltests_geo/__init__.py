@@ -1,35 +1,82 @@
+"""
+The pytest plugin of pytest-approvaltests-geo. It is loaded by every pytest run, so it registers its hooks, options
+and fixtures without importing GDAL, xarray or numpy. The verification functions live in `verify` and are imported
+on first use, also when accessed as attributes of this package.
+"""
+from importlib import import_module
 from pathlib import Path
-from typing import Optional, Union
+from typing import Optional, TYPE_CHECKING
 
 import pytest
-import rasterio
-from approval_utilities.utilities.exceptions.exception_collector import gather_all_exceptions_and_throw
-from approvaltests import verify_with_namer_and_writer, ExistingFileWriter, ScenarioNamer
-from approvaltests.namer import NamerBase
-from xarray import DataArray
 
 from pytest_approvaltests_geo._version import __version__
-from pytest_approvaltests_geo.comparators.compare_geo_ncs import CompareGeoNcs
-from pytest_approvaltests_geo.comparators.compare_geo_tiffs import CompareGeoTiffs
-from pytest_approvaltests_geo.comparators.compare_geo_zarrs import CompareGeoZarrs
-from pytest_approvaltests_geo.existing_dir_writer import ExistingDirWriter
-from pytest_approvaltests_geo.geo_options import GeoOptions
-from pytest_approvaltests_geo.namer.stack_frame_namer_with_external_data_dir import StackFrameNamerWithExternalDataDir
-from pytest_approvaltests_geo.reporters.report_geo_ncs import ReportGeoNcs
-from pytest_approvaltests_geo.reporters.report_geo_tiffs import ReportGeoTiffs
-from pytest_approvaltests_geo.reporters.report_geo_zarrs import ReportGeoZarrs
-from pytest_approvaltests_geo.scrubbers import RecursiveScrubber
+from pytest_approvaltests_geo.remote_data import BlockCache, DEFAULT_CACHE_BYTES, \
+    DEFAULT_CACHE_DIRECTORY, artifact_path, set_block_cache
 
-APPROVAL_TEST_GEO_DATA_ROOT_OPTION = "--approval-test-geo-data-root"
+if TYPE_CHECKING:  # pragma: no cover
+    from xarray import DataArray, Dataset
+    from pytest_approvaltests_geo.geo_options import GeoOptions
+    from pytest_approvaltests_geo.verify import TifFile, PathConvertible
 
-PathConvertible = Union[Path, str]
+APPROVAL_TEST_GEO_DATA_ROOT_OPTION = "--approval-test-geo-data-root"
+APPROVAL_TEST_GEO_DURATIONS_OPTION = "--approval-test-geo-durations"
+APPROVAL_TEST_GEO_PROFILE_LOG_OPTION = "--approval-test-geo-profile-log"
+APPROVAL_TEST_GEO_CACHE_DIR_OPTION = "--approval-test-geo-cache-dir"
+APPROVAL_TEST_GEO_CACHE_SIZE_OPTION = "--approval-test-geo-cache-size"
+APPROVAL_TEST_GEO_SHARED_ARRAYS_SIZE_OPTION = "--approval-test-geo-shared-arrays-size"
+APPROVAL_TEST_GEO_SHARED_ARRAYS_DIR_OPTION = "--approval-test-geo-shared-arrays-dir"
+_SHARED_ARRAYS_WORKER_INPUT = "approval_test_geo_shared_arrays_dir"
+_VERIFICATION_RECORDS_WORKER_OUTPUT = "approval_test_geo_verification_records"
+
+_LAZY_ATTRIBUTES = {
+    **{name: "pytest_approvaltests_geo.verify" for name in [
+        "PathConvertible", "TifFile", "geo_data_namer_factory", "verify_geo_tif", "verify_geo_tif_with_namer",
+        "verify_raster_as_geo_tif", "verify_geo_zarr", "verify_geo_nc", "verify_geo_dataset",
+        "verify_data_frame_using"]},
+    "GeoOptions": "pytest_approvaltests_geo.geo_options",
+    "RecursiveScrubber": "pytest_approvaltests_geo.scrubbers",
+    "CompareGeoTiffs": "pytest_approvaltests_geo.comparators.compare_geo_tiffs",
+    "CompareGeoNcs": "pytest_approvaltests_geo.comparators.compare_geo_ncs",
+    "CompareGeoZarrs": "pytest_approvaltests_geo.comparators.compare_geo_zarrs",
+    "ReportGeoTiffs": "pytest_approvaltests_geo.reporters.report_geo_tiffs",
+    "ReportGeoNcs": "pytest_approvaltests_geo.reporters.report_geo_ncs",
+    "ReportGeoZarrs": "pytest_approvaltests_geo.reporters.report_geo_zarrs",
+}
+
+
+def __getattr__(name: str):
+    # not listed in __dir__, as pytest would otherwise import all of them while it collects the fixtures
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
 
 
 def pytest_addoption(parser):
     group = parser.getgroup('pytest-approvaltests-geo')
     group.addoption(APPROVAL_TEST_GEO_DATA_ROOT_OPTION,
                     default=None,
-                    help="specify local approval test data root")
+                    help="specify approval test data root, a local path or an fsspec URL like s3://bucket/data")
+    group.addoption(APPROVAL_TEST_GEO_DURATIONS_OPTION,
+                    type=int, default=None, metavar="N",
+                    help="show a breakdown of the N slowest geo verifications (N=0 for all)")
+    group.addoption(APPROVAL_TEST_GEO_PROFILE_LOG_OPTION,
+                    default=None, metavar="PATH",
+                    help="append a JSON line with the breakdown of every geo verification to PATH")
+    group.addoption(APPROVAL_TEST_GEO_CACHE_DIR_OPTION,
+                    default=None, metavar="PATH",
+                    help="directory of the persistent block cache of a remote approval test data root")
+    group.addoption(APPROVAL_TEST_GEO_CACHE_SIZE_OPTION,
+                    type=int, default=None, metavar="MB",
+                    help="size of the block cache of a remote approval test data root in megabytes")
+    group.addoption(APPROVAL_TEST_GEO_SHARED_ARRAYS_SIZE_OPTION,
+                    type=int, default=None, metavar="MB",
+                    help="share decoded approved arrays of up to MB megabytes between processes, e.g. xdist workers")
+    group.addoption(APPROVAL_TEST_GEO_SHARED_ARRAYS_DIR_OPTION,
+                    default=None, metavar="PATH",
+                    help="keep the shared decoded approved arrays in PATH instead of a directory removed after the "
+                         "run")
 
     parser.addini('approvaltests_geo_data_root',
                   'Path to your approval test geo data root containing your input and approved files', type='string')
@@ -42,14 +89,105 @@ def pytest_addoption(parser):
 def get_approval_root(config):
     custom_root = config.option.approval_test_geo_data_root
     if custom_root is not None:
-        return Path(custom_root)
+        return artifact_path(custom_root)
 
     root = config.getini('approvaltests_geo_data_root')
     if root:
-        return Path(root)
+        return artifact_path(root)
     return None
 
 
+_verification_profile_key = pytest.StashKey["VerificationProfile"]()
+_shared_array_cache_key = pytest.StashKey["SharedArrayCache"]()
+
+
+def pytest_configure(config):
+    cache_dir = config.getoption('approval_test_geo_cache_dir', None)
+    cache_size = config.getoption('approval_test_geo_cache_size', None)
+    if cache_dir is not None or cache_size is not None:
+        set_block_cache(BlockCache(cache_dir or DEFAULT_CACHE_DIRECTORY,
+                                   DEFAULT_CACHE_BYTES if cache_size is None else cache_size * 2 ** 20))
+
+    shared_arrays_size = config.getoption('approval_test_geo_shared_arrays_size', None)
+    if shared_arrays_size is not None:
+        _configure_shared_arrays(config, shared_arrays_size * 2 ** 20)
+
+    durations = config.getoption('approval_test_geo_durations', None)
+    log_path = config.getoption('approval_test_geo_profile_log', None)
+    if durations is None and log_path is None:
+        return
+    from pytest_approvaltests_geo.instrumentation import VerificationProfile, add_verification_listener
+    profile = VerificationProfile(log_path)
+    add_verification_listener(profile)
+    config.stash[_verification_profile_key] = profile
+
+
+def _configure_shared_arrays(config, max_bytes: int) -> None:
+    from pytest_approvaltests_geo.shared_arrays import SharedArrayCache, set_shared_array_cache, \
+        default_shared_array_directory
+    worker_input = getattr(config, 'workerinput', {})
+    directory = worker_input.get(_SHARED_ARRAYS_WORKER_INPUT) or \
+        config.getoption('approval_test_geo_shared_arrays_dir', None)
+    cache = SharedArrayCache(directory or default_shared_array_directory(), max_bytes)
+    set_shared_array_cache(cache)
+    if directory is None:
+        config.stash[_shared_array_cache_key] = cache
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    """Lets all pytest-xdist workers attach to the shared decoded arrays of the controller."""
+    from pytest_approvaltests_geo.shared_arrays import get_shared_array_cache
+    cache = get_shared_array_cache()
+    if cache is not None:
+        node.workerinput[_SHARED_ARRAYS_WORKER_INPUT] = str(cache.directory)
+
+
+def pytest_sessionfinish(session):
+    """Hands the verification records of a pytest-xdist worker to the controller for its summary."""
+    profile = session.config.stash.get(_verification_profile_key, None)
+    if profile is not None and hasattr(session.config, 'workeroutput'):
+        from dataclasses import asdict
+        session.config.workeroutput[_VERIFICATION_RECORDS_WORKER_OUTPUT] = [asdict(r) for r in profile.records]
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    profile = node.config.stash.get(_verification_profile_key, None)
+    records = getattr(node, 'workeroutput', {}).get(_VERIFICATION_RECORDS_WORKER_OUTPUT)
+    if profile is not None and records:
+        from pytest_approvaltests_geo.instrumentation import VerificationRecord
+        profile.add_forwarded([VerificationRecord(**record) for record in records])
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    profile = config.stash.get(_verification_profile_key, None)
+    durations = config.getoption('approval_test_geo_durations', None)
+    if profile is None or durations is None:
+        return
+    from pytest_approvaltests_geo.instrumentation import format_record
+    terminalreporter.write_sep("=", f"slowest {durations or 'all'} geo verifications")
+    for record in profile.slowest(durations):
+        for line in format_record(record):
+            terminalreporter.write_line(line)
+
+
+def pytest_unconfigure(config):
+    shared_arrays = config.stash.get(_shared_array_cache_key, None)
+    if shared_arrays is not None:
+        from pytest_approvaltests_geo.shared_arrays import set_shared_array_cache
+        set_shared_array_cache(None)
+        shared_arrays.close()
+        del config.stash[_shared_array_cache_key]
+
+    profile = config.stash.get(_verification_profile_key, None)
+    if profile is not None:
+        from pytest_approvaltests_geo.instrumentation import remove_verification_listener
+        remove_verification_listener(profile)
+        profile.close()
+        del config.stash[_verification_profile_key]
+
+
 def pytest_collection_modifyitems(config, items):
     approval_root = get_approval_root(config)
     if approval_root:
@@ -67,11 +205,11 @@ def pytest_collection_modifyitems(config, items):
 def approval_test_geo_data_root(request):
     custom_root = request.config.option.approval_test_geo_data_root
     if custom_root is not None:
-        return Path(custom_root)
+        return artifact_path(custom_root)
 
     root = request.config.getini('approvaltests_geo_data_root')
     if root:
-        return Path(root)
+        return artifact_path(root)
     return None
 
 
@@ -89,174 +227,95 @@ def approved_geo_directory(approval_test_geo_data_root, request):
     return None
 
 
-def geo_data_namer_factory(approved_geo_directory: Optional[Path] = None):
-    if approved_geo_directory is not None:
-        return lambda: StackFrameNamerWithExternalDataDir(approved_geo_directory.as_posix())
-    else:
-        from approvaltests.namer.default_name import get_default_namer
-        return get_default_namer
-
-
 @pytest.fixture(scope='module', name='geo_data_namer_factory')
 def geo_data_namer_factory_fixture(approved_geo_directory):
-    if approved_geo_directory is not None:
-        return lambda: StackFrameNamerWithExternalDataDir(approved_geo_directory.as_posix())
-    else:
-        from approvaltests.namer.default_name import get_default_namer
-        return get_default_namer
+    from pytest_approvaltests_geo.verify import geo_data_namer_factory
+    return geo_data_namer_factory(approved_geo_directory)
 
 
 @pytest.fixture(scope='module')
 def name_geo_scenario(approved_geo_directory):
     def scenario_namer(*scenario_names):
+        from approvaltests import ScenarioNamer
+        from pytest_approvaltests_geo.verify import geo_data_namer_factory
         return ScenarioNamer(geo_data_namer_factory(approved_geo_directory)(), *scenario_names)
 
     return scenario_namer
 
 
-def verify_geo_tif(tile_file: PathConvertible,
-                   *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
-                   options: Optional[GeoOptions] = None):
-    geo_data_namer = options.namer if options else None
-    geo_approved_dir = options.approved_directory if options else None
-    geo_data_namer = geo_data_namer or geo_data_namer_factory(geo_approved_dir)()
-    geo_data_namer.set_extension(Path(tile_file).suffix)
-    verify_geo_tif_with_namer(tile_file, geo_data_namer, options=options)
+def _with_approved_directory(options: Optional["GeoOptions"], approved_geo_directory: Optional[Path]) -> "GeoOptions":
+    from pytest_approvaltests_geo.geo_options import GeoOptions
+    return (options or GeoOptions()).with_approved_directory(approved_geo_directory)
 
 
 @pytest.fixture(scope='module', name='verify_geo_tif')
 def verify_geo_tif_fixture(approved_geo_directory):
-    def _verify_fn(tile_file: PathConvertible,
+    def _verify_fn(tile_file: "TifFile",
                    *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
-                   options: Optional[GeoOptions] = None):
-        options = options or GeoOptions()
-        options = options.with_approved_directory(approved_geo_directory)
-        verify_geo_tif(tile_file, options=options)
+                   options: Optional["GeoOptions"] = None):
+        from pytest_approvaltests_geo.verify import verify_geo_tif
+        verify_geo_tif(tile_file, options=_with_approved_directory(options, approved_geo_directory))
 
     return _verify_fn
 
 
-def verify_geo_tif_with_namer(tile_file: PathConvertible,
-                              namer: NamerBase,
-                              *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
-                              options: Optional[GeoOptions] = None):
-    options = options or GeoOptions()
-    tif_comparator = CompareGeoTiffs(options.scrub_tags, options.tolerance)
-    tif_reporter = ReportGeoTiffs(options.scrub_tags, options.tolerance)
-    if options.has_scenario_by_tags():
-        with rasterio.open(tile_file) as rds:
-            namer = options.wrap_namer_in_tags_scenario(namer, rds.tags())
-    options = options.with_comparator(tif_comparator)
-    options = options.with_reporter(tif_reporter)
-    verify_with_namer_and_writer(
-        namer=namer,
-        writer=ExistingFileWriter(tile_file, options),
-        options=options)
-
-
 @pytest.fixture(scope='module', name='verify_geo_tif_with_namer')
 def verify_geo_tif_with_namer_fixture():
+    from pytest_approvaltests_geo.verify import verify_geo_tif_with_namer
     return verify_geo_tif_with_namer
 
 
-def verify_raster_as_geo_tif(tile: DataArray, *, options: Optional[GeoOptions] = None):
-    options = options or GeoOptions()
-    tile_file = options.tmp_directory / "raster.tif"
-    options.tif_writer(tile_file, tile)
-    verify_geo_tif(tile_file, options=options)
-
-
 @pytest.fixture(scope='module', name='verify_raster_as_geo_tif')
 def verify_raster_as_geo_tif_fixture(tmp_path_factory, approved_geo_directory):
-    def _verify_fn(tile: DataArray,
+    def _verify_fn(tile: "DataArray",
                    *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
-                   options: Optional[GeoOptions] = None):
-        options = options or GeoOptions()
-        options = options.with_tmp_directory(tmp_path_factory.mktemp("raster_as_geo_tif")) \
-            .with_approved_directory(approved_geo_directory)
+                   options: Optional["GeoOptions"] = None):
+        from pytest_approvaltests_geo.verify import verify_raster_as_geo_tif
+        options = _with_approved_directory(options, approved_geo_directory)
+        if not options.raster_in_memory:
+            options = options.with_tmp_directory(tmp_path_factory.mktemp("raster_as_geo_tif"))
         verify_raster_as_geo_tif(tile, options=options)
 
     return _verify_fn
 
 
-def verify_geo_zarr(zarr_archive: PathConvertible,
-                    *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
-                    options: Optional[GeoOptions] = None):
-    options = options or GeoOptions()
-    geo_data_namer = options.namer if options else None
-    geo_approved_dir = options.approved_directory if options else None
-    geo_data_namer = geo_data_namer or geo_data_namer_factory(geo_approved_dir)()
-    geo_data_namer.set_extension(Path(zarr_archive).suffix)
-    zarr_comparator = CompareGeoZarrs(options.scrub_tags, options.scrub_coords, options.tolerance)
-    zarr_reporter = ReportGeoZarrs(options.scrub_tags, options.scrub_coords, options.tolerance)
-    options = options.with_comparator(zarr_comparator)
-    options = options.with_reporter(zarr_reporter)
-    verify_with_namer_and_writer(
-        namer=geo_data_namer,
-        writer=ExistingDirWriter(zarr_archive),
-        options=options)
-
-
 @pytest.fixture(scope='module', name='verify_geo_zarr')
 def verify_geo_zarr_fixture(approved_geo_directory):
-    def _verify_fn(zarr_archive: PathConvertible,
+    def _verify_fn(zarr_archive: "PathConvertible",
                    *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
-                   options: Optional[GeoOptions] = None):
-        options = options or GeoOptions()
-        options = options.with_approved_directory(approved_geo_directory)
-        verify_geo_zarr(zarr_archive, options=options)
+                   options: Optional["GeoOptions"] = None):
+        from pytest_approvaltests_geo.verify import verify_geo_zarr
+        verify_geo_zarr(zarr_archive, options=_with_approved_directory(options, approved_geo_directory))
 
     return _verify_fn
 
 
-def verify_geo_nc(nc_file: PathConvertible,
-                  *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
-                  options: Optional[GeoOptions] = None):
-    options = options or GeoOptions()
-    geo_data_namer = options.namer if options else None
-    geo_approved_dir = options.approved_directory if options else None
-    geo_data_namer = geo_data_namer or geo_data_namer_factory(geo_approved_dir)()
-    geo_data_namer.set_extension(Path(nc_file).suffix)
-    nc_comparator = CompareGeoNcs(options.scrub_tags, options.scrub_coords, options.tolerance)
-    nc_reporter = ReportGeoNcs(options.scrub_tags, options.scrub_coords, options.tolerance)
-    options = options.with_comparator(nc_comparator)
-    options = options.with_reporter(nc_reporter)
-    verify_with_namer_and_writer(
-        namer=geo_data_namer,
-        writer=ExistingFileWriter(nc_file, options),
-        options=options)
-
-
 @pytest.fixture(scope='module', name='verify_geo_nc')
 def verify_geo_nc_fixture(approved_geo_directory):
-    def _verify_fn(nc_file: PathConvertible,
+    def _verify_fn(nc_file: "PathConvertible",
                    *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
-                   options: Optional[GeoOptions] = None):
-        options = options or GeoOptions()
-        options = options.with_approved_directory(approved_geo_directory)
-        verify_geo_nc(nc_file, options=options)
+                   options: Optional["GeoOptions"] = None):
+        from pytest_approvaltests_geo.verify import verify_geo_nc
+        verify_geo_nc(nc_file, options=_with_approved_directory(options, approved_geo_directory))
 
     return _verify_fn
 
 
-def verify_data_frame_using(verify_fn, *columns, approved_geo_directory: Optional[Path] = None):
-    def _verify_data_frame(data_frame, *, options: Optional[GeoOptions] = None):
-        options = options or GeoOptions()
-        geo_approved_dir = options.approved_directory or approved_geo_directory
-        base_namer = options.namer or geo_data_namer_factory(geo_approved_dir)()
-
-        def _verify(pack):
-            _, row = pack
-            verify_fn(row['filepath'], options=GeoOptions.from_options(options.with_namer(
-                ScenarioNamer(base_namer, *tuple(row[c] for c in columns))
-            )))
+@pytest.fixture(scope='module', name='verify_geo_dataset')
+def verify_geo_dataset_fixture(approved_geo_directory):
+    def _verify_fn(dataset: "Dataset",
+                   format: str = "zarr",
+                   *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
+                   options: Optional["GeoOptions"] = None):
+        from pytest_approvaltests_geo.verify import verify_geo_dataset
+        verify_geo_dataset(dataset, format, options=_with_approved_directory(options, approved_geo_directory))
 
-        gather_all_exceptions_and_throw(data_frame.iterrows(), _verify)
+    return _verify_fn
 
-    return _verify_data_frame
 
 @pytest.fixture(name='verify_data_frame_using')
 def verify_data_frame_using_fixture(approved_geo_directory):
     def _make_verifier(verify_fn, *columns):
+        from pytest_approvaltests_geo.verify import verify_data_frame_using
         return verify_data_frame_using(verify_fn, *columns, approved_geo_directory=approved_geo_directory)
     return _make_verifier
@@ -0,0 +1,63 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from fsspec.spec import AbstractBufferedFile, AbstractFileSystem
+
+from pytest_approvaltests_geo.remote_data import BlockCache
+
+
+class BlockCachedFile(AbstractBufferedFile):
+    def __init__(self, fs: "BlockCachedFileSystem", path: str):
+        super().__init__(fs, path, mode="rb", block_size=fs.cache.block_size, cache_type="blockcache")
+        self._file_key = hashlib.sha256(json.dumps([fs.unstrip_protocol(path), self.details],
+                                                   sort_keys=True, default=str).encode()).hexdigest()
+
+    def _fetch_range(self, start: int, end: int) -> bytes:
+        block_size = self.fs.cache.block_size
+        first = start // block_size
+        blocks = [self.fs.cache.block(self._file_key, index, lambda index=index: self._fetch_block(index))
+                  for index in range(first, (end - 1) // block_size + 1)]
+        offset = start - first * block_size
+        return b"".join(blocks)[offset:offset + end - start]
+
+    def _fetch_block(self, index: int) -> bytes:
+        start = index * self.fs.cache.block_size
+        return self.fs.fs.cat_file(self.path, start, min(start + self.fs.cache.block_size, self.size))
+
+
+class BlockCachedFileSystem(AbstractFileSystem):
+    """
+    A read-only file system which reads the files of `fs` with range requests of whole blocks through a
+    `BlockCache`. Listings and file details are always requested from `fs`.
+    """
+    cachable = False
+
+    def __init__(self, fs: AbstractFileSystem, cache: BlockCache, **kwargs):
+        super().__init__(**kwargs)
+        self.fs = fs
+        self.cache = cache
+
+    def _strip_protocol(self, path: str) -> str:
+        return self.fs._strip_protocol(path)
+
+    def unstrip_protocol(self, name: str) -> str:
+        return self.fs.unstrip_protocol(name)
+
+    def info(self, path: str, **kwargs) -> Dict[str, Any]:
+        return self.fs.info(path, **kwargs)
+
+    def ls(self, path: str, detail: bool = True, **kwargs):
+        return self.fs.ls(path, detail=detail, **kwargs)
+
+    def cat_file(self, path: str, start: Optional[int] = None, end: Optional[int] = None, **kwargs) -> bytes:
+        with self._open(path) as f:
+            start = 0 if start is None else start if start >= 0 else max(f.size + start, 0)
+            end = f.size if end is None else end if end >= 0 else f.size + end
+            f.seek(start)
+            return f.read(max(end - start, 0))
+
+    def _open(self, path: str, mode: str = "rb", **kwargs) -> BlockCachedFile:
+        if mode != "rb":
+            raise PermissionError(f"remote approved data is read-only, cannot open {path} with mode {mode}")
+        return BlockCachedFile(self, self._strip_protocol(path))
@@ -4,15 +4,22 @@ from pathlib import Path
 from approvaltests.core import Comparator
 
 from pytest_approvaltests_geo.differs.differ_of_geo_ncs import DifferOfGeoNcs
+from pytest_approvaltests_geo.remote_data import artifact_path
 
 
 class CompareGeoNcs(Comparator, DifferOfGeoNcs):
 
     def compare(self, received_path: str, approved_path: str) -> bool:
         received_path = Path(received_path)
-        approved_path = Path(approved_path)
+        approved_path = artifact_path(approved_path)
         if not received_path.exists() or not approved_path.exists():
             return False
+        if self.is_rejected_by_approved_manifest(received_path, approved_path):
+            return False
 
-        diffs = self.diffs(received_path, approved_path)
-        return len(diffs) == 0
+        is_identical = self.are_byte_identical(received_path, approved_path) or \
+            self.shared_is_equal(received_path, approved_path)
+        if is_identical:
+            self.update_approved_manifest(approved_path)
+            self.release_shared(received_path, approved_path)
+        return is_identical
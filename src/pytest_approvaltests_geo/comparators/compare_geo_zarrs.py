@@ -4,18 +4,25 @@ from pathlib import Path
 from approvaltests.core import Comparator
 
 from pytest_approvaltests_geo.differs.differ_of_geo_zarrs import DifferOfGeoZarrs
+from pytest_approvaltests_geo.remote_data import artifact_path
 
 
 class CompareGeoZarrs(Comparator, DifferOfGeoZarrs):
 
     def compare(self, received_path: str, approved_path: str) -> bool:
         received_path = Path(received_path)
-        approved_path = Path(approved_path)
+        approved_path = artifact_path(approved_path)
         if not received_path.exists() or not approved_path.exists():
             return False
+        if self.is_rejected_by_approved_manifest(received_path, approved_path):
+            return False
 
-        is_identical = len(self.diffs(received_path, approved_path)) == 0
+        is_identical = self.are_byte_identical(received_path, approved_path) or \
+            self.shared_is_equal(received_path, approved_path)
         if is_identical:
-            shutil.rmtree(received_path)
-            received_path.touch()  # TODO: fix so approval tests has something to delete
+            self.update_approved_manifest(approved_path)
+            self.release_shared(received_path, approved_path)
+            if received_path.is_dir():
+                shutil.rmtree(received_path)
+                received_path.touch()  # TODO: fix so approval tests has something to delete
         return is_identical
@@ -0,0 +1,126 @@
+import shutil
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+from approvaltests import Writer
+from rasterio.io import MemoryFile
+from xarray import Dataset
+
+from pytest_approvaltests_geo.differs.diff_session import DiffSession
+from pytest_approvaltests_geo.digests import bytes_digest, file_digest
+
+DATASET_FORMATS = ("zarr", "nc")
+
+
+class DeferredArtifact(ABC):
+    """
+    A received artifact which is kept outside of the file system during its verification. Differs read it from
+    `source`, and it is only written to its received path if the verification does not succeed.
+    """
+
+    @property
+    @abstractmethod
+    def source(self) -> Any:
+        pass
+
+    def is_byte_identical(self, approved_path: Path) -> bool:
+        return False
+
+    def digest(self) -> Optional[str]:
+        return None
+
+    @abstractmethod
+    def write_to(self, received_path: Path) -> None:
+        pass
+
+
+class MemoryFileArtifact(DeferredArtifact):
+    def __init__(self, memory_file: MemoryFile):
+        self._memory_file = memory_file
+
+    @property
+    def source(self) -> str:
+        return self._memory_file.name
+
+    def is_byte_identical(self, approved_path: Path) -> bool:
+        buffer = self._memory_file.getbuffer()
+        return approved_path.is_file() and approved_path.stat().st_size == len(buffer) and \
+            bytes_digest(buffer) == file_digest(approved_path)
+
+    def digest(self) -> str:
+        return bytes_digest(self._memory_file.getbuffer())
+
+    def write_to(self, received_path: Path) -> None:
+        received_path.write_bytes(self._memory_file.getbuffer())
+
+
+class DatasetArtifact(DeferredArtifact):
+    def __init__(self, dataset: Dataset, dataset_format: str):
+        self._dataset = dataset
+        self._format = dataset_format
+
+    @property
+    def source(self) -> Dataset:
+        return self._dataset
+
+    def write_to(self, received_path: Path) -> None:
+        write_dataset(self._dataset, received_path, self._format)
+
+
+def write_dataset(dataset: Dataset, file_path: Path, dataset_format: str) -> None:
+    if dataset_format not in DATASET_FORMATS:
+        raise ValueError(f"unknown dataset format {dataset_format}, expected one of {DATASET_FORMATS}")
+    if dataset_format == "zarr":
+        if file_path.is_dir():
+            shutil.rmtree(file_path)
+        elif file_path.exists():
+            file_path.unlink()
+        dataset.to_zarr(file_path)
+    else:
+        dataset.to_netcdf(file_path)
+
+
+def has_value_changing_encoding(dataset: Dataset) -> bool:
+    """
+    Tells whether writing and reading back the dataset changes its values, e.g. because variables are packed
+    with a scale factor or integer fill values are masked as NaN. Such a dataset can not be compared as it is.
+    """
+    for variable in dataset.variables.values():
+        encoding = variable.encoding
+        if 'scale_factor' in encoding or 'add_offset' in encoding:
+            return True
+        if 'dtype' in encoding and np.dtype(encoding['dtype']) != variable.dtype and variable.dtype.kind not in 'MmOSU':
+            return True
+        has_fill_value = any(encoding.get(k) is not None for k in ['_FillValue', 'missing_value']) or \
+            any(k in variable.attrs for k in ['_FillValue', 'missing_value'])
+        if has_fill_value and variable.dtype.kind in 'biu':
+            return True
+    return False
+
+
+class DatasetWriter(Writer):
+    def __init__(self, dataset: Dataset, dataset_format: str) -> None:
+        self.dataset = dataset
+        self.dataset_format = dataset_format
+
+    def write_received_file(self, received_file: str) -> str:
+        write_dataset(self.dataset, Path(received_file), self.dataset_format)
+        return received_file
+
+
+class DeferredReceivedWriter(Writer):
+    """
+    Registers the artifact with the session instead of writing it. Only an empty placeholder is created at the
+    received path, which approvaltests removes after a successful comparison.
+    """
+
+    def __init__(self, session: DiffSession, artifact: DeferredArtifact) -> None:
+        self.session = session
+        self.artifact = artifact
+
+    def write_received_file(self, received_file: str) -> str:
+        Path(received_file).touch()
+        self.session.defer(received_file, self.artifact)
+        return received_file
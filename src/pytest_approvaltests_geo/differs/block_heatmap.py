@@ -0,0 +1,90 @@
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Tuple, Iterator, Optional, Any, Hashable, Iterable
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+
+from pytest_approvaltests_geo.differs.difference import PixelDiffStatsAccumulator
+
+DEFAULT_HEATMAP_BLOCK_SIZE = 256
+HEATMAP_BANDS = ("max_abs_diff", "violation_fraction", "nan_delta")
+
+
+@dataclass
+class BlockReduction:
+    origin: Tuple[int, ...]
+    violations: int
+    pixels: int
+    max_abs_diff: float
+    nan_delta: int
+
+    @classmethod
+    def of(cls, origin: Iterable[int], violations: int, stats: PixelDiffStatsAccumulator,
+           reverse_nans: bool = False) -> "BlockReduction":
+        return cls(tuple(origin), violations, stats.size, np.nan if stats.max is None else float(stats.max),
+                   -stats.nans if reverse_nans else stats.nans)
+
+
+class BlockHeatmap:
+    """
+    A summary raster of the differences of a `shape` raster with one pixel per block of `block_shape` pixels. Its
+    bands are the maximum absolute difference, the fraction of pixels violating the tolerance and the number of NaNs
+    in the received minus those in the approved pixels of each block. Reductions of parts of the same block, like
+    those of other bands or of windows crossing the block, are combined.
+    """
+
+    def __init__(self, shape: Tuple[int, int], block_shape: Tuple[int, int]):
+        self.block_shape = block_shape
+        grid = tuple(max(math.ceil(n / b), 1) for n, b in zip(shape, block_shape))
+        self.max_abs_diff = np.full(grid, np.nan)
+        self.violations = np.zeros(grid, np.int64)
+        self.pixels = np.zeros(grid, np.int64)
+        self.nan_delta = np.zeros(grid, np.int64)
+
+    def add(self, reduction: BlockReduction, y_axis: int = 0, x_axis: int = 1) -> "BlockHeatmap":
+        cell = reduction.origin[y_axis] // self.block_shape[0], reduction.origin[x_axis] // self.block_shape[1]
+        self.max_abs_diff[cell] = np.fmax(self.max_abs_diff[cell], reduction.max_abs_diff)
+        self.violations[cell] += reduction.violations
+        self.pixels[cell] += reduction.pixels
+        self.nan_delta[cell] += reduction.nan_delta
+        return self
+
+    def bands(self) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            violation_fraction = np.where(self.pixels > 0, self.violations / self.pixels, np.nan)
+        return np.stack([self.max_abs_diff, violation_fraction, self.nan_delta]).astype(np.float32)
+
+    def write(self, path: Path, transform: Affine, crs: Optional[Any] = None) -> None:
+        """Writes the heatmap as a GeoTIFF whose pixels cover the blocks of the raster with the given `transform`."""
+        bands = self.bands()
+        with rasterio.open(path, 'w', driver='GTiff', count=bands.shape[0], height=bands.shape[1],
+                           width=bands.shape[2], dtype=bands.dtype, nodata=np.nan, crs=crs,
+                           transform=transform * Affine.scale(self.block_shape[1], self.block_shape[0])) as rds:
+            rds.write(bands)
+            for band, name in enumerate(HEATMAP_BANDS, start=1):
+                rds.set_band_description(band, name)
+
+
+def iter_block_regions(y: int, x: int, height: int, width: int, block_shape: Tuple[int, int]) \
+        -> Iterator[Tuple[int, int, slice, slice]]:
+    """
+    Splits the window of `height` and `width` pixels at `y`, `x` along the borders of the blocks it overlaps. Yields
+    the position of every part together with its rows and columns relative to the window.
+    """
+    for part_y, rows in _block_parts(y, height, block_shape[0]):
+        for part_x, cols in _block_parts(x, width, block_shape[1]):
+            yield part_y, part_x, rows, cols
+
+
+def _block_parts(start: int, size: int, block_size: int) -> Iterator[Tuple[int, slice]]:
+    borders = [start] + list(range((start // block_size + 1) * block_size, start + size, block_size)) + [start + size]
+    for begin, end in zip(borders[:-1], borders[1:]):
+        yield begin, slice(begin - start, end - start)
+
+
+def block_heatmap_path(received_path: Path, name: Optional[Hashable] = None) -> Path:
+    stem = received_path.with_suffix("").name
+    return received_path.with_name(f"{stem}.heatmap.tif" if name is None else f"{stem}.{name}.heatmap.tif")
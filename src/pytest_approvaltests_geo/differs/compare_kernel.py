@@ -0,0 +1,132 @@
+from typing import Optional, Dict, Tuple, Sequence
+
+import numpy as np
+from numpy.typing import ArrayLike
+
+from pytest_approvaltests_geo.differs.difference import PixelDiffStatsAccumulator, STATS_CHUNK_SIZE, abs_diff, \
+    count_nans, WorstPixelsAccumulator
+from pytest_approvaltests_geo.float_utils import Tolerance, count_tolerance_violations
+
+KERNEL_CHUNK_SIZE = STATS_CHUNK_SIZE
+
+
+class CompareKernel:
+    """
+    Counts tolerance violations like `count_tolerance_violations` and optionally accumulates the pixel difference
+    statistics in the same pass. Pixels are processed in chunks of `chunk_size` with buffers which are allocated
+    once and reused, so no full-size temporaries are created and floats are compared in their own dtype.
+
+    The NaN difference of the statistics is the number of NaNs in the received pixels minus those in the approved
+    pixels, or the reverse for `reverse_nans`. The violating pixels with the largest differences can be collected
+    into a `WorstPixelsAccumulator` as well, indexed into the unflattened arrays shifted by `origin`.
+
+    >>> stats = PixelDiffStatsAccumulator()
+    >>> CompareKernel(Tolerance(abs=0.5)).compare(np.array([1., 2., np.nan]), np.array([1., 3., np.nan]), stats)
+    1
+    >>> stats.stats()
+    Stats(min=0.0, max=1.0, mean=0.5, median=0.5, nans=0)
+    """
+
+    def __init__(self, tolerance: Tolerance, chunk_size: int = KERNEL_CHUNK_SIZE, reverse_nans: bool = False):
+        self._rtol = tolerance.rel
+        self._atol = tolerance.abs
+        self._tolerance = tolerance
+        self._chunk_size = chunk_size
+        self._reverse_nans = reverse_nans
+        self._buffers: Dict[Tuple[str, np.dtype], np.ndarray] = {}
+
+    def count_violations(self, received: ArrayLike, approved: ArrayLike) -> int:
+        return self.compare(received, approved)
+
+    def compare(self, received: ArrayLike, approved: ArrayLike,
+                stats: Optional[PixelDiffStatsAccumulator] = None, worst: Optional[WorstPixelsAccumulator] = None,
+                origin: Optional[Sequence[int]] = None) -> int:
+        received = np.asarray(received)
+        shape = received.shape
+        received = received.reshape(-1)
+        approved = np.asarray(approved).reshape(-1)
+        if any(a.dtype.kind not in 'biuf' for a in [received, approved]):
+            return self._compare_unfused(received, approved, stats)
+        violations = 0
+        with np.errstate(invalid='ignore'):
+            for start in range(0, received.size, self._chunk_size):
+                received_chunk = received[start:start + self._chunk_size]
+                approved_chunk = approved[start:start + self._chunk_size]
+                chunk_violations = self._compare_chunk(received_chunk, approved_chunk, stats)
+                if worst is not None and chunk_violations > 0:
+                    self._add_worst(worst, received_chunk, approved_chunk, start, shape, origin)
+                violations += chunk_violations
+        return int(violations)
+
+    def _compare_chunk(self, received: np.ndarray, approved: np.ndarray,
+                       stats: Optional[PixelDiffStatsAccumulator]) -> int:
+        # same dtypes and order of operations as np.isclose, which casts approved to an inexact type first
+        tolerances = self._buffer('tolerances', np.result_type(approved.dtype, 1.0), received.size)
+        diffs = self._buffer('diffs', np.result_type(received.dtype, tolerances.dtype), received.size)
+        is_close = self._buffer('is_close', np.dtype(bool), received.size)
+        np.subtract(received, approved, out=diffs, dtype=diffs.dtype)
+        np.abs(diffs, out=diffs)
+        np.abs(approved, out=tolerances, dtype=tolerances.dtype)
+        tolerances *= self._rtol
+        tolerances += self._atol
+        np.less_equal(diffs, tolerances, out=is_close)
+        violations = is_close.size - np.count_nonzero(is_close)
+
+        is_inexact = diffs.dtype.kind == 'f'
+        if is_inexact and np.fmax.reduce(tolerances) == np.inf:
+            violations = count_tolerance_violations(received, approved, self._tolerance)
+        elif is_inexact and violations > 0:
+            np.logical_not(is_close, out=is_close)
+            received_far, approved_far = received[is_close], approved[is_close]
+            violations -= np.count_nonzero((received_far == approved_far) |
+                                           (np.isnan(received_far) & np.isnan(approved_far)))
+
+        if stats is not None:
+            if diffs.dtype == np.result_type(received.dtype, approved.dtype):
+                stats.add_abs_diffs(diffs, *self._nans(received, approved, diffs))
+            else:
+                stats.add_abs_diffs(abs_diff(received, approved), *self._nans(received, approved))
+        return violations
+
+    def _compare_unfused(self, received: np.ndarray, approved: np.ndarray,
+                         stats: Optional[PixelDiffStatsAccumulator]) -> int:
+        violations = 0
+        for start in range(0, received.size, self._chunk_size):
+            received_chunk = received[start:start + self._chunk_size]
+            approved_chunk = approved[start:start + self._chunk_size]
+            violations += count_tolerance_violations(received_chunk, approved_chunk, self._tolerance)
+            if stats is not None and received.dtype.kind in 'biufc' and approved.dtype.kind in 'biufc':
+                stats.add_abs_diffs(abs_diff(received_chunk, approved_chunk),
+                                    *self._nans(received_chunk, approved_chunk))
+        return violations
+
+    def _add_worst(self, worst: WorstPixelsAccumulator, received: np.ndarray, approved: np.ndarray, start: int,
+                   shape: Tuple[int, ...], origin: Optional[Sequence[int]]) -> None:
+        # the buffers still hold the absolute differences and tolerances of this chunk
+        tolerances = self._buffer('tolerances', np.result_type(approved.dtype, 1.0), received.size)
+        diffs = self._buffer('diffs', np.result_type(received.dtype, tolerances.dtype), received.size)
+        if diffs.dtype.kind == 'f' and np.fmax.reduce(tolerances) == np.inf:
+            far = ~np.isclose(received, approved, equal_nan=True, **self._tolerance.to_kwargs())
+        else:
+            far = ~(diffs <= tolerances)
+            if diffs.dtype.kind == 'f':
+                far &= ~((received == approved) | (np.isnan(received) & np.isnan(approved)))
+        positions = np.flatnonzero(far)
+        indices = np.stack(np.unravel_index(start + positions, shape), axis=-1) if shape else \
+            np.zeros((positions.size, 0), dtype=np.intp)
+        if origin is not None:
+            indices += np.asarray(origin, dtype=indices.dtype)
+        worst.add(indices, received[positions], approved[positions], diffs[positions])
+
+    def _nans(self, received: np.ndarray, approved: np.ndarray,
+              diffs: Optional[np.ndarray] = None) -> Tuple[int, int]:
+        if diffs is not None and not np.isnan(np.add.reduce(diffs)):
+            return 0, 0
+        nans = count_nans(received), count_nans(approved)
+        return (nans[1], nans[0]) if self._reverse_nans else nans
+
+    def _buffer(self, name: str, dtype: np.dtype, size: int) -> np.ndarray:
+        buffer = self._buffers.get((name, dtype))
+        if buffer is None or buffer.size < size:
+            buffer = self._buffers[(name, dtype)] = np.empty(size, dtype)
+        return buffer[:size]
@@ -0,0 +1,240 @@
+from abc import ABC, abstractmethod
+from contextlib import ExitStack, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Hashable, List, Optional, Sequence, Tuple, Union, \
+    TYPE_CHECKING
+
+from pytest_approvaltests_geo.differs.difference import Difference
+from pytest_approvaltests_geo.digests import artifact_digest, have_same_layout
+from pytest_approvaltests_geo.instrumentation import VerificationRecorder, WRITE_RECEIVED, DIGEST
+from pytest_approvaltests_geo.manifest import ApprovedManifest, load_manifest, save_manifest, stat_signature
+from pytest_approvaltests_geo.remote_data import RemotePath, artifact_path, is_remote
+
+if TYPE_CHECKING:
+    from pytest_approvaltests_geo.deferred_artifacts import DeferredArtifact
+
+SessionKey = Tuple[Path, Union[Path, RemotePath], Hashable]
+
+DEFAULT_MEMORY_LIMIT = 512 * 1024 ** 2
+OBSERVED_DIGEST = "digest"
+OBSERVED_STATS = "stats"
+
+
+@dataclass
+class DiffSessionEntry:
+    resources: ExitStack = field(default_factory=ExitStack)
+    artifacts: Any = None
+    diffs: Optional[Sequence[Difference]] = None
+
+
+class DiffSession:
+    """
+    Shares the opened artifacts and the calculated differences of one verification between its comparator and
+    reporter, so a failing comparison does not decode received and approved data a second time for the report.
+    Entries are keyed on the received path, the approved path and the options of the differ.
+
+    Received artifacts can also be deferred, i.e. kept outside of the file system behind a placeholder. When the
+    session is closed, every deferred artifact whose placeholder has not been removed by a successful
+    verification is written to its received path.
+
+    With a `VerificationRecorder` the session also records the phases of the verification, which ends when the
+    session is left.
+    """
+
+    def __init__(self, recorder: Optional[VerificationRecorder] = None):
+        self._entries: Dict[SessionKey, DiffSessionEntry] = {}
+        self._deferred: Dict[Path, "DeferredArtifact"] = {}
+        self.recorder = recorder
+
+    def phase(self, name: str) -> ContextManager:
+        return nullcontext() if self.recorder is None else self.recorder.phase(name)
+
+    def add_pixels(self, n: int) -> None:
+        if self.recorder is not None:
+            self.recorder.add_pixels(n)
+
+    def defer(self, received_path: Path, artifact: "DeferredArtifact") -> None:
+        self._deferred[Path(received_path)] = artifact
+
+    def deferred(self, received_path: Path) -> Optional["DeferredArtifact"]:
+        return self._deferred.get(Path(received_path))
+
+    def artifacts(self, differ: "SessionDiffer", received_path: Path, approved_path: Path) -> Any:
+        entry = self._entry(differ, received_path, approved_path)
+        if entry.artifacts is None:
+            entry.artifacts = differ.open_artifacts(received_path, approved_path, entry.resources)
+        return entry.artifacts
+
+    def diffs(self, differ: "SessionDiffer", received_path: Path, approved_path: Path) -> Sequence[Difference]:
+        entry = self._entry(differ, received_path, approved_path)
+        if entry.diffs is None:
+            entry.diffs = differ.diffs_of(self.artifacts(differ, received_path, approved_path))
+        return entry.diffs
+
+    def release(self, differ: "SessionDiffer", received_path: Path, approved_path: Path) -> None:
+        entry = self._entries.pop(self._key(differ, received_path, approved_path), None)
+        if entry is not None:
+            entry.resources.close()
+
+    def close(self) -> None:
+        while self._deferred:
+            received_path, artifact = self._deferred.popitem()
+            if received_path.exists():
+                with self.phase(WRITE_RECEIVED):
+                    artifact.write_to(received_path)
+        while self._entries:
+            _, entry = self._entries.popitem()
+            entry.resources.close()
+
+    def __enter__(self) -> "DiffSession":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+        if self.recorder is not None:
+            self.recorder.finish(passed=exc_type is None)
+
+    def _entry(self, differ: "SessionDiffer", received_path: Path, approved_path: Path) -> DiffSessionEntry:
+        return self._entries.setdefault(self._key(differ, received_path, approved_path), DiffSessionEntry())
+
+    @staticmethod
+    def _key(differ: "SessionDiffer", received_path: Path, approved_path: Path) -> SessionKey:
+        return Path(received_path), artifact_path(approved_path), differ.session_key
+
+
+class SessionDiffer(ABC):
+    """
+    Base of differs which can keep their opened artifacts and differences in a shared `DiffSession`.
+    Without a session every call of `diffs` opens and releases the artifacts on its own.
+
+    `is_equal_of` only has to decide whether there are any differences and may stop at the first one, while
+    `diffs_of` calculates all of them including the statistics needed for a report.
+
+    With `approved_manifests` the differ consults an `ApprovedManifest` stored next to the approved artifact instead
+    of reading the approved data where possible, and writes one after a successful comparison. Facts about an
+    approved artifact without a manifest which the comparison comes across anyway, like its digest or the
+    statistics of values it decoded as a whole, are observed for that manifest so it does not read them again.
+    Remote approved artifacts are only ever read block by block, so they are neither digested nor have manifests.
+    """
+
+    def __init__(self, session: Optional[DiffSession] = None, approved_manifests: bool = False):
+        self._session = session
+        self._approved_manifests = approved_manifests
+        self._manifests: Dict[Path, Optional[ApprovedManifest]] = {}
+        self._observed: Dict[Path, Tuple[List[int], Dict[str, Any]]] = {}
+
+    @property
+    @abstractmethod
+    def session_key(self) -> Hashable:
+        pass
+
+    @abstractmethod
+    def open_artifacts(self, received_path: Path, approved_path: Path, resources: ExitStack) -> Any:
+        pass
+
+    @abstractmethod
+    def diffs_of(self, artifacts: Any) -> Sequence[Difference]:
+        pass
+
+    @abstractmethod
+    def build_manifest(self, approved_path: Path) -> ApprovedManifest:
+        pass
+
+    def is_rejected_by_manifest(self, received_source: Any, manifest: ApprovedManifest) -> bool:
+        return False
+
+    def is_equal_of(self, artifacts: Any) -> bool:
+        return len(self.diffs_of(artifacts)) == 0
+
+    def phase(self, name: str) -> ContextManager:
+        return nullcontext() if self._session is None else self._session.phase(name)
+
+    def add_pixels(self, n: int) -> None:
+        if self._session is not None:
+            self._session.add_pixels(n)
+
+    def source_of(self, received_path: Path) -> Any:
+        deferred = self._session.deferred(received_path) if self._session is not None else None
+        return received_path if deferred is None else deferred.source
+
+    def are_byte_identical(self, received_path: Path, approved_path: Path) -> bool:
+        with self.phase(DIGEST):
+            return self._are_byte_identical(received_path, approved_path)
+
+    def _are_byte_identical(self, received_path: Path, approved_path: Path) -> bool:
+        if is_remote(approved_path):
+            return False
+        deferred = self._session.deferred(received_path) if self._session is not None else None
+        manifest = self.approved_manifest(approved_path)
+        if deferred is not None:
+            if manifest is not None:
+                return deferred.digest() == manifest.digest
+            return deferred.is_byte_identical(approved_path)
+        if manifest is not None:
+            return artifact_digest(received_path) == manifest.digest
+        if not have_same_layout(received_path, approved_path):
+            return False
+        approved_digest = artifact_digest(approved_path)
+        self.observe_approved(approved_path, OBSERVED_DIGEST, approved_digest)
+        return artifact_digest(received_path) == approved_digest
+
+    def approved_manifest(self, approved_path: Path) -> Optional[ApprovedManifest]:
+        if not self._approved_manifests or is_remote(approved_path):
+            return None
+        approved_path = Path(approved_path)
+        if approved_path not in self._manifests:
+            self._manifests[approved_path] = load_manifest(approved_path)
+        return self._manifests[approved_path]
+
+    def is_rejected_by_approved_manifest(self, received_path: Path, approved_path: Path) -> bool:
+        manifest = self.approved_manifest(approved_path)
+        return manifest is not None and self.is_rejected_by_manifest(self.source_of(received_path), manifest)
+
+    def update_approved_manifest(self, approved_path: Path) -> None:
+        if not self._approved_manifests or is_remote(approved_path):
+            return
+        if self.approved_manifest(approved_path) is None:
+            approved_path = Path(approved_path)
+            self._manifests[approved_path] = self.build_manifest(approved_path)
+            self._observed.pop(approved_path, None)
+            save_manifest(approved_path, self._manifests[approved_path])
+
+    def observes_approved(self, approved_path: Path) -> bool:
+        return self._approved_manifests and not is_remote(approved_path) and \
+            self.approved_manifest(approved_path) is None
+
+    def observe_approved(self, approved_path: Path, name: str, value: Any) -> None:
+        if not self.observes_approved(approved_path):
+            return
+        approved_path = Path(approved_path)
+        signature = stat_signature(approved_path)
+        observed_signature, facts = self._observed.get(approved_path, (signature, {}))
+        facts = facts if observed_signature == signature else {}
+        self._observed[approved_path] = signature, {**facts, name: value}
+
+    def observed_approved(self, approved_path: Path, name: str, compute: Callable[[], Any]) -> Any:
+        """The fact `name` observed while comparing against the unchanged approved artifact, else `compute()`."""
+        signature, facts = self._observed.get(Path(approved_path), (None, {}))
+        if name in facts and signature == stat_signature(approved_path):
+            return facts[name]
+        return compute()
+
+    def diffs(self, received_path: Path, approved_path: Path) -> Sequence[Difference]:
+        with ExitStack() as resources:
+            return self.diffs_of(self.open_artifacts(received_path, approved_path, resources))
+
+    def shared_is_equal(self, received_path: Path, approved_path: Path) -> bool:
+        if self._session is None:
+            with ExitStack() as resources:
+                return self.is_equal_of(self.open_artifacts(received_path, approved_path, resources))
+        return self.is_equal_of(self._session.artifacts(self, received_path, approved_path))
+
+    def shared_diffs(self, received_path: Path, approved_path: Path) -> Sequence[Difference]:
+        if self._session is None:
+            return self.diffs(received_path, approved_path)
+        return self._session.diffs(self, received_path, approved_path)
+
+    def release_shared(self, received_path: Path, approved_path: Path) -> None:
+        if self._session is not None:
+            self._session.release(self, received_path, approved_path)
@@ -1,42 +1,402 @@
+from contextlib import ExitStack
+from dataclasses import astuple, dataclass
 from pathlib import Path
-from typing import Sequence, Callable
+from typing import Sequence, Callable, Optional, Hashable, List, Any, Iterator, Dict, Tuple, Mapping
 
+import numpy as np
+import rioxarray  # noqa # pylint: disable=unused-import
 import xarray as xr
-from xarray import Dataset
+from rioxarray.exceptions import RioXarrayError
+from xarray import Dataset, DataArray
 
-from pytest_approvaltests_geo.differs.difference import Difference, add_common_meta_data_diffs, \
-    calculate_pixel_diff_stats, DiffType
+from pytest_approvaltests_geo.differs.block_heatmap import BlockHeatmap, BlockReduction, iter_block_regions, \
+    block_heatmap_path, DEFAULT_HEATMAP_BLOCK_SIZE
+from pytest_approvaltests_geo.differs.diff_session import SessionDiffer, DiffSession, OBSERVED_DIGEST, OBSERVED_STATS, \
+    DEFAULT_MEMORY_LIMIT
+from pytest_approvaltests_geo.differs.compare_kernel import CompareKernel
+from pytest_approvaltests_geo.differs.difference import Difference, add_common_meta_data_diffs, DiffType, \
+    PixelDiffStatsAccumulator, WorstPixelsAccumulator, DEFAULT_WORST_PIXELS, format_worst_pixels
+from pytest_approvaltests_geo.differs.lazy_comparison import LazyComparison, BlockComparison, \
+    compare_data_vars_lazily
+from pytest_approvaltests_geo.differs.raw_chunks import RawChunkDiffer, Region, RawChunkHasher, \
+    differing_chunks_of_hashes, chunk_region
+from pytest_approvaltests_geo.digests import artifact_digest
+from pytest_approvaltests_geo.instrumentation import OPEN, SCRUB, COMPARE_VALUES, DIFF_STATS
+from pytest_approvaltests_geo.manifest import ApprovedManifest, ValueStatsAccumulator, stat_signature, to_json_value
+from pytest_approvaltests_geo.remote_data import dataset_source, is_remote
 from pytest_approvaltests_geo.scrubbers import scrub_xarray_metadata, scrub_xarray_coordinates
+from pytest_approvaltests_geo.shared_arrays import get_shared_array_cache, approved_array_key
 
 DatasetOpener = Callable[[Path], Dataset]
+MemoryMapper = Callable[[Path, Hashable, Optional[Region]], Optional[np.ndarray]]
+HeatmapGrid = Tuple[Tuple[int, int], Tuple[int, int]]
 
 
-class DifferOfGeoDataset:
-    def __init__(self, opener: DatasetOpener, tags_scrubber, coords_scrubber, float_tolerance):
+@dataclass
+class DatasetArtifacts:
+    received_path: Path
+    received_ds: Dataset
+    approved_path: Path
+    approved_ds: Dataset
+    resources: ExitStack
+
+
+class DifferOfGeoDataset(SessionDiffer):
+    def __init__(self, opener: DatasetOpener, tags_scrubber, coords_scrubber, float_tolerance,
+                 session: Optional[DiffSession] = None, lazy: Optional[LazyComparison] = None,
+                 raw_chunk_differ: Optional[RawChunkDiffer] = None,
+                 raw_chunk_hasher: Optional[RawChunkHasher] = None,
+                 approved_manifests: bool = False,
+                 memory_mapper: Optional[MemoryMapper] = None,
+                 worst_pixels: int = DEFAULT_WORST_PIXELS,
+                 block_heatmap: bool = False,
+                 memory_limit: Optional[int] = None):
+        super().__init__(session, approved_manifests)
         self._opener = opener
         self._tags_scrubber = tags_scrubber
         self._coords_scrubber = coords_scrubber
         self._float_tolerance = float_tolerance
+        self._lazy = lazy
+        self._raw_chunk_differ = raw_chunk_differ
+        self._raw_chunk_hasher = raw_chunk_hasher
+        self._memory_mapper = memory_mapper
+        self._worst_pixels = worst_pixels
+        self._block_heatmap = block_heatmap
+        self._memory_limit = memory_limit or DEFAULT_MEMORY_LIMIT
+        self._kernel = CompareKernel(float_tolerance, reverse_nans=True)
 
-    def diffs(self, received_path: Path, approved_path: Path) -> Sequence[Difference]:
-        diffs = []
-        with self._opener(received_path) as received_ds, self._opener(approved_path) as approved_ds:
+    @property
+    def session_key(self) -> Hashable:
+        return self._opener, self._tags_scrubber, self._coords_scrubber, astuple(self._float_tolerance), \
+            None if self._lazy is None else self._lazy.session_key
+
+    def open_artifacts(self, received_path: Path, approved_path: Path, resources: ExitStack) -> DatasetArtifacts:
+        with self.phase(OPEN):
+            received_ds = self._open_received(received_path, resources)
+            approved_ds = resources.enter_context(self._open(approved_path))
+        with self.phase(SCRUB):
             received_ds = scrub_xarray_metadata(received_ds, self._tags_scrubber)
             approved_ds = scrub_xarray_metadata(approved_ds, self._tags_scrubber)
             received_ds = scrub_xarray_coordinates(received_ds, self._coords_scrubber)
             approved_ds = scrub_xarray_coordinates(approved_ds, self._coords_scrubber)
-            diffs = add_common_meta_data_diffs(received_ds, approved_ds, diffs)
-
-            try:
-                xr.testing.assert_allclose(received_ds, approved_ds, **self._float_tolerance.to_kwargs())
-            except AssertionError as assertion_diff:
-                common_data_vars = set(received_ds.data_vars) & set(approved_ds.data_vars)
-                stats_per_data_var = [(name, calculate_pixel_diff_stats(received_ds[name], approved_ds[name]))
-                                      for name in common_data_vars]
-                stats_per_data_var = [(n, s) for n, s in stats_per_data_var if not s.is_empty]
-                diff_stats = '\n'.join([f"{n}: {str(s)}" for n, s in stats_per_data_var])
-                if diff_stats:
-                    diffs.append(Difference(diff_stats, DiffType.PIXEL_STATS))
-                diffs.append(Difference(str(assertion_diff), DiffType.DATASET))
+        return DatasetArtifacts(received_path, received_ds, approved_path, approved_ds, resources)
+
+    def _open_received(self, received_path: Path, resources: ExitStack) -> Dataset:
+        source = self.source_of(received_path)
+        if not isinstance(source, Dataset):
+            return resources.enter_context(self._open(source))
+        received_ds = source.copy(deep=False)
+        if self._lazy is not None and not received_ds.chunks:
+            received_ds = received_ds.chunk(self._lazy.chunks)
+        return received_ds
+
+    def _open(self, path: Path) -> Dataset:
+        if self._lazy is not None:
+            return self._opener(dataset_source(path), chunks=self._lazy.chunks)
+        return self._opener(dataset_source(path))
+
+    def is_equal_of(self, artifacts: DatasetArtifacts) -> bool:
+        received_ds, approved_ds = artifacts.received_ds, artifacts.approved_ds
+        if add_common_meta_data_diffs(received_ds, approved_ds, []):
+            return False
+        try:
+            self._assert_same_structure(received_ds, approved_ds)
+        except AssertionError:
+            return False
+        approved_stats = {} if self.observes_approved(artifacts.approved_path) else None
+        with self.phase(COMPARE_VALUES):
+            if not all(self._count_violations(artifacts, name, approved_stats) == 0
+                       for name in sorted(received_ds.data_vars, key=str)):
+                return False
+        if approved_stats is not None and len(approved_stats) == len(approved_ds.data_vars):
+            self.observe_approved(artifacts.approved_path, OBSERVED_STATS, approved_stats)
+        return True
+
+    def _count_violations(self, artifacts: DatasetArtifacts, name: Hashable,
+                          approved_stats: Optional[Dict[str, Dict[str, Optional[float]]]] = None) -> int:
+        """
+        Counts the values of `name` violating the tolerance. The statistics of the approved values are added to
+        `approved_stats`, if given, whenever they are decoded as a whole.
+        """
+        received_ds, approved_ds = artifacts.received_ds, artifacts.approved_ds
+        regions = self._differing_raw_chunks(artifacts, name)
+        if regions is not None:
+            self.add_pixels(sum(received_ds[name][region].size for region in regions))
+            return sum(self._kernel.count_violations(*self._values_of(artifacts, name, region)) for region in regions)
+        self.add_pixels(received_ds[name].size)
+        if self._lazy is not None:
+            return compare_data_vars_lazily(received_ds, approved_ds, [name], self._float_tolerance,
+                                            self._lazy, with_stats=False)[name].violations
+        received_values, approved_values = self._values_of(artifacts, name)
+        if approved_stats is not None:
+            approved_stats[str(name)] = ValueStatsAccumulator().add(approved_values).stats()
+        return self._kernel.count_violations(received_values, approved_values)
+
+    def _values_of(self, artifacts: DatasetArtifacts, name: Hashable, region: Optional[Region] = None) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The received and approved values of `name` in `region`, read straight from memory maps of the files where
+        their layout allows it.
+        """
+        received_values = self._mapped_or_decoded(self.source_of(artifacts.received_path), artifacts.received_ds,
+                                                  name, region)
+        approved_values = None if region is not None else self._shared_values(artifacts, name)
+        if approved_values is None:
+            approved_values = self._mapped_or_decoded(artifacts.approved_path, artifacts.approved_ds, name, region)
+        return received_values, approved_values
+
+    def _mapped_or_decoded(self, path: Any, ds: Dataset, name: Hashable, region: Optional[Region]) -> np.ndarray:
+        mapped = self._memory_map(path, name, region)
+        if mapped is not None:
+            return mapped
+        return (ds[name] if region is None else ds[name][region]).values
+
+    def _shared_values(self, artifacts: DatasetArtifacts, name: Hashable) -> Optional[np.ndarray]:
+        """
+        The approved values of `name` attached from the shared array cache, if one is set. Only data variables
+        which are compared as a whole, fit into the memory limit and cannot be memory-mapped are shared, as the
+        comparison of a few differing chunks decodes just those chunks.
+        """
+        shared_arrays = get_shared_array_cache()
+        variable = artifacts.approved_ds[name]
+        if shared_arrays is None or self._lazy is not None or variable.nbytes > self._memory_limit or \
+                self._memory_map(artifacts.approved_path, name) is not None:
+            return None
+        opener = getattr(self._opener, '__qualname__', repr(self._opener))
+        key = approved_array_key(artifacts.approved_path, opener, name)
+        if key is None:
+            return None
+        return artifacts.resources.enter_context(shared_arrays.attached(key, lambda: variable.values,
+                                                                        variable.nbytes))
 
+    def _memory_map(self, path: Any, name: Hashable, region: Optional[Region] = None) -> Optional[np.ndarray]:
+        if self._memory_mapper is None or not isinstance(path, (str, Path)) or is_remote(path):
+            return None
+        return self._memory_mapper(path, name, region)
+
+    def _differing_raw_chunks(self, artifacts: DatasetArtifacts, name: Hashable) -> Optional[List[Region]]:
+        manifest = self.approved_manifest(artifacts.approved_path)
+        if manifest is not None and self._raw_chunk_hasher is not None and str(name) in manifest.chunks:
+            approved_hashes = manifest.chunks[str(name)]
+            starts = differing_chunks_of_hashes(self._raw_chunk_hasher(artifacts.received_path, name),
+                                                approved_hashes)
+            if starts is not None:
+                return [chunk_region(start, approved_hashes.chunk_shape) for start in starts]
+        if self._raw_chunk_differ is None or is_remote(artifacts.approved_path):
+            return None
+        return self._raw_chunk_differ(artifacts.received_path, artifacts.approved_path, name)
+
+    def build_manifest(self, approved_path: Path) -> ApprovedManifest:
+        signature = stat_signature(approved_path)
+        digest = self.observed_approved(approved_path, OBSERVED_DIGEST, lambda: artifact_digest(approved_path))
+        with self._open(approved_path) as approved_ds:
+            metadata = to_json_value(dict(attrs=approved_ds.attrs, variables={
+                str(name): dict(dims=list(v.dims), shape=list(v.shape), dtype=str(v.dtype))
+                for name, v in approved_ds.data_vars.items()}))
+            stats = self.observed_approved(approved_path, OBSERVED_STATS, lambda: _read_value_stats(approved_ds))
+        chunks = {}
+        if self._raw_chunk_hasher is not None:
+            for name in metadata['variables']:
+                hashes = self._raw_chunk_hasher(approved_path, name)
+                if hashes is not None:
+                    chunks[name] = hashes
+        return ApprovedManifest(signature, digest, metadata, chunks, stats)
+
+    def is_rejected_by_manifest(self, received_source: Any, manifest: ApprovedManifest) -> bool:
+        if isinstance(received_source, Dataset):
+            return self._has_other_variables(received_source, manifest)
+        with self._open(received_source) as received_ds:
+            return self._has_other_variables(received_ds, manifest)
+
+    @staticmethod
+    def _has_other_variables(received_ds: Dataset, manifest: ApprovedManifest) -> bool:
+        variables = {str(name): dict(dims=list(v.dims), shape=list(v.shape))
+                     for name, v in received_ds.data_vars.items()}
+        return variables != {name: dict(dims=v['dims'], shape=v['shape'])
+                             for name, v in manifest.metadata['variables'].items()}
+
+    def diffs_of(self, artifacts: DatasetArtifacts) -> Sequence[Difference]:
+        with self.phase(DIFF_STATS):
+            return self._diffs_of(artifacts)
+
+    def _diffs_of(self, artifacts: DatasetArtifacts) -> Sequence[Difference]:
+        diffs = []
+        received_ds, approved_ds = artifacts.received_ds, artifacts.approved_ds
+        self.add_pixels(sum(v.size for v in received_ds.data_vars.values()))
+        diffs = add_common_meta_data_diffs(received_ds, approved_ds, diffs)
+
+        heatmap_base = self._heatmap_base(artifacts.received_path)
+        if self._lazy is not None:
+            diffs.extend(self._lazy_value_diffs(received_ds, approved_ds, heatmap_base))
+            return diffs
+
+        try:
+            self._assert_same_structure(received_ds, approved_ds)
+        except AssertionError as assertion_diff:
+            diffs.extend(self._unaligned_value_diffs(received_ds, approved_ds, assertion_diff))
+            return diffs
+
+        names = sorted(received_ds.data_vars, key=str)
+        comparisons = {name: self._compare_values(*self._values_of(artifacts, name),
+                                                  _heatmap_grid(received_ds[name]) if heatmap_base else None)
+                       for name in names}
+        diffs.extend(self._value_diffs(received_ds, comparisons, heatmap_base))
         return diffs
+
+    def _heatmap_base(self, received_path: Path) -> Optional[Path]:
+        if not self._block_heatmap or not Path(received_path).parent.is_dir():
+            return None
+        return Path(received_path)
+
+    def _compare_values(self, received: np.ndarray, approved: np.ndarray,
+                        heatmap_grid: Optional[HeatmapGrid] = None) -> BlockComparison:
+        """
+        Compares the values of a data variable, split into the blocks of the `heatmap_grid` if one is given, so
+        that every block is reduced to one pixel of the heatmap in the same pass.
+        """
+        with_stats = all(a.dtype.kind in 'biufc' for a in [received, approved])
+        stats = PixelDiffStatsAccumulator() if with_stats else None
+        worst = WorstPixelsAccumulator(self._worst_pixels) if with_stats and self._worst_pixels > 0 else None
+        if heatmap_grid is None or stats is None:
+            return BlockComparison(self._kernel.compare(received, approved, stats, worst), stats, worst)
+        (y_axis, x_axis), block_shape = heatmap_grid
+        comparison = BlockComparison(0, stats, worst, [])
+        for y, x, rows, cols in iter_block_regions(0, 0, received.shape[y_axis], received.shape[x_axis],
+                                                   block_shape):
+            region = tuple({y_axis: rows, x_axis: cols}.get(axis, slice(None)) for axis in range(received.ndim))
+            origin = tuple({y_axis: y, x_axis: x}.get(axis, 0) for axis in range(received.ndim))
+            block_stats = PixelDiffStatsAccumulator()
+            violations = self._kernel.compare(received[region], approved[region], block_stats, worst, origin)
+            comparison.merge(BlockComparison(violations, block_stats, None,
+                                             [BlockReduction.of(origin, violations, block_stats, reverse_nans=True)]))
+        return comparison
+
+    def _unaligned_value_diffs(self, received_ds: Dataset, approved_ds: Dataset,
+                               structure_diff: AssertionError) -> Sequence[Difference]:
+        """
+        Reports the structural difference and compares the values of the common data variables where their
+        coordinates overlap.
+        """
+        received_vars, comparisons = {}, {}
+        for name in sorted(set(received_ds.data_vars) & set(approved_ds.data_vars), key=str):
+            received, approved = xr.broadcast(*xr.align(received_ds[name], approved_ds[name], join='inner'))
+            received_vars[name] = received
+            comparisons[name] = self._compare_values(received.values, approved.transpose(*received.dims).values)
+        return [Difference(str(structure_diff), DiffType.DATASET)] + \
+            list(self._value_diffs(received_vars, comparisons))
+
+    def _lazy_value_diffs(self, received_ds: Dataset, approved_ds: Dataset,
+                          heatmap_base: Optional[Path] = None) -> Sequence[Difference]:
+        try:
+            self._assert_same_structure(received_ds, approved_ds)
+        except AssertionError as assertion_diff:
+            return [Difference(str(assertion_diff), DiffType.DATASET)]
+
+        names = sorted(received_ds.data_vars, key=str)
+        comparisons = compare_data_vars_lazily(received_ds, approved_ds, names, self._float_tolerance, self._lazy,
+                                               worst_pixels=self._worst_pixels,
+                                               block_reductions=heatmap_base is not None)
+        return self._value_diffs(received_ds, comparisons, heatmap_base)
+
+    def _value_diffs(self, received_vars: Mapping[Hashable, DataArray], comparisons: Dict[Hashable, BlockComparison],
+                     heatmap_base: Optional[Path] = None) -> Sequence[Difference]:
+        violating = {n: c for n, c in comparisons.items() if c.violations > 0}
+        if not violating:
+            return []
+
+        diffs = []
+        stats_per_data_var = [(n, c.stats.stats()) for n, c in comparisons.items() if c.stats is not None]
+        diff_stats = '\n'.join([f"{n}: {str(s)}" for n, s in stats_per_data_var if not s.is_empty])
+        if diff_stats:
+            diffs.append(Difference(diff_stats, DiffType.PIXEL_STATS))
+        tolerance = self._float_tolerance.to_kwargs()
+        violations = '\n'.join([f"{n}: {c.violations} of {received_vars[n].size} values differ beyond tolerance "
+                                f"(rtol={tolerance['rtol']}, atol={tolerance['atol']})" +
+                                _worst_pixels_report(received_vars[n], c.worst) for n, c in violating.items()])
+        diffs.append(Difference(f"Left and right Dataset objects are not close\nDiffering values:\n{violations}",
+                                DiffType.DATASET))
+        if heatmap_base is not None:
+            diffs.extend(_write_heatmaps(heatmap_base, received_vars, violating))
+        return diffs
+
+    def _assert_same_structure(self, received_ds: Dataset, approved_ds: Dataset) -> None:
+        xr.testing.assert_allclose(received_ds.coords.to_dataset(), approved_ds.coords.to_dataset(),
+                                   **self._float_tolerance.to_kwargs())
+        assert set(received_ds.data_vars) == set(approved_ds.data_vars), \
+            f"Left and right Dataset objects are not close\n" \
+            f"Differing data variables: {sorted(received_ds.data_vars, key=str)} vs " \
+            f"{sorted(approved_ds.data_vars, key=str)}"
+        for name in received_ds.data_vars:
+            received, approved = received_ds[name], approved_ds[name]
+            assert received.dims == approved.dims and received.shape == approved.shape, \
+                f"Left and right Dataset objects are not close\n" \
+                f"Differing dimensions of {name}: {dict(received.sizes)} vs {dict(approved.sizes)}"
+
+
+def _heatmap_grid(values: DataArray) -> Optional[HeatmapGrid]:
+    """
+    The axes of the spatial dimensions of a data variable and its blocks along them: its dask chunks, the chunks
+    it is stored in or squares of the default size. Variables without spatial dimensions have no heatmap.
+    """
+    try:
+        dims = values.rio.y_dim, values.rio.x_dim
+    except RioXarrayError:
+        return None
+    if not all(dim in values.dims for dim in dims):
+        return None
+    axes = values.dims.index(dims[0]), values.dims.index(dims[1])
+    if values.chunks:
+        block_shape = values.chunks[axes[0]][0], values.chunks[axes[1]][0]
+    else:
+        preferred_chunks = values.encoding.get('preferred_chunks', {})
+        block_shape = tuple(preferred_chunks.get(dim, DEFAULT_HEATMAP_BLOCK_SIZE) for dim in dims)
+    return axes, block_shape
+
+
+def _write_heatmaps(received_path: Path, received_vars: Mapping[Hashable, DataArray],
+                    comparisons: Dict[Hashable, BlockComparison]) -> List[Difference]:
+    diffs = []
+    for name, comparison in comparisons.items():
+        values = received_vars[name]
+        grid = _heatmap_grid(values)
+        if comparison.blocks is None or grid is None:
+            continue
+        (y_axis, x_axis), block_shape = grid
+        heatmap = BlockHeatmap((values.shape[y_axis], values.shape[x_axis]), block_shape)
+        for block in comparison.blocks:
+            heatmap.add(block, y_axis, x_axis)
+        path = block_heatmap_path(received_path, name)
+        heatmap.write(path, values.rio.transform(recalc=True), values.rio.crs)
+        diffs.append(Difference(f"block difference heatmap of {name}: {path}", DiffType.PIXEL_STATS))
+    return diffs
+
+
+def _worst_pixels_report(values: DataArray, worst: Optional[WorstPixelsAccumulator]) -> str:
+    if worst is None:
+        return ""
+    indexes = {dim: values.indexes[dim] for dim in values.dims if dim in values.indexes}
+
+    def _locate(index: Tuple[int, ...]) -> str:
+        return "at " + ", ".join(f"{dim}={indexes[dim][i]}" for dim, i in zip(values.dims, index) if dim in indexes)
+
+    report = format_worst_pixels(worst, [str(dim) for dim in values.dims], _locate if indexes else None)
+    return "\n" + "\n".join(f"  {line}" for line in report.splitlines())
+
+
+def _read_value_stats(ds: Dataset) -> Dict[str, Dict[str, Optional[float]]]:
+    stats = {}
+    for name, variable in ds.data_vars.items():
+        accumulator = ValueStatsAccumulator()
+        for values in _iter_value_chunks(variable):
+            accumulator.add(values)
+        stats[str(name)] = accumulator.stats()
+    return stats
+
+
+def _iter_value_chunks(variable: DataArray) -> Iterator[np.ndarray]:
+    data = variable.data
+    if not hasattr(data, 'blocks'):
+        yield np.asarray(data)
+        return
+    for index in np.ndindex(*data.numblocks):
+        yield np.asarray(data.blocks[index])
@@ -1,50 +1,408 @@
 import os
+import weakref
+from contextlib import ExitStack
+from dataclasses import astuple, dataclass
 from difflib import unified_diff
 from pathlib import Path
-from typing import Sequence, Optional
+from typing import Sequence, Optional, Dict, Hashable, Iterator, Tuple, Iterable, List, Any, Callable
 
+import numpy as np
+import rasterio
 import xarray as xr
 from approval_utilities.utils import to_json
+from rasterio.io import DatasetReader
+from rasterio.windows import Window, intersect as windows_intersect
+from xarray import DataArray
 
-from pytest_approvaltests_geo.differs.difference import DiffType, Difference, calculate_pixel_diff_stats, \
-    add_common_meta_data_diffs
+from pytest_approvaltests_geo.differs.block_heatmap import BlockHeatmap, BlockReduction, iter_block_regions, \
+    block_heatmap_path, DEFAULT_HEATMAP_BLOCK_SIZE
+from pytest_approvaltests_geo.differs.compare_kernel import CompareKernel
+from pytest_approvaltests_geo.differs.diff_session import SessionDiffer, DiffSession, OBSERVED_DIGEST, OBSERVED_STATS, \
+    DEFAULT_MEMORY_LIMIT
+from pytest_approvaltests_geo.differs.difference import DiffType, Difference, add_common_meta_data_diffs, \
+    PixelDiffStatsAccumulator, WorstPixelsAccumulator, DEFAULT_WORST_PIXELS, format_worst_pixels
+from pytest_approvaltests_geo.differs.raw_chunks import differing_tiff_blocks, tiff_block_hashes, \
+    differing_chunks_of_hashes, tiff_block_window
+from pytest_approvaltests_geo.digests import artifact_digest
 from pytest_approvaltests_geo.float_utils import Tolerance
-from pytest_approvaltests_geo.geo_io import read_array_and_tags
+from pytest_approvaltests_geo.geo_io import read_array_and_tags, iter_block_windows, band_groups_of, \
+    iter_windows_read_concurrently, shared_overview_levels, open_overview, BandGroup, \
+    memmap_raster
+from pytest_approvaltests_geo.instrumentation import OPEN, SCRUB, COMPARE_VALUES, DIFF_STATS
+from pytest_approvaltests_geo.manifest import ApprovedManifest, ValueStatsAccumulator, stat_signature, to_json_value
+from pytest_approvaltests_geo.parallel import worker_resources, raster_handle_key, WorkerThreadPoolExecutor
+from pytest_approvaltests_geo.remote_data import open_raster
 from pytest_approvaltests_geo.scrubbers import RecursiveScrubber, identity_recursive_scrubber, scrub_xarray_metadata
+from pytest_approvaltests_geo.shared_arrays import get_shared_array_cache, approved_array_key, SharedArrayCache
 
+WINDOW_WORKING_COPIES = 6
+MANIFEST_PIXELS = "pixels"
 
-class DifferOfGeoTiffs:
+
+@dataclass
+class GeoTiffArtifacts:
+    received_path: Path
+    received_pixels: DataArray
+    received_tags: Dict
+    received_rds: DatasetReader
+    approved_path: Path
+    approved_pixels: DataArray
+    approved_tags: Dict
+    approved_rds: DatasetReader
+
+
+class DifferOfGeoTiffs(SessionDiffer):
     def __init__(self, recursive_scrubber: Optional[RecursiveScrubber] = None,
-                 float_tolerance: Optional[Tolerance] = None):
+                 float_tolerance: Optional[Tolerance] = None,
+                 *,
+                 session: Optional[DiffSession] = None,
+                 memory_limit: Optional[int] = None,
+                 approved_manifests: bool = False,
+                 decode_threads: Optional[int] = None,
+                 compare_overviews: bool = False,
+                 worst_pixels: int = DEFAULT_WORST_PIXELS,
+                 block_heatmap: bool = False):
+        super().__init__(session, approved_manifests)
         self._recursive_scrubber = recursive_scrubber or identity_recursive_scrubber
         self._float_tolerance = float_tolerance or Tolerance()
+        self._memory_limit = memory_limit or DEFAULT_MEMORY_LIMIT
+        self._decode_threads = decode_threads or 1
+        self._compare_overviews = compare_overviews
+        self._worst_pixels = worst_pixels
+        self._block_heatmap = block_heatmap
+        self._kernel = CompareKernel(self._float_tolerance)
+        self._windows_in_flight = 2 * self._decode_threads if self._decode_threads > 1 else 1
+        self._window_bytes = self._memory_limit // WINDOW_WORKING_COPIES // self._windows_in_flight
+        self._decode_executor = None
 
-    def diffs(self, received_path: Path, approved_path: Path) -> Sequence[Difference]:
-        diffs = []
-        with read_array_and_tags(received_path) as (received_pixels, received_tags), \
-                read_array_and_tags(approved_path) as (approved_pixels, approved_tags):
-            diff_tags = self._calculate_tags_diff(approved_path, approved_tags, received_path, received_tags)
-            if diff_tags:
-                diffs.append(Difference(diff_tags, DiffType.TAGS))
+    @property
+    def session_key(self) -> Hashable:
+        return self._recursive_scrubber, astuple(self._float_tolerance)
 
+    def open_artifacts(self, received_path: Path, approved_path: Path, resources: ExitStack) -> GeoTiffArtifacts:
+        received_source = self.source_of(received_path)
+        with self.phase(OPEN):
+            received_pixels, received_tags = resources.enter_context(read_array_and_tags(received_source))
+            received_rds = resources.enter_context(rasterio.open(received_source))
+            approved_pixels, approved_tags = resources.enter_context(read_array_and_tags(approved_path))
+            approved_rds = _open_approved_raster(approved_path, resources)
+        with self.phase(SCRUB):
             received_pixels = scrub_xarray_metadata(received_pixels, self._recursive_scrubber)
             approved_pixels = scrub_xarray_metadata(approved_pixels, self._recursive_scrubber)
-            diffs = add_common_meta_data_diffs(received_pixels, approved_pixels, diffs)
-
-            try:
-                xr.testing.assert_allclose(received_pixels, approved_pixels, **self._float_tolerance.to_kwargs())
-            except AssertionError as assertion_diff:
-                diff_px_stats = calculate_pixel_diff_stats(approved_pixels, received_pixels)
-                diffs.append(Difference(f"pixel differences statistics:\n{str(diff_px_stats)}", DiffType.PIXEL_STATS))
-                diffs.append(Difference(str(assertion_diff), DiffType.DATASET))
+        return GeoTiffArtifacts(received_path, received_pixels, received_tags, received_rds,
+                                approved_path, approved_pixels, approved_tags, approved_rds)
+
+    def is_equal_of(self, artifacts: GeoTiffArtifacts) -> bool:
+        if self._calculate_tags_diff(artifacts.approved_path, artifacts.approved_tags,
+                                     artifacts.received_path, artifacts.received_tags):
+            return False
+        if add_common_meta_data_diffs(artifacts.received_pixels, artifacts.approved_pixels, []):
+            return False
+        try:
+            self._assert_same_grid(artifacts.received_pixels, artifacts.approved_pixels)
+        except AssertionError:
+            return False
+        with self.phase(COMPARE_VALUES):
+            for level, factor, received_rds, approved_rds in self._iter_overviews(artifacts):
+                suspect = self._first_violating_window(received_rds, approved_rds, level)
+                if suspect is None:
+                    continue
+                if not self._windows_are_equal(artifacts.received_rds, artifacts.approved_rds,
+                                               self._full_resolution_windows(artifacts.approved_rds, suspect, factor)):
+                    return False
+                break
+            windows = self._differing_blocks(artifacts)
+            approved_stats = None if windows is not None or not self.observes_approved(artifacts.approved_path) \
+                else [ValueStatsAccumulator() for _ in range(artifacts.approved_rds.count)]
+            if not self._windows_are_equal(artifacts.received_rds, artifacts.approved_rds, windows,
+                                           approved_stats=approved_stats):
+                return False
+            if approved_stats is not None:
+                self.observe_approved(artifacts.approved_path, OBSERVED_STATS, _band_stats(approved_stats))
+            return True
+
+    def _windows_are_equal(self, received_rds: DatasetReader, approved_rds: DatasetReader,
+                           windows: Optional[Iterable[Window]] = None, overview_level: Optional[int] = None,
+                           approved_stats: Optional[List[ValueStatsAccumulator]] = None) -> bool:
+        """
+        Compares the windows until the first one violating the tolerance. Values of all compared approved windows
+        are added to the `approved_stats` of their bands, if given.
+        """
+        for _, received, approved in self._iter_windows(received_rds, approved_rds, windows, overview_level):
+            if self._kernel.count_violations(received, approved) != 0:
+                return False
+            for band_stats, pixels in zip(approved_stats or [], approved):
+                band_stats.add(pixels)
+        return True
+
+    def _first_violating_window(self, received_rds: DatasetReader, approved_rds: DatasetReader,
+                                overview_level: int) -> Optional[Window]:
+        return next((window for window, received, approved in self._iter_windows(received_rds, approved_rds,
+                                                                                 overview_level=overview_level)
+                     if self._kernel.count_violations(received, approved)), None)
+
+    def _full_resolution_windows(self, approved_rds: DatasetReader, overview_window: Window,
+                                 factor: int) -> List[Window]:
+        region = Window(overview_window.col_off * factor, overview_window.row_off * factor,
+                        overview_window.width * factor, overview_window.height * factor)
+        return [window for window in iter_block_windows(approved_rds, self._window_bytes)
+                if windows_intersect(window, region)]
+
+    def _iter_overviews(self, artifacts: GeoTiffArtifacts) -> Iterator[Tuple[int, int, DatasetReader, DatasetReader]]:
+        """
+        Opens the overview levels shared by both rasters from coarsest to finest, if overviews are compared. They
+        only point to where the rasters probably differ: averaged pixels can violate the tolerance although none of
+        the pixels they average does, so the full resolution windows below the first violating overview window are
+        compared first, and a comparison only fails on full resolution pixels.
+        """
+        if not self._compare_overviews:
+            return
+        for level, factor in shared_overview_levels(artifacts.received_rds, artifacts.approved_rds):
+            with open_overview(artifacts.received_rds.name, level) as received_rds, \
+                    open_overview(artifacts.approved_rds.name, level) as approved_rds:
+                yield level, factor, received_rds, approved_rds
+
+    def _differing_blocks(self, artifacts: GeoTiffArtifacts) -> Optional[List[Window]]:
+        manifest = self.approved_manifest(artifacts.approved_path)
+        if manifest is not None and MANIFEST_PIXELS in manifest.chunks:
+            starts = differing_chunks_of_hashes(tiff_block_hashes(artifacts.received_rds),
+                                                manifest.chunks[MANIFEST_PIXELS])
+            if starts is not None:
+                return [tiff_block_window(start, artifacts.received_rds) for start in starts]
+        return differing_tiff_blocks(artifacts.received_rds, artifacts.approved_rds)
+
+    def build_manifest(self, approved_path: Path) -> ApprovedManifest:
+        signature = stat_signature(approved_path)
+        digest = self.observed_approved(approved_path, OBSERVED_DIGEST, lambda: artifact_digest(approved_path))
+        with rasterio.open(approved_path) as rds:
+            metadata = to_json_value(dict(tags=rds.tags(), shape=[rds.count, rds.height, rds.width],
+                                          dtypes=rds.dtypes, crs=rds.crs and rds.crs.to_string(),
+                                          transform=list(rds.transform)[:6]))
+            block_hashes = tiff_block_hashes(rds)
+            stats = self.observed_approved(approved_path, OBSERVED_STATS, lambda: self._read_band_stats(rds))
+        chunks = {} if block_hashes is None else {MANIFEST_PIXELS: block_hashes}
+        return ApprovedManifest(signature, digest, metadata, chunks, stats)
+
+    def _read_band_stats(self, rds: DatasetReader) -> Dict[str, Dict[str, Optional[float]]]:
+        stats = [ValueStatsAccumulator() for _ in range(rds.count)]
+        for window in iter_block_windows(rds, self._memory_limit // WINDOW_WORKING_COPIES):
+            for band_stats, pixels in zip(stats, rds.read(window=window)):
+                band_stats.add(pixels)
+        return _band_stats(stats)
+
+    def is_rejected_by_manifest(self, received_source: Any, manifest: ApprovedManifest) -> bool:
+        with rasterio.open(received_source) as rds:
+            return [rds.count, rds.height, rds.width] != manifest.metadata['shape'] or \
+                self._recursive_scrubber(rds.tags()) != self._recursive_scrubber(manifest.metadata['tags'])
+
+    def diffs_of(self, artifacts: GeoTiffArtifacts) -> Sequence[Difference]:
+        with self.phase(DIFF_STATS):
+            return self._diffs_of(artifacts)
+
+    def _diffs_of(self, artifacts: GeoTiffArtifacts) -> Sequence[Difference]:
+        diffs = []
+        diff_tags = self._calculate_tags_diff(artifacts.approved_path, artifacts.approved_tags,
+                                              artifacts.received_path, artifacts.received_tags)
+        if diff_tags:
+            diffs.append(Difference(diff_tags, DiffType.TAGS))
+
+        diffs = add_common_meta_data_diffs(artifacts.received_pixels, artifacts.approved_pixels, diffs)
+
+        try:
+            self._assert_same_grid(artifacts.received_pixels, artifacts.approved_pixels)
+        except AssertionError as assertion_diff:
+            diffs.append(Difference(str(assertion_diff), DiffType.DATASET))
+            return diffs
+
+        diffs.extend(self._windowed_pixel_diffs(artifacts.received_rds, artifacts.approved_rds,
+                                                heatmap_path=self._heatmap_path(artifacts.received_path)))
         return diffs
 
+    def _heatmap_path(self, received_path: Path) -> Optional[Path]:
+        if not self._block_heatmap or not Path(received_path).parent.is_dir():
+            return None
+        return block_heatmap_path(Path(received_path))
+
+    def _assert_same_grid(self, received_pixels: DataArray, approved_pixels: DataArray) -> None:
+        assert received_pixels.dims == approved_pixels.dims and received_pixels.shape == approved_pixels.shape, \
+            f"Left and right DataArray objects are not close\n" \
+            f"Differing shapes: {dict(received_pixels.sizes)} vs {dict(approved_pixels.sizes)}"
+        xr.testing.assert_allclose(received_pixels.coords.to_dataset(), approved_pixels.coords.to_dataset(),
+                                   **self._float_tolerance.to_kwargs())
+
+    def _windowed_pixel_diffs(self, received_rds: DatasetReader, approved_rds: DatasetReader,
+                              heatmap_path: Optional[Path] = None) -> Sequence[Difference]:
+        tolerance = self._float_tolerance.to_kwargs()
+        stats = PixelDiffStatsAccumulator()
+        worst = WorstPixelsAccumulator(self._worst_pixels) if self._worst_pixels > 0 else None
+        heatmap = None if heatmap_path is None else \
+            BlockHeatmap((approved_rds.height, approved_rds.width), _heatmap_block_shape(approved_rds))
+        violations = 0
+        first_violating_window = None
+        for window, received, approved in self._iter_windows(received_rds, approved_rds):
+            window_violations = self._compare_window(window, received, approved, stats, worst, heatmap)
+            if window_violations and first_violating_window is None:
+                first_violating_window = window
+            violations += window_violations
+
+        if violations == 0:
+            return []
+        diff_px_stats = stats.stats()
+        total = approved_rds.count * approved_rds.height * approved_rds.width
+        worst_report = "" if worst is None else \
+            "\n" + format_worst_pixels(worst, ["band", "y", "x"], _map_coordinates_of(approved_rds))
+        diffs = [Difference(f"pixel differences statistics:\n{str(diff_px_stats)}", DiffType.PIXEL_STATS),
+                 Difference(f"Left and right DataArray objects are not close\n"
+                            f"{violations} of {total} pixels differ beyond tolerance "
+                            f"(rtol={tolerance['rtol']}, atol={tolerance['atol']}), "
+                            f"first in {first_violating_window}{worst_report}", DiffType.DATASET)]
+        if heatmap is not None:
+            heatmap.write(heatmap_path, approved_rds.transform, approved_rds.crs)
+            diffs.append(Difference(f"block difference heatmap: {heatmap_path}", DiffType.PIXEL_STATS))
+        return diffs
+
+    def _compare_window(self, window: Window, received: np.ndarray, approved: np.ndarray,
+                        stats: PixelDiffStatsAccumulator, worst: Optional[WorstPixelsAccumulator],
+                        heatmap: Optional[BlockHeatmap]) -> int:
+        """
+        Compares the pixels of a window, split into the blocks of the heatmap if one is given, so that every block
+        is reduced to one pixel of it in the same pass.
+        """
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        if heatmap is None:
+            return self._kernel.compare(received, approved, stats, worst, (1, row_off, col_off))
+        violations = 0
+        for y, x, rows, cols in iter_block_regions(row_off, col_off, received.shape[1], received.shape[2],
+                                                   heatmap.block_shape):
+            block_stats = PixelDiffStatsAccumulator()
+            block_violations = self._kernel.compare(received[:, rows, cols], approved[:, rows, cols], block_stats,
+                                                    worst, (1, y, x))
+            heatmap.add(BlockReduction.of((y, x), block_violations, block_stats))
+            stats.merge(block_stats)
+            violations += block_violations
+        return violations
+
+    def _iter_windows(self, received_rds: DatasetReader, approved_rds: DatasetReader,
+                      windows: Optional[Iterable[Window]] = None, overview_level: Optional[int] = None) \
+            -> Iterator[Tuple[Window, np.ndarray, np.ndarray]]:
+        shared_arrays = get_shared_array_cache()
+        is_shared_whole = _is_shared_whole(shared_arrays, approved_rds, windows, overview_level, self._memory_limit)
+        key = approved_array_key(approved_rds.name, "tif", overview_level) if is_shared_whole else None
+        if windows is None:
+            windows = iter_block_windows(approved_rds, self._window_bytes)
+        band_groups = band_groups_of(approved_rds)
+        if key is None:
+            for window, (received, approved) in self._iter_reads([received_rds, approved_rds], windows, band_groups,
+                                                                 overview_level):
+                self.add_pixels(received.size)
+                yield window, received, approved
+            return
+        with shared_arrays.attached(key, approved_rds.read, _raster_bytes(approved_rds)) as approved_pixels:
+            for window, (received,) in self._iter_reads([received_rds], windows, band_groups, overview_level):
+                self.add_pixels(received.size)
+                yield window, received, approved_pixels[(slice(None),) + window.toslices()]
+
+    def _iter_reads(self, rdss: Sequence[DatasetReader], windows: Iterable[Window], band_groups: List[BandGroup],
+                    overview_level: Optional[int]) \
+            -> Iterator[Tuple[Window, List[np.ndarray]]]:
+        """
+        Reads the windows of all rasters, as views of memory maps of those which are stored uncompressed and
+        contiguously and by decoding all others.
+        """
+        mapped = [_memmap_level(rds, overview_level) for rds in rdss]
+        decoded = [rds for rds, pixels in zip(rdss, mapped) if pixels is None]
+        for window, reads in self._iter_decoded(decoded, windows, band_groups, overview_level):
+            reads = iter(reads)
+            yield window, [next(reads) if pixels is None else pixels[(slice(None),) + window.toslices()]
+                           for pixels in mapped]
+
+    def _iter_decoded(self, rdss: Sequence[DatasetReader], windows: Iterable[Window], band_groups: List[BandGroup],
+                      overview_level: Optional[int]) -> Iterator[Tuple[Window, List[np.ndarray]]]:
+        if self._decode_threads > 1 and rdss:
+            yield from iter_windows_read_concurrently(self._decode_pool(), [rds.name for rds in rdss], windows,
+                                                      band_groups, self._windows_in_flight, overview_level)
+            return
+        for window in windows:
+            yield window, [rds.read(window=window) for rds in rdss]
+
+    def _decode_pool(self) -> WorkerThreadPoolExecutor:
+        """
+        The threads decoding windows, started on first use and shut down together with the differ, so that their
+        GDAL environments and dataset handles serve all windows and overview levels it compares.
+        """
+        if self._decode_executor is None:
+            gdal_options = dict(GDAL_CACHEMAX=_cache_max_mb(self._window_bytes, self._windows_in_flight))
+            self._decode_executor = WorkerThreadPoolExecutor(self._decode_threads, gdal_options)
+            weakref.finalize(self, self._decode_executor.shutdown)
+        return self._decode_executor
+
     def _calculate_tags_diff(self, approved_path, approved_tags, received_path, received_tags):
-        approved_text = f"{to_json(self._recursive_scrubber(approved_tags))}\n"
-        received_text = f"{to_json(self._recursive_scrubber(received_tags))}\n"
+        with self.phase(SCRUB):
+            approved_text = f"{to_json(self._recursive_scrubber(approved_tags))}\n"
+            received_text = f"{to_json(self._recursive_scrubber(received_tags))}\n"
         return "\n".join(unified_diff(
             approved_text.splitlines(),
             received_text.splitlines(),
-            os.path.basename(approved_path),
-            os.path.basename(received_path)
+            os.path.basename(str(approved_path)),
+            os.path.basename(str(received_path))
         )).strip()
+
+
+def _open_approved_raster(approved_path: Path, resources: ExitStack) -> DatasetReader:
+    """
+    Reuses the handle of the approved raster kept by the worker of a parallel verification, as many rows are
+    usually compared to the same approved rasters.
+    """
+    worker = worker_resources()
+    if worker is None:
+        return resources.enter_context(open_raster(approved_path))
+    return worker.handle(raster_handle_key(str(approved_path)), lambda: open_raster(approved_path))
+
+
+def _band_stats(stats: List[ValueStatsAccumulator]) -> Dict[str, Dict[str, Optional[float]]]:
+    return {f"band_{i}": s.stats() for i, s in enumerate(stats, start=1)}
+
+
+def _heatmap_block_shape(rds: DatasetReader) -> Tuple[int, int]:
+    """
+    The native blocks of tiled rasters and squares of the default size for striped ones, whose strips span the
+    whole width.
+    """
+    block_height, block_width = rds.block_shapes[0]
+    if block_width >= rds.width:
+        return DEFAULT_HEATMAP_BLOCK_SIZE, DEFAULT_HEATMAP_BLOCK_SIZE
+    return block_height, block_width
+
+
+def _map_coordinates_of(rds: DatasetReader) -> Callable[[Tuple[int, ...]], str]:
+    def _locate(index: Tuple[int, ...]) -> str:
+        x, y = rds.transform * (index[2] + 0.5, index[1] + 0.5)
+        return f"at map x={x}, y={y}"
+    return _locate
+
+
+def _is_shared_whole(shared_arrays: Optional[SharedArrayCache], approved_rds: DatasetReader,
+                     windows: Optional[Iterable[Window]], overview_level: Optional[int], memory_limit: int) -> bool:
+    """
+    Whether the approved raster is attached from the shared arrays as a whole instead of being read by window. Only
+    whole comparisons of rasters which fit into both the cache and the memory limit and cannot be memory mapped
+    directly are, as the whole raster is decoded at once to be shared.
+    """
+    return shared_arrays is not None and windows is None and \
+        _raster_bytes(approved_rds) <= min(shared_arrays.max_bytes, memory_limit) and \
+        _memmap_level(approved_rds, overview_level) is None
+
+
+def _memmap_level(rds: DatasetReader, overview_level: Optional[int]) -> Optional[np.ndarray]:
+    return memmap_raster(rds) if overview_level is None else None
+
+
+def _raster_bytes(rds: DatasetReader) -> int:
+    return rds.count * rds.height * rds.width * max(np.dtype(dt).itemsize for dt in rds.dtypes)
+
+
+def _cache_max_mb(window_bytes: int, windows_in_flight: int) -> int:
+    """
+    Sizes GDAL's block cache to hold the blocks of all windows being decoded at once for both rasters.
+    """
+    return max(2 * window_bytes * windows_in_flight // 2 ** 20, 1)
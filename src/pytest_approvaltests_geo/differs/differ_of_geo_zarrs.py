@@ -2,7 +2,11 @@ from typing import Optional
 
 import xarray as xr
 
+from pytest_approvaltests_geo.differs.diff_session import DiffSession
 from pytest_approvaltests_geo.differs.differ_of_geo_dataset import DifferOfGeoDataset
+from pytest_approvaltests_geo.differs.difference import DEFAULT_WORST_PIXELS
+from pytest_approvaltests_geo.differs.lazy_comparison import LazyComparison
+from pytest_approvaltests_geo.differs.raw_chunks import differing_zarr_chunks, zarr_chunk_hashes, memmap_zarr_chunk
 from pytest_approvaltests_geo.float_utils import Tolerance
 from pytest_approvaltests_geo.scrubbers import RecursiveScrubber, identity_recursive_scrubber, SequenceScrubber, \
     identity_sequence_scrubber
@@ -11,8 +15,24 @@ from pytest_approvaltests_geo.scrubbers import RecursiveScrubber, identity_recur
 class DifferOfGeoZarrs(DifferOfGeoDataset):
     def __init__(self, tags_scrubber: Optional[RecursiveScrubber] = None,
                  coords_scrubber: Optional[SequenceScrubber] = None,
-                 float_tolerance: Optional[Tolerance] = None):
+                 float_tolerance: Optional[Tolerance] = None,
+                 *,
+                 session: Optional[DiffSession] = None,
+                 lazy: Optional[LazyComparison] = None,
+                 approved_manifests: bool = False,
+                 worst_pixels: int = DEFAULT_WORST_PIXELS,
+                 block_heatmap: bool = False,
+                 memory_limit: Optional[int] = None):
         super().__init__(xr.open_zarr,
                          tags_scrubber or identity_recursive_scrubber,
                          coords_scrubber or identity_sequence_scrubber,
-                         float_tolerance or Tolerance())
+                         float_tolerance or Tolerance(),
+                         session,
+                         lazy,
+                         differing_zarr_chunks,
+                         zarr_chunk_hashes,
+                         approved_manifests,
+                         memmap_zarr_chunk,
+                         worst_pixels,
+                         block_heatmap,
+                         memory_limit)
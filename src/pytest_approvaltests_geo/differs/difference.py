@@ -1,8 +1,9 @@
 from dataclasses import dataclass
 from enum import Enum
-from typing import Sequence
+from typing import Sequence, Any, Tuple, List, Optional, Callable
 
 import numpy as np
+import xarray as xr
 from numpy.typing import ArrayLike
 from xarray.core.formatting import diff_attrs_repr
 
@@ -44,16 +45,223 @@ class Stats:
         return self.min == 0 and self.max == 0 and self.nans == 0
 
 
+EXACT_QUANTILES_LIMIT = 1 << 16
+QUANTILES_RELATIVE_ACCURACY = 0.01
+STATS_CHUNK_SIZE = 1 << 16
+
+
+class PixelDiffStatsAccumulator:
+    """
+    Accumulates the statistics of absolute pixel differences chunk by chunk in a single pass.
+
+    Minimum, maximum, mean and the NaN difference are exact. Quantiles are exact as long as at most
+    `exact_limit` valid differences have been added, afterwards they are estimated with a logarithmically
+    bucketed sketch with the given relative accuracy. Accumulators of disjoint parts, like blocks, bands or the
+    results of different workers, can be combined with `merge`.
+
+    >>> acc = PixelDiffStatsAccumulator().add([1, 2, 3], [2, 4, 4]).merge(PixelDiffStatsAccumulator().add([4], [3]))
+    >>> acc.stats()
+    Stats(min=1, max=2, mean=1.25, median=1.0, nans=0)
+    """
+
+    def __init__(self, exact_limit: int = EXACT_QUANTILES_LIMIT,
+                 relative_accuracy: float = QUANTILES_RELATIVE_ACCURACY):
+        self.size = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.nans = 0
+        self._exact_limit = exact_limit
+        self._exact_values = []
+        self._log_gamma = np.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self._zeros = 0
+        self._buckets = {}
+
+    @property
+    def is_exact(self) -> bool:
+        return self._exact_values is not None
+
+    def add(self, approved_pixels: ArrayLike, received_pixels: ArrayLike) -> "PixelDiffStatsAccumulator":
+        approved_pixels = np.asarray(approved_pixels).reshape(-1)
+        received_pixels = np.asarray(received_pixels).reshape(-1)
+        for start in range(0, received_pixels.size, STATS_CHUNK_SIZE):
+            self._add_chunk(approved_pixels[start:start + STATS_CHUNK_SIZE],
+                            received_pixels[start:start + STATS_CHUNK_SIZE])
+        return self
+
+    def add_abs_diffs(self, abs_diffs: np.ndarray, received_nans: int = 0,
+                      approved_nans: int = 0) -> "PixelDiffStatsAccumulator":
+        self.size += abs_diffs.size
+        self.nans += received_nans - approved_nans
+        valid = abs_diffs[~np.isnan(abs_diffs)] if abs_diffs.dtype.kind == 'f' else abs_diffs
+        if valid.size == 0:
+            return self
+        self.count += valid.size
+        chunk_min, chunk_max = valid.min().item(), valid.max().item()
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+        self.sum += np.sum(valid, dtype=np.float64).item()
+        if self.is_exact:
+            self._exact_values.append(valid.copy())
+            if self.count > self._exact_limit:
+                self._flush_exact_values()
+        else:
+            self._add_to_sketch(valid)
+        return self
+
+    def merge(self, other: "PixelDiffStatsAccumulator") -> "PixelDiffStatsAccumulator":
+        self.size += other.size
+        self.nans += other.nans
+        if other.count == 0:
+            return self
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sum += other.sum
+        if self.is_exact and other.is_exact and self.count <= self._exact_limit:
+            self._exact_values.extend(other._exact_values)
+            return self
+        if self.is_exact:
+            self._flush_exact_values()
+        if other.is_exact:
+            for values in other._exact_values:
+                self._add_to_sketch(values)
+        else:
+            self._zeros += other._zeros
+            for index, n in other._buckets.items():
+                self._buckets[index] = self._buckets.get(index, 0) + n
+        return self
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return np.nan
+        if self.is_exact:
+            return np.quantile(np.concatenate(self._exact_values), q).item()
+        rank = q * (self.count - 1)
+        if rank < self._zeros:
+            return 0.0
+        seen = self._zeros
+        gamma = np.exp(self._log_gamma)
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if rank < seen:
+                estimate = 2 * gamma ** index / (gamma + 1)
+                return float(np.clip(estimate, self.min, self.max))
+        return float(self.max)
+
+    def stats(self) -> Stats:
+        if self.size == 0:
+            return Stats()
+        if self.count == 0:
+            return Stats(np.nan, np.nan, np.nan, np.nan, self.nans)
+        return Stats(self.min, self.max, self.sum / self.count, self.quantile(0.5), self.nans)
+
+    def _add_chunk(self, approved_pixels: np.ndarray, received_pixels: np.ndarray) -> None:
+        self.add_abs_diffs(abs_diff(received_pixels, approved_pixels),
+                           count_nans(received_pixels), count_nans(approved_pixels))
+
+    def _flush_exact_values(self) -> None:
+        exact_values, self._exact_values = self._exact_values, None
+        for values in exact_values:
+            self._add_to_sketch(values)
+
+    def _add_to_sketch(self, values: np.ndarray) -> None:
+        positive = values[values > 0]
+        self._zeros += values.size - positive.size
+        if positive.size == 0:
+            return
+        indices = np.ceil(np.log(positive.astype(np.float64)) / self._log_gamma).astype(np.int64)
+        for index, n in zip(*np.unique(indices, return_counts=True)):
+            self._buckets[index.item()] = self._buckets.get(index.item(), 0) + n.item()
+
+
+DEFAULT_WORST_PIXELS = 10
+
+
+@dataclass
+class WorstPixel:
+    index: Tuple[int, ...]
+    received: Any
+    approved: Any
+    abs_diff: float
+
+
+class WorstPixelsAccumulator:
+    """
+    Keeps the `k` pixels which violate the tolerance with the largest absolute differences, selected chunk by chunk
+    with `np.argpartition`, so only `k` pixels are ever kept. A difference to a NaN ranks above all others.
+    Accumulators of disjoint parts can be combined with `merge`.
+
+    >>> acc = WorstPixelsAccumulator(2).add(np.array([[0], [1], [2]]), np.array([1, 5, np.nan]), np.array([0, 0, 0]))
+    >>> [(p.index, p.abs_diff) for p in acc.pixels()]
+    [((2,), nan), ((1,), 5.0)]
+    """
+
+    def __init__(self, k: int = DEFAULT_WORST_PIXELS):
+        self.k = k
+        self._pixels: List[WorstPixel] = []
+
+    def add(self, indices: np.ndarray, received: np.ndarray, approved: np.ndarray,
+            abs_diffs: Optional[np.ndarray] = None) -> "WorstPixelsAccumulator":
+        """Adds violating pixels at `indices`, an array with the index of one pixel per row."""
+        abs_diffs = abs_diff(received, approved) if abs_diffs is None else abs_diffs
+        ranks = abs_diffs.astype(np.float64)
+        ranks[np.isnan(ranks)] = np.inf
+        if ranks.size > self.k:
+            selected = np.argpartition(-ranks, self.k - 1)[:self.k]
+        else:
+            selected = np.arange(ranks.size)
+        self._pixels.extend(WorstPixel(tuple(int(i) for i in indices[j]), received[j].item(), approved[j].item(),
+                                       float(abs_diffs[j])) for j in selected)
+        self._keep_worst()
+        return self
+
+    def merge(self, other: "WorstPixelsAccumulator") -> "WorstPixelsAccumulator":
+        self._pixels.extend(other._pixels)
+        self._keep_worst()
+        return self
+
+    def pixels(self) -> List[WorstPixel]:
+        return list(self._pixels)
+
+    def _keep_worst(self) -> None:
+        self._pixels = sorted(self._pixels, key=lambda p: np.inf if np.isnan(p.abs_diff) else p.abs_diff,
+                              reverse=True)[:self.k]
+
+
+def format_worst_pixels(worst: WorstPixelsAccumulator, dims: Sequence[str],
+                        locate: Optional[Callable[[Tuple[int, ...]], str]] = None) -> str:
+    """
+    Lists the worst pixels one per line with their index along `dims` and, with `locate`, their coordinates.
+    """
+    pixels = worst.pixels()
+    lines = [f"{len(pixels)} largest differences:"]
+    for pixel in pixels:
+        index = ", ".join(f"{dim}={i}" for dim, i in zip(dims, pixel.index))
+        location = f" ({locate(pixel.index)})" if locate is not None else ""
+        lines.append(f"  {index}{location}: received={pixel.received}, approved={pixel.approved}, "
+                     f"abs diff={pixel.abs_diff}")
+    return "\n".join(lines)
+
+
+def abs_diff(received_pixels: np.ndarray, approved_pixels: np.ndarray) -> np.ndarray:
+    if received_pixels.dtype.kind == 'u' and approved_pixels.dtype.kind == 'u':
+        return np.where(received_pixels > approved_pixels,
+                        received_pixels - approved_pixels, approved_pixels - received_pixels)
+    return np.abs(received_pixels - approved_pixels)
+
+
+def count_nans(pixels: np.ndarray) -> int:
+    if pixels.dtype.kind not in 'fc':
+        return 0
+    return int(np.count_nonzero(np.isnan(pixels)))
+
+
 def calculate_pixel_diff_stats(approved_pixels: ArrayLike, received_pixels: ArrayLike) -> Stats:
-    diff_pixels = np.abs(received_pixels - approved_pixels)
-    if diff_pixels.size == 0:
-        return Stats()
-    diff_min = np.nanmin(diff_pixels).item()
-    diff_max = np.nanmax(diff_pixels).item()
-    diff_mean = np.nanmean(diff_pixels).item()
-    diff_median = np.nanmedian(diff_pixels).item()
-    diff_nans = (np.asarray(np.sum(np.isnan(received_pixels))) - np.asarray(np.sum(np.isnan(approved_pixels)))).item()
-    return Stats(diff_min, diff_max, diff_mean, diff_median, diff_nans)
+    if isinstance(approved_pixels, xr.DataArray) and isinstance(received_pixels, xr.DataArray):
+        approved_pixels, received_pixels = xr.broadcast(*xr.align(approved_pixels, received_pixels, join='inner'))
+    return PixelDiffStatsAccumulator().add(approved_pixels, received_pixels).stats()
 
 
 def print_diffs(diffs: Sequence[Difference]) -> None:
@@ -0,0 +1,98 @@
+import itertools
+from dataclasses import dataclass
+from typing import Optional, Union, Mapping, Dict, Tuple, Sequence, Hashable, List
+
+import numpy as np
+from xarray import Dataset
+
+from pytest_approvaltests_geo.differs.block_heatmap import BlockReduction
+from pytest_approvaltests_geo.differs.difference import PixelDiffStatsAccumulator, WorstPixelsAccumulator
+from pytest_approvaltests_geo.differs.compare_kernel import CompareKernel
+from pytest_approvaltests_geo.float_utils import Tolerance
+
+Chunks = Union[str, int, Mapping[str, int]]
+
+
+@dataclass
+class LazyComparison:
+    scheduler: str = "threads"
+    num_workers: Optional[int] = None
+    chunks: Chunks = "auto"
+
+    @property
+    def session_key(self) -> Hashable:
+        chunks = tuple(sorted(self.chunks.items())) if isinstance(self.chunks, Mapping) else self.chunks
+        return self.scheduler, self.num_workers, chunks
+
+
+@dataclass
+class BlockComparison:
+    violations: int
+    stats: Optional[PixelDiffStatsAccumulator]
+    worst: Optional[WorstPixelsAccumulator] = None
+    blocks: Optional[List[BlockReduction]] = None
+
+    def merge(self, other: "BlockComparison") -> "BlockComparison":
+        self.violations += other.violations
+        if self.stats is not None and other.stats is not None:
+            self.stats.merge(other.stats)
+        if self.worst is not None and other.worst is not None:
+            self.worst.merge(other.worst)
+        if self.blocks is not None and other.blocks is not None:
+            self.blocks.extend(other.blocks)
+        return self
+
+
+def compare_block(received: np.ndarray, approved: np.ndarray, tolerance: Tolerance,
+                  with_stats: bool = True, worst_pixels: int = 0,
+                  origin: Optional[Sequence[int]] = None, reduce_block: bool = False) -> BlockComparison:
+    with_stats = with_stats and received.dtype.kind in 'biufc' and approved.dtype.kind in 'biufc'
+    stats = PixelDiffStatsAccumulator() if with_stats else None
+    worst = WorstPixelsAccumulator(worst_pixels) if worst_pixels > 0 else None
+    # same sign of the NaN difference as the statistics of the eager dataset comparison
+    violations = CompareKernel(tolerance, reverse_nans=True).compare(received, approved, stats, worst, origin)
+    blocks = None
+    if reduce_block and stats is not None:
+        blocks = [BlockReduction.of(origin or (0,) * received.ndim, violations, stats, reverse_nans=True)]
+    return BlockComparison(violations, stats, worst, blocks)
+
+
+def merge_block_comparisons(a: BlockComparison, b: BlockComparison) -> BlockComparison:
+    return a.merge(b)
+
+
+def compare_data_vars_lazily(received_ds: Dataset, approved_ds: Dataset, names: Sequence[Hashable],
+                             tolerance: Tolerance, lazy: LazyComparison,
+                             with_stats: bool = True, worst_pixels: int = 0,
+                             block_reductions: bool = False) -> Dict[Hashable, BlockComparison]:
+    """
+    Compares the given data variables of both datasets block by block as one dask graph. Every task reduces one
+    pair of chunks to its tolerance violations and, if requested, a statistics accumulator, its `worst_pixels`
+    largest differences and the reduction of the block itself. They are merged in a tree, so workers never hold
+    more than a few chunks at once.
+    """
+    import dask
+    import dask.array as da
+
+    comparisons = []
+    for name in names:
+        received = da.asarray(received_ds[name].data)
+        approved = da.asarray(approved_ds[name].data).rechunk(received.chunks)
+        blocks = [dask.delayed(compare_block)(r, a, tolerance, with_stats, worst_pixels, origin, block_reductions)
+                  for r, a, origin in zip(received.to_delayed().ravel(), approved.to_delayed().ravel(),
+                                          _block_origins(received.chunks))]
+        comparisons.append(_tree_merge(blocks, dask.delayed(merge_block_comparisons)))
+
+    computed = dask.compute(*comparisons, scheduler=lazy.scheduler, num_workers=lazy.num_workers)
+    return dict(zip(names, computed))
+
+
+def _block_origins(chunks: Tuple[Tuple[int, ...], ...]) -> Sequence[Tuple[int, ...]]:
+    # in the same row-major order as the raveled blocks of `to_delayed`
+    return list(itertools.product(*[np.cumsum((0,) + c[:-1]).tolist() for c in chunks]))
+
+
+def _tree_merge(parts, merge):
+    while len(parts) > 1:
+        parts = [merge(*parts[i:i + 2]) if i + 1 < len(parts) else parts[i] for i in range(0, len(parts), 2)]
+    return parts[0]
@@ -0,0 +1,342 @@
+import json
+import math
+import os
+import re
+from pathlib import Path
+from typing import Optional, List, Tuple, Hashable, Callable, Mapping, Iterator, Any
+
+import numpy as np
+from rasterio.io import DatasetReader
+from rasterio.windows import Window
+
+from pytest_approvaltests_geo.digests import new_hasher
+from pytest_approvaltests_geo.manifest import ChunkHashes, to_json_value
+
+try:
+    import h5py
+except ImportError:  # pragma: no cover
+    h5py = None
+
+Region = Tuple[slice, ...]
+RawChunkDiffer = Callable[[Path, Path, Hashable], Optional[List[Region]]]
+RawChunkHasher = Callable[[Path, Hashable], Optional[ChunkHashes]]
+
+CF_DECODING_ATTRS = ('scale_factor', 'add_offset', '_FillValue', 'missing_value', 'units', 'calendar', '_Unsigned',
+                     'dtype')
+ZARR_METADATA_FILES = {'.zarray', '.zattrs', '.zgroup', '.zmetadata', 'zarr.json'}
+
+
+def differing_tiff_blocks(received_rds: DatasetReader, approved_rds: DatasetReader) -> Optional[List[Window]]:
+    """
+    Compares the raw, still encoded bytes of all blocks (tiles or strips) of two GeoTIFFs and returns the windows
+    of the blocks which differ. Returns None if both are not encoded the same way, in which case identical pixel
+    values could still be stored as different bytes and only decoding can tell.
+    """
+    if not _same_tiff_encoding(received_rds, approved_rds):
+        return None
+    interleaved = approved_rds.tags(ns='IMAGE_STRUCTURE').get('INTERLEAVE') == 'PIXEL'
+    bands = [1] if interleaved else range(1, approved_rds.count + 1)
+    with open(received_rds.name, 'rb') as received_file, open(approved_rds.name, 'rb') as approved_file:
+        return [window for (row, col), window in approved_rds.block_windows(1)
+                if not all(_same_byte_range(received_file, _tiff_block_range(received_rds, band, row, col),
+                                            approved_file, _tiff_block_range(approved_rds, band, row, col))
+                           for band in bands)]
+
+
+def differing_zarr_chunks(received_path: Path, approved_path: Path, name: Hashable) -> Optional[List[Region]]:
+    """
+    Compares the chunk objects of the array `name` in two zarr stores by size and content and returns the regions
+    of the chunks which differ. Chunks missing in both stores hold the fill value and count as equal. Returns None
+    if the arrays are not encoded the same way.
+    """
+    received_array, approved_array = Path(received_path) / str(name), Path(approved_path) / str(name)
+    received_meta, approved_meta = _zarr_array_metadata(received_array), _zarr_array_metadata(approved_array)
+    if received_meta is None or received_meta != approved_meta:
+        return None
+    shape, chunk_shape = received_meta[0]['shape'], _zarr_chunk_shape(received_meta[0])
+    received_chunks, approved_chunks = dict(_iter_zarr_chunks(received_array)), dict(_iter_zarr_chunks(approved_array))
+    differing = []
+    for key in sorted(received_chunks.keys() | approved_chunks.keys()):
+        region = _zarr_chunk_region(key, shape, chunk_shape)
+        if region is None:
+            return None
+        if key not in received_chunks or key not in approved_chunks or \
+                not _same_file_content(received_chunks[key], approved_chunks[key]):
+            differing.append(region)
+    return differing
+
+
+def differing_hdf5_chunks(received_path: Path, approved_path: Path, name: Hashable) -> Optional[List[Region]]:
+    """
+    Compares the raw chunks of the variable `name` in two NetCDF4/HDF5 files, as stored on disk with their filters
+    still applied, and returns the regions of the chunks which differ. Returns None if h5py is not installed, the
+    files are not HDF5 or the variables are not encoded the same way.
+    """
+    if h5py is None or not all(h5py.is_hdf5(p) for p in [received_path, approved_path]):
+        return None
+    with h5py.File(received_path, 'r') as received_h5, h5py.File(approved_path, 'r') as approved_h5:
+        received, approved = received_h5.get(str(name)), approved_h5.get(str(name))
+        if not isinstance(received, h5py.Dataset) or not isinstance(approved, h5py.Dataset) or \
+                _hdf5_encoding(received) != _hdf5_encoding(approved):
+            return None
+        received_chunks, approved_chunks = dict(_iter_hdf5_chunks(received)), dict(_iter_hdf5_chunks(approved))
+        chunk_shape = received.chunks or received.shape
+    with open(received_path, 'rb') as received_file, open(approved_path, 'rb') as approved_file:
+        return [tuple(slice(o, o + c) for o, c in zip(start, chunk_shape))
+                for start in sorted(received_chunks.keys() | approved_chunks.keys())
+                if not _same_byte_range(received_file, received_chunks.get(start),
+                                        approved_file, approved_chunks.get(start))]
+
+
+def tiff_block_hashes(rds: DatasetReader) -> Optional[ChunkHashes]:
+    """
+    Hashes the raw bytes of every block of a GeoTIFF over all bands, keyed on the pixel offsets of the block.
+    """
+    if not os.path.isfile(rds.name) or rds.driver != 'GTiff' or len(set(rds.block_shapes)) != 1:
+        return None
+    interleaved = rds.tags(ns='IMAGE_STRUCTURE').get('INTERLEAVE') == 'PIXEL'
+    bands = [1] if interleaved else range(1, rds.count + 1)
+    hashes = {}
+    with open(rds.name, 'rb') as f:
+        for (row, col), window in rds.block_windows(1):
+            hasher = new_hasher()
+            for band in bands:
+                _update_with_range(hasher, f, _tiff_block_range(rds, band, row, col))
+            hashes[_chunk_key((window.row_off, window.col_off))] = hasher.hexdigest()
+    return ChunkHashes(_tiff_encoding(rds), list(rds.block_shapes[0]), hashes)
+
+
+def zarr_chunk_hashes(store_path: Path, name: Hashable) -> Optional[ChunkHashes]:
+    array_path = Path(store_path) / str(name)
+    meta = _zarr_array_metadata(array_path)
+    if meta is None:
+        return None
+    shape, chunk_shape = meta[0]['shape'], _zarr_chunk_shape(meta[0])
+    hashes = {}
+    for key, file_path in _iter_zarr_chunks(array_path):
+        region = _zarr_chunk_region(key, shape, chunk_shape)
+        if region is None:
+            return None
+        hasher = new_hasher()
+        hasher.update(file_path.read_bytes())
+        hashes[_chunk_key(tuple(s.start for s in region))] = hasher.hexdigest()
+    return ChunkHashes(to_json_value(meta), list(chunk_shape), hashes)
+
+
+def hdf5_chunk_hashes(file_path: Path, name: Hashable) -> Optional[ChunkHashes]:
+    if h5py is None or not h5py.is_hdf5(file_path):
+        return None
+    with h5py.File(file_path, 'r') as h5:
+        dataset = h5.get(str(name))
+        if not isinstance(dataset, h5py.Dataset):
+            return None
+        encoding, chunk_shape = to_json_value(_hdf5_encoding(dataset)), list(dataset.chunks or dataset.shape)
+        chunks = dict(_iter_hdf5_chunks(dataset))
+    hashes = {}
+    with open(file_path, 'rb') as f:
+        for start, byte_range in chunks.items():
+            hasher = new_hasher()
+            hasher.update(byte_range[2].to_bytes(8, 'little'))
+            _update_with_range(hasher, f, byte_range)
+            hashes[_chunk_key(start)] = hasher.hexdigest()
+    return ChunkHashes(encoding, chunk_shape, hashes)
+
+
+def memmap_zarr_chunk(store_path: Any, name: Hashable, region: Optional[Region]) -> Optional[np.ndarray]:
+    """
+    Returns the values of the array `name` in `region` of a local zarr store as a read-only memory map of the chunk
+    object holding them, if the region is a single chunk and the array is stored uncompressed and without filters.
+    Returns None if xarray would decode the values to something else than what is stored.
+    """
+    if region is None or not isinstance(store_path, (str, Path)):
+        return None
+    array_path = Path(store_path) / str(name)
+    meta = _zarr_array_metadata(array_path)
+    if meta is None:
+        return None
+    layout = _uncompressed_zarr_layout(meta[0])
+    if layout is None:
+        return None
+    dtype, order, prefix, separator = layout
+    shape, chunk_shape = meta[0]['shape'], _zarr_chunk_shape(meta[0])
+    if len(shape) == 0 or len(region) != len(shape) or dtype.kind not in 'biuf' or \
+            has_value_decoding({'_FillValue': meta[0].get('fill_value'), **meta[1]}, dtype):
+        return None
+    if any(s.start % c != 0 or s.stop - s.start != c for s, c in zip(region, chunk_shape)):
+        return None
+    chunk_path = array_path / (prefix + separator.join(str(s.start // c) for s, c in zip(region, chunk_shape)))
+    if not chunk_path.is_file() or chunk_path.stat().st_size != math.prod(chunk_shape) * dtype.itemsize:
+        return None
+    chunk = np.memmap(chunk_path, dtype, mode='r', shape=tuple(chunk_shape), order=order)
+    return chunk[tuple(slice(0, min(c, n - s.start)) for s, c, n in zip(region, chunk_shape, shape))]
+
+
+def has_value_decoding(attrs: Mapping[str, Any], dtype: np.dtype) -> bool:
+    """
+    Whether xarray decodes stored values of `dtype` with the CF attributes `attrs` into other values. A NaN fill
+    value of floats masks nothing which is not NaN already.
+    """
+    fill_value = attrs.get('_FillValue')
+    is_nan_fill = dtype.kind == 'f' and fill_value is not None and \
+        bool(np.all(np.isnan(np.asarray(fill_value, dtype=float))))
+    return any(k in attrs for k in CF_DECODING_ATTRS if k != '_FillValue') or \
+        (fill_value is not None and not is_nan_fill)
+
+
+def differing_chunks_of_hashes(received: Optional[ChunkHashes], approved: Optional[ChunkHashes]) \
+        -> Optional[List[Tuple[int, ...]]]:
+    """
+    Returns the offsets of the chunks whose hashes differ, or None if both are not encoded the same way.
+    """
+    if received is None or approved is None or received.encoding != approved.encoding or \
+            received.chunk_shape != approved.chunk_shape:
+        return None
+    keys = received.hashes.keys() | approved.hashes.keys()
+    return sorted(tuple(int(i) for i in k.split(',') if i) for k in keys
+                  if received.hashes.get(k) != approved.hashes.get(k))
+
+
+def chunk_region(start: Tuple[int, ...], chunk_shape: List[int]) -> Region:
+    return tuple(slice(s, s + c) for s, c in zip(start, chunk_shape))
+
+
+def tiff_block_window(start: Tuple[int, int], rds: DatasetReader) -> Window:
+    block_height, block_width = rds.block_shapes[0]
+    row, col = start
+    return Window(col, row, min(block_width, rds.width - col), min(block_height, rds.height - row))
+
+
+def _chunk_key(start: Tuple[int, ...]) -> str:
+    return ','.join(str(int(s)) for s in start)
+
+
+def _update_with_range(hasher, f, byte_range: Optional[Tuple[int, ...]]) -> None:
+    if byte_range is None:
+        hasher.update(b'\0' * 8)
+        return
+    hasher.update(byte_range[1].to_bytes(8, 'little'))
+    hasher.update(_read_range(f, byte_range))
+
+
+def _tiff_encoding(rds: DatasetReader) -> Any:
+    return to_json_value(dict(shape=rds.shape, count=rds.count, dtypes=rds.dtypes, block_shapes=rds.block_shapes,
+                              structure=rds.tags(ns='IMAGE_STRUCTURE'), byte_order=_tiff_byte_order(rds.name)))
+
+
+def _same_tiff_encoding(received_rds: DatasetReader, approved_rds: DatasetReader) -> bool:
+    return all(os.path.isfile(rds.name) and rds.driver == 'GTiff' for rds in [received_rds, approved_rds]) and \
+        received_rds.shape == approved_rds.shape and received_rds.count == approved_rds.count and \
+        received_rds.dtypes == approved_rds.dtypes and received_rds.block_shapes == approved_rds.block_shapes and \
+        len(set(approved_rds.block_shapes)) == 1 and \
+        received_rds.tags(ns='IMAGE_STRUCTURE') == approved_rds.tags(ns='IMAGE_STRUCTURE') and \
+        _tiff_byte_order(received_rds.name) == _tiff_byte_order(approved_rds.name)
+
+
+def _tiff_byte_order(file_path: str) -> bytes:
+    with open(file_path, 'rb') as f:
+        return f.read(2)
+
+
+def _tiff_block_range(rds: DatasetReader, band: int, row: int, col: int) -> Optional[Tuple[int, int]]:
+    offset = rds.get_tag_item(f'BLOCK_OFFSET_{col}_{row}', 'TIFF', bidx=band)
+    size = rds.get_tag_item(f'BLOCK_SIZE_{col}_{row}', 'TIFF', bidx=band)
+    if not offset or not size:
+        return None
+    return int(offset), int(size)
+
+
+def _same_byte_range(received_file, received_range: Optional[Tuple[int, Any]],
+                     approved_file, approved_range: Optional[Tuple[int, Any]]) -> bool:
+    if received_range is None or approved_range is None:
+        return received_range is None and approved_range is None
+    if received_range[1:] != approved_range[1:]:
+        return False
+    return _read_range(received_file, received_range) == _read_range(approved_file, approved_range)
+
+
+def _read_range(f, byte_range: Tuple[int, ...]) -> bytes:
+    f.seek(byte_range[0])
+    return f.read(byte_range[1])
+
+
+def _same_file_content(received_path: Path, approved_path: Path) -> bool:
+    return received_path.stat().st_size == approved_path.stat().st_size and \
+        received_path.read_bytes() == approved_path.read_bytes()
+
+
+def _zarr_array_metadata(array_path: Path) -> Optional[Tuple[Mapping, Mapping]]:
+    if (array_path / '.zarray').is_file():
+        meta = json.loads((array_path / '.zarray').read_text())
+        attrs_path = array_path / '.zattrs'
+        attrs = json.loads(attrs_path.read_text()) if attrs_path.is_file() else {}
+    elif (array_path / 'zarr.json').is_file():
+        meta = json.loads((array_path / 'zarr.json').read_text())
+        if meta.get('node_type') != 'array' or meta.get('chunk_grid', {}).get('name') != 'regular':
+            return None
+        attrs = meta.pop('attributes', {})
+        meta.pop('dimension_names', None)
+    else:
+        return None
+    return meta, {k: attrs[k] for k in CF_DECODING_ATTRS if k in attrs}
+
+
+def _uncompressed_zarr_layout(meta: Mapping) -> Optional[Tuple[np.dtype, str, str, str]]:
+    """Returns dtype, order, chunk key prefix and separator of an array stored without any compression."""
+    if meta.get('zarr_format') == 2:
+        if meta.get('compressor') is not None or meta.get('filters'):
+            return None
+        return np.dtype(meta['dtype']), meta.get('order', 'C'), '', meta.get('dimension_separator', '.')
+    codecs = meta.get('codecs', [])
+    if len(codecs) != 1 or codecs[0].get('name') != 'bytes':
+        return None
+    endian = codecs[0].get('configuration', {}).get('endian', 'little')
+    dtype = np.dtype(meta['data_type']).newbyteorder('<' if endian == 'little' else '>')
+    key_encoding = meta.get('chunk_key_encoding', {'name': 'default'})
+    separator = key_encoding.get('configuration', {}).get('separator')
+    if key_encoding['name'] == 'default':
+        return dtype, 'C', 'c' + (separator or '/'), separator or '/'
+    if key_encoding['name'] == 'v2':
+        return dtype, 'C', '', separator or '.'
+    return None
+
+
+def _zarr_chunk_shape(meta: Mapping) -> List[int]:
+    if 'chunks' in meta:
+        return meta['chunks']
+    return meta['chunk_grid']['configuration']['chunk_shape']
+
+
+def _iter_zarr_chunks(array_path: Path) -> Iterator[Tuple[str, Path]]:
+    for root, dirs, files in os.walk(array_path):
+        for file_name in files:
+            if file_name not in ZARR_METADATA_FILES:
+                file_path = Path(root) / file_name
+                yield file_path.relative_to(array_path).as_posix(), file_path
+
+
+def _zarr_chunk_region(key: str, shape: List[int], chunk_shape: List[int]) -> Optional[Region]:
+    parts = re.split(r'[./]', key)
+    if parts[0] == 'c':
+        parts = parts[1:]
+    if len(shape) == 0:
+        return () if parts in ([], ['0']) else None
+    if len(parts) != len(shape) or not all(p.isdigit() for p in parts):
+        return None
+    return tuple(slice(int(i) * c, (int(i) + 1) * c) for i, c in zip(parts, chunk_shape))
+
+
+def _hdf5_encoding(dataset) -> Tuple:
+    attrs = tuple((k, repr(np.asarray(dataset.attrs[k]).tolist())) for k in CF_DECODING_ATTRS if k in dataset.attrs)
+    return dataset.shape, dataset.dtype, dataset.chunks, dataset.compression, dataset.compression_opts, \
+        dataset.shuffle, dataset.fletcher32, dataset.scaleoffset, attrs
+
+
+def _iter_hdf5_chunks(dataset) -> Iterator[Tuple[Tuple[int, ...], Tuple[int, int, int]]]:
+    if dataset.chunks is None:
+        offset = dataset.id.get_offset()
+        if offset is not None:
+            yield (0,) * len(dataset.shape), (offset, dataset.id.get_storage_size(), 0)
+        return
+    for i in range(dataset.id.get_num_chunks()):
+        info = dataset.id.get_chunk_info(i)
+        yield info.chunk_offset, (info.byte_offset, info.size, info.filter_mask)
@@ -0,0 +1,81 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Iterator, Tuple, Union
+
+try:
+    import xxhash
+except ImportError:  # pragma: no cover
+    xxhash = None
+
+DIGEST_CHUNK_SIZE = 1 << 20
+
+PathConvertible = Union[Path, str]
+
+
+def new_hasher():
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def file_digest(file_path: PathConvertible, chunk_size: int = DIGEST_CHUNK_SIZE) -> str:
+    hasher = new_hasher()
+    _update_with_file(hasher, Path(file_path), chunk_size)
+    return hasher.hexdigest()
+
+
+def bytes_digest(data) -> str:
+    hasher = new_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def tree_digest(dir_path: PathConvertible, chunk_size: int = DIGEST_CHUNK_SIZE) -> str:
+    hasher = new_hasher()
+    for relative_path, file_path in iter_tree_files(Path(dir_path)):
+        hasher.update(relative_path.encode())
+        hasher.update(file_path.stat().st_size.to_bytes(8, 'little'))
+        _update_with_file(hasher, file_path, chunk_size)
+    return hasher.hexdigest()
+
+
+def artifact_digest(path: PathConvertible) -> str:
+    path = Path(path)
+    if path.is_dir():
+        return tree_digest(path)
+    return file_digest(path)
+
+
+def iter_tree_files(dir_path: Path) -> Iterator[Tuple[str, Path]]:
+    for root, dirs, files in os.walk(dir_path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = Path(root) / name
+            yield file_path.relative_to(dir_path).as_posix(), file_path
+
+
+def are_byte_identical(received_path: PathConvertible, approved_path: PathConvertible) -> bool:
+    return have_same_layout(received_path, approved_path) and \
+        artifact_digest(received_path) == artifact_digest(approved_path)
+
+
+def have_same_layout(received_path: PathConvertible, approved_path: PathConvertible) -> bool:
+    """Whether both artifacts consist of the same files of the same sizes, which byte identical ones do."""
+    received_path = Path(received_path)
+    approved_path = Path(approved_path)
+    if received_path.is_dir() != approved_path.is_dir():
+        return False
+    if received_path.is_dir():
+        return _tree_layout(received_path) == _tree_layout(approved_path)
+    return received_path.stat().st_size == approved_path.stat().st_size
+
+
+def _tree_layout(dir_path: Path):
+    return [(relative_path, file_path.stat().st_size) for relative_path, file_path in iter_tree_files(dir_path)]
+
+
+def _update_with_file(hasher, file_path: Path, chunk_size: int) -> None:
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
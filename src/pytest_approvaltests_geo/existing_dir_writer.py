@@ -1,15 +1,19 @@
 import shutil
 from pathlib import Path
+from typing import Sequence
 
 from approvaltests import Writer
 
+from pytest_approvaltests_geo.file_links import link_or_copy_tree, DEFAULT_LINK_MODES
+
 
 class ExistingDirWriter(Writer):
-    def __init__(self, dir_name: str) -> None:
+    def __init__(self, dir_name: str, link_modes: Sequence[str] = DEFAULT_LINK_MODES) -> None:
         self.dir_name = dir_name
+        self.link_modes = link_modes
 
     def write_received_file(self, received_file: str) -> str:
         if Path(received_file).exists():
             shutil.rmtree(received_file)
-        shutil.copytree(self.dir_name, received_file)
+        link_or_copy_tree(self.dir_name, received_file, self.link_modes)
         return received_file
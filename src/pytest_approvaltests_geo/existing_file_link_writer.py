@@ -0,0 +1,16 @@
+from typing import Sequence
+
+from approvaltests import ExistingFileWriter, Options
+
+from pytest_approvaltests_geo.file_links import link_or_copy_file, DEFAULT_LINK_MODES
+
+
+class ExistingFileLinkWriter(ExistingFileWriter):
+    def __init__(self, file_name: str, options: Options, link_modes: Sequence[str] = DEFAULT_LINK_MODES) -> None:
+        super().__init__(file_name, options)
+        self.link_modes = link_modes
+
+    def write_received_file(self, received_file: str) -> str:
+        if self.options.has_scrubber():
+            return super().write_received_file(received_file)
+        return link_or_copy_file(self.file_name, received_file, self.link_modes)
@@ -1,6 +1,8 @@
 from dataclasses import dataclass
 from typing import Mapping
 
+import numpy as np
+
 
 @dataclass
 class Tolerance:
@@ -9,3 +11,13 @@ class Tolerance:
 
     def to_kwargs(self) -> Mapping:
         return dict(rtol=self.rel, atol=self.abs)
+
+
+def count_tolerance_violations(received: np.ndarray, approved: np.ndarray, tolerance: Tolerance) -> int:
+    if any(a.dtype.kind in 'MmOSU' for a in [received, approved]):
+        is_close = np.asarray(received == approved)
+        if received.dtype.kind in 'Mm' and approved.dtype.kind in 'Mm':
+            is_close |= np.isnat(received) & np.isnat(approved)
+    else:
+        is_close = np.isclose(received, approved, equal_nan=True, **tolerance.to_kwargs())
+    return is_close.size - np.count_nonzero(is_close)
@@ -1,18 +1,258 @@
+import math
+import os
+import struct
+from collections import deque
+from concurrent.futures import wait
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Iterator, Sequence, Iterable, List, Optional, Any, BinaryIO, Hashable
 
-import rasterio
+import numpy as np
 import rioxarray
+from rasterio.io import DatasetReader
+from rasterio.windows import Window
 from xarray import DataArray
 
+from pytest_approvaltests_geo.differs.raw_chunks import has_value_decoding
+from pytest_approvaltests_geo.parallel import WorkerThreadPoolExecutor, worker_resources, raster_handle_key
+from pytest_approvaltests_geo.remote_data import open_raster, reopenable_source
+
 
 @contextmanager
 def read_array_and_tags(file_path: Path) -> Tuple[DataArray, Dict]:
+    with open_raster(file_path) as rds:
+        t = rds.tags()
+        a = rioxarray.open_rasterio(rds)
+        try:
+            yield a, t
+        finally:
+            a.close()
+
+
+def iter_block_windows(rds: DatasetReader, max_window_bytes: int) -> Iterator[Window]:
+    """
+    Yields windows covering the raster which are aligned to its native blocks. Neighbouring blocks are
+    grouped into one window as long as all bands of it fit into `max_window_bytes`, but a window never
+    gets smaller than a single native block.
+    """
+    block_height, block_width = rds.block_shapes[0]
+    bytes_per_pixel = max(rds.count, 1) * max(np.dtype(dt).itemsize for dt in rds.dtypes)
+    max_pixels = max(max_window_bytes // bytes_per_pixel, 1)
+    block_height = min(block_height, rds.height)
+    block_width = min(block_width, rds.width)
+
+    if rds.width * block_height <= max_pixels:
+        window_width = rds.width
+        window_height = max(max_pixels // rds.width // block_height, 1) * block_height
+    else:
+        window_height = block_height
+        window_width = max(max_pixels // block_height // block_width, 1) * block_width
+
+    for row_off in range(0, rds.height, window_height):
+        for col_off in range(0, rds.width, window_width):
+            yield Window(col_off, row_off,
+                         min(window_width, rds.width - col_off),
+                         min(window_height, rds.height - row_off))
+
+
+def shared_overview_levels(received_rds: DatasetReader, approved_rds: DatasetReader) -> List[Tuple[int, int]]:
+    """
+    Returns the overview levels of both rasters as `(level, decimation factor)`, coarsest first, if all of their
+    bands carry the same overviews. Rasters with differing overview pyramids have no shared levels.
+    """
+    factors = approved_rds.overviews(1)
+    if any(rds.overviews(band) != factors for rds in [received_rds, approved_rds]
+           for band in range(1, rds.count + 1)):
+        return []
+    return list(reversed(list(enumerate(factors))))
+
+
+def open_overview(source: Any, overview_level: Optional[int] = None) -> DatasetReader:
+    source = reopenable_source(source) if isinstance(source, str) else source
+    if overview_level is None:
+        return open_raster(source)
+    return open_raster(source, overview_level=overview_level)
+
+
+BandGroup = Optional[List[int]]
+
+
+def band_groups_of(rds: DatasetReader) -> List[BandGroup]:
+    """
+    Splits the bands of a raster into groups which can be decoded independently. Pixel interleaved rasters
+    store all bands in the same blocks, so they are read as a whole.
+    """
+    if rds.count == 1 or rds.tags(ns='IMAGE_STRUCTURE').get('INTERLEAVE') == 'PIXEL':
+        return [None]
+    return [[band] for band in range(1, rds.count + 1)]
+
+
+def iter_windows_read_concurrently(executor: WorkerThreadPoolExecutor, sources: Sequence[str],
+                                   windows: Iterable[Window], band_groups: Sequence[BandGroup] = (None,),
+                                   max_in_flight: int = 2, overview_level: Optional[int] = None) \
+        -> Iterator[Tuple[Window, List[np.ndarray]]]:
+    """
+    Reads every window of all sources on the threads of `executor`, with the dataset handles each of them keeps,
+    and yields the windows in order with one array of all bands per source. Band groups of a window are read as
+    separate tasks and stacked again. At most `max_in_flight` windows are read ahead of the consumer.
+    """
+    keys = [raster_handle_key(source, overview_level) for source in sources]
+    windows = iter(windows)
+    in_flight = deque()
+
+    def _submit_next() -> None:
+        for window in windows:
+            in_flight.append((window, [executor.submit(_read_window, key, source, overview_level, window, bands)
+                                       for key, source in zip(keys, sources) for bands in band_groups]))
+            return
+
     try:
-        with rasterio.open(file_path) as rds:
-            t = rds.tags()
-            a = rioxarray.open_rasterio(rds)
-        yield a, t
+        for _ in range(max_in_flight):
+            _submit_next()
+        while in_flight:
+            window, futures = in_flight.popleft()
+            reads = [future.result() for future in futures]
+            _submit_next()
+            n = len(band_groups)
+            yield window, [_stack_bands(reads[i * n:(i + 1) * n]) for i in range(len(sources))]
     finally:
-        a.close()
+        for _, futures in in_flight:
+            for future in futures:
+                future.cancel()
+        wait([future for _, futures in in_flight for future in futures])
+
+
+def _read_window(key: Hashable, source: str, overview_level: Optional[int], window: Window,
+                 bands: BandGroup) -> np.ndarray:
+    rds = worker_resources().handle(key, lambda: open_overview(source, overview_level))
+    return rds.read(bands, window=window)
+
+
+def _stack_bands(reads: List[np.ndarray]) -> np.ndarray:
+    return reads[0] if len(reads) == 1 else np.concatenate(reads, axis=0)
+
+
+def memmap_raster(rds: DatasetReader) -> Optional[np.ndarray]:
+    """
+    Returns all bands of a local, uncompressed GeoTIFF whose strips are stored contiguously as a read-only
+    `(band, row, column)` view of a memory map of the file, the same array `rds.read()` decodes. Returns None for
+    any other layout, e.g. compressed or tiled rasters, which have to be decoded.
+    """
+    if rds.driver != 'GTiff' or not os.path.isfile(rds.name) or rds.compression is not None or \
+            len(set(rds.dtypes)) != 1 or len(set(rds.block_shapes)) != 1 or rds.block_shapes[0][1] != rds.width:
+        return None
+    structure = rds.tags(ns='IMAGE_STRUCTURE')
+    if 'NBITS' in structure:
+        return None
+    with open(rds.name, 'rb') as f:
+        byte_order = f.read(2)
+    if byte_order not in (b'II', b'MM'):
+        return None
+    dtype = np.dtype(rds.dtypes[0]).newbyteorder('<' if byte_order == b'II' else '>')
+    interleaved = rds.count > 1 and structure.get('INTERLEAVE') == 'PIXEL'
+    row_bytes = rds.width * dtype.itemsize * (rds.count if interleaved else 1)
+    bands = [1] if interleaved else range(1, rds.count + 1)
+    band_ranges = [_contiguous_strips(rds, band, row_bytes) for band in bands]
+    if None in band_ranges:
+        return None
+    offset = band_ranges[0][0]
+    band_stride = band_ranges[1][0] - offset if len(band_ranges) > 1 else band_ranges[0][1]
+    if any(start != offset + i * band_stride or size > band_stride for i, (start, size) in enumerate(band_ranges)):
+        return None
+    file_map = np.memmap(rds.name, mode='r')
+    if interleaved:
+        return np.ndarray((rds.height, rds.width, rds.count), dtype, file_map, offset).transpose(2, 0, 1)
+    return np.ndarray((rds.count, rds.height, rds.width), dtype, file_map, offset,
+                      (band_stride, row_bytes, dtype.itemsize))
+
+
+def _contiguous_strips(rds: DatasetReader, band: int, row_bytes: int) -> Optional[Tuple[int, int]]:
+    rows_per_strip = rds.block_shapes[0][0]
+    n_strips = math.ceil(rds.height / rows_per_strip)
+    start = end = None
+    for strip in range(n_strips):
+        offset = rds.get_tag_item(f'BLOCK_OFFSET_0_{strip}', 'TIFF', bidx=band)
+        size = rds.get_tag_item(f'BLOCK_SIZE_0_{strip}', 'TIFF', bidx=band)
+        if not offset or not size or (end is not None and int(offset) != end) or \
+                (strip < n_strips - 1 and int(size) != rows_per_strip * row_bytes):
+            return None
+        start = int(offset) if start is None else start
+        end = int(offset) + int(size)
+    if end - start < rds.height * row_bytes:
+        return None
+    return start, end - start
+
+
+NETCDF3_DTYPES = {1: 'i1', 2: 'S1', 3: '>i2', 4: '>i4', 5: '>f4', 6: '>f8'}
+_NETCDF3_DIMENSION, _NETCDF3_VARIABLE, _NETCDF3_ATTRIBUTE = 10, 11, 12
+
+
+def memmap_netcdf3_variable(file_path: Any, name: Hashable, region: Optional[Tuple[slice, ...]] = None) \
+        -> Optional[np.ndarray]:
+    """
+    Returns the values of the variable `name`, or of its `region`, in a local NetCDF3 file with the classic or
+    64-bit offset format as a read-only memory map of the file. Returns None if xarray would decode the values to
+    something else than what is stored, e.g. characters, scaled or masked values and times, and for record
+    variables, whose values are interleaved with those of the other record variables.
+    """
+    if not isinstance(file_path, (str, Path)) or not os.path.isfile(file_path):
+        return None
+    with open(file_path, 'rb') as f:
+        variable = _netcdf3_variables(f).get(str(name))
+    if variable is None:
+        return None
+    shape, dtype, attrs, begin = variable
+    if dtype.kind not in 'iuf' or math.prod(shape) == 0 or has_value_decoding(attrs, dtype):
+        return None
+    values = np.memmap(file_path, dtype, mode='r', offset=begin, shape=shape)
+    return values if region is None else values[region]
+
+
+def _netcdf3_variables(f: BinaryIO) -> Dict[str, Tuple[Tuple[int, ...], np.dtype, Dict[str, Any], int]]:
+    magic = f.read(4)
+    if magic not in (b'CDF\x01', b'CDF\x02'):
+        return {}
+    offset_format = '>q' if magic[3] == 2 else '>i'
+    f.read(4)
+    dimensions = [(_read_netcdf3_name(f), _read_int(f)) for _ in range(_read_list_header(f, _NETCDF3_DIMENSION))]
+    _read_netcdf3_attributes(f)
+    variables = {}
+    for _ in range(_read_list_header(f, _NETCDF3_VARIABLE)):
+        name = _read_netcdf3_name(f)
+        dimension_ids = [_read_int(f) for _ in range(_read_int(f))]
+        attrs = _read_netcdf3_attributes(f)
+        nc_type = _read_int(f)
+        _read_int(f)
+        begin = struct.unpack(offset_format, f.read(struct.calcsize(offset_format)))[0]
+        shape = tuple(dimensions[i][1] for i in dimension_ids)
+        if nc_type in NETCDF3_DTYPES and 0 not in shape[:1]:
+            variables[name] = shape, np.dtype(NETCDF3_DTYPES[nc_type]), attrs, begin
+    return variables
+
+
+def _read_netcdf3_attributes(f: BinaryIO) -> Dict[str, Any]:
+    attrs = {}
+    for _ in range(_read_list_header(f, _NETCDF3_ATTRIBUTE)):
+        name = _read_netcdf3_name(f)
+        nc_type, n = _read_int(f), _read_int(f)
+        dtype = np.dtype(NETCDF3_DTYPES.get(nc_type, 'i1'))
+        values = f.read(n * dtype.itemsize)
+        f.read(-len(values) % 4)
+        attrs[name] = np.frombuffer(values, dtype)
+    return attrs
+
+
+def _read_list_header(f: BinaryIO, tag: int) -> int:
+    list_tag, n = _read_int(f), _read_int(f)
+    return n if list_tag == tag else 0
+
+
+def _read_netcdf3_name(f: BinaryIO) -> str:
+    n = _read_int(f)
+    name = f.read(n)
+    f.read(-n % 4)
+    return name.decode('utf-8')
+
+
+def _read_int(f: BinaryIO) -> int:
+    return struct.unpack('>i', f.read(4))[0]
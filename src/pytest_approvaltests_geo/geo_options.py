@@ -1,3 +1,4 @@
+import os
 import tempfile
 from os import PathLike
 from pathlib import Path
@@ -8,12 +9,21 @@ from approvaltests import Options, ScenarioNamer, Namer
 from approvaltests.namer import NamerBase
 from xarray import DataArray
 
+from pytest_approvaltests_geo.differs.difference import DEFAULT_WORST_PIXELS
+from pytest_approvaltests_geo.differs.lazy_comparison import LazyComparison, Chunks
+from pytest_approvaltests_geo.file_links import DEFAULT_LINK_MODES
 from pytest_approvaltests_geo.float_utils import Tolerance
+from pytest_approvaltests_geo.parallel import ParallelVerification
+from pytest_approvaltests_geo.remote_data import DEFAULT_RECEIVED_DIRECTORY
 from pytest_approvaltests_geo.scrubbers import RecursiveScrubber
 
 TifWriter = Callable[[PathLike, DataArray], None]
 
 
+def _write_raster(file: PathLike, array: DataArray) -> None:
+    array.rio.to_raster(file)
+
+
 class GeoOptions(Options):
     _TAGS_SCRUBBER_FUNC = "tags_scrubber_func"
     _COORDS_SCRUBBER_FUNC = "coords_scrubber_func"
@@ -22,6 +32,17 @@ class GeoOptions(Options):
     _TMP_DIRECTORY = "tmp_directory"
     _TOLERANCE = "tolerance"
     _TIF_WRITER = "tif_writer"
+    _MEMORY_LIMIT = "memory_limit"
+    _LAZY_COMPARISON = "lazy_comparison"
+    _PARALLEL_VERIFICATION = "parallel_verification"
+    _RECEIVED_LINK_MODES = "received_link_modes"
+    _RASTER_IN_MEMORY = "raster_in_memory"
+    _APPROVED_MANIFESTS = "approved_manifests"
+    _DECODE_THREADS = "decode_threads"
+    _OVERVIEW_COMPARISON = "overview_comparison"
+    _RECEIVED_DIRECTORY = "received_directory"
+    _WORST_PIXELS = "worst_pixels"
+    _BLOCK_HEATMAP = "block_heatmap"
 
     @classmethod
     def from_options(cls, options: Options) -> "GeoOptions":
@@ -75,7 +96,7 @@ class GeoOptions(Options):
 
     @property
     def tif_writer(self) -> TifWriter:
-        return self.fields.get(GeoOptions._TIF_WRITER, lambda f, a: a.rio.to_raster(f))
+        return self.fields.get(GeoOptions._TIF_WRITER, _write_raster)
 
     def with_approved_directory(self, directory: Path):
         return GeoOptions({**self.fields, **{GeoOptions._APPROVED_DIRECTORY: directory}})
@@ -89,4 +110,95 @@ class GeoOptions(Options):
 
     @property
     def tmp_directory(self) -> Path:
-        return self.fields.get(GeoOptions._TMP_DIRECTORY, Path(tempfile.mkdtemp()))
+        if GeoOptions._TMP_DIRECTORY not in self.fields:
+            return Path(tempfile.mkdtemp())
+        return self.fields[GeoOptions._TMP_DIRECTORY]
+
+    def with_memory_limit(self, n_bytes: int):
+        return GeoOptions({**self.fields, **{GeoOptions._MEMORY_LIMIT: n_bytes}})
+
+    @property
+    def memory_limit(self) -> Optional[int]:
+        return self.fields.get(GeoOptions._MEMORY_LIMIT)
+
+    def with_lazy_comparison(self, scheduler: str = "threads", num_workers: Optional[int] = None,
+                             chunks: Chunks = "auto"):
+        return GeoOptions({**self.fields, **{GeoOptions._LAZY_COMPARISON: LazyComparison(scheduler, num_workers,
+                                                                                          chunks)}})
+
+    @property
+    def lazy_comparison(self) -> Optional[LazyComparison]:
+        return self.fields.get(GeoOptions._LAZY_COMPARISON)
+
+    def with_parallel_verification(self, max_workers: Optional[int] = None, use_processes: bool = False):
+        return GeoOptions({**self.fields, **{GeoOptions._PARALLEL_VERIFICATION: ParallelVerification(max_workers,
+                                                                                                     use_processes)}})
+
+    @property
+    def parallel_verification(self) -> Optional[ParallelVerification]:
+        return self.fields.get(GeoOptions._PARALLEL_VERIFICATION)
+
+    def with_received_link_modes(self, *link_modes: str):
+        return GeoOptions({**self.fields, **{GeoOptions._RECEIVED_LINK_MODES: link_modes}})
+
+    @property
+    def received_link_modes(self) -> Sequence[str]:
+        return self.fields.get(GeoOptions._RECEIVED_LINK_MODES, DEFAULT_LINK_MODES)
+
+    def with_raster_in_memory(self, in_memory: bool = True):
+        return GeoOptions({**self.fields, **{GeoOptions._RASTER_IN_MEMORY: in_memory}})
+
+    @property
+    def raster_in_memory(self) -> bool:
+        """
+        Rasters are written into GDAL's in-memory file system by default only with the default tif writer, as
+        custom writers may not be able to write to a `/vsimem` name.
+        """
+        return self.fields.get(GeoOptions._RASTER_IN_MEMORY, GeoOptions._TIF_WRITER not in self.fields)
+
+    def with_approved_manifests(self, enabled: bool = True):
+        return GeoOptions({**self.fields, **{GeoOptions._APPROVED_MANIFESTS: enabled}})
+
+    @property
+    def approved_manifests(self) -> bool:
+        return self.fields.get(GeoOptions._APPROVED_MANIFESTS, False)
+
+    def with_decode_threads(self, n_threads: Optional[int] = None):
+        return GeoOptions({**self.fields, **{GeoOptions._DECODE_THREADS: n_threads or os.cpu_count() or 1}})
+
+    @property
+    def decode_threads(self) -> Optional[int]:
+        return self.fields.get(GeoOptions._DECODE_THREADS)
+
+    def with_overview_comparison(self, enabled: bool = True):
+        return GeoOptions({**self.fields, **{GeoOptions._OVERVIEW_COMPARISON: enabled}})
+
+    @property
+    def overview_comparison(self) -> bool:
+        """
+        Whether shared GeoTIFF overviews are compared first to find differing regions early. Overviews only select
+        which full resolution windows are compared first: comparisons fail and reports are made at full resolution,
+        as averaged overview pixels may violate the tolerance although none of the original pixels does.
+        """
+        return self.fields.get(GeoOptions._OVERVIEW_COMPARISON, False)
+
+    def with_received_directory(self, directory: Path):
+        return GeoOptions({**self.fields, **{GeoOptions._RECEIVED_DIRECTORY: Path(directory)}})
+
+    @property
+    def received_directory(self) -> Path:
+        return self.fields.get(GeoOptions._RECEIVED_DIRECTORY, DEFAULT_RECEIVED_DIRECTORY)
+
+    def with_worst_pixels(self, k: int = DEFAULT_WORST_PIXELS):
+        return GeoOptions({**self.fields, **{GeoOptions._WORST_PIXELS: k}})
+
+    @property
+    def worst_pixels(self) -> int:
+        return self.fields.get(GeoOptions._WORST_PIXELS, DEFAULT_WORST_PIXELS)
+
+    def with_block_heatmap(self, enabled: bool = True):
+        return GeoOptions({**self.fields, **{GeoOptions._BLOCK_HEATMAP: enabled}})
+
+    @property
+    def block_heatmap(self) -> bool:
+        return self.fields.get(GeoOptions._BLOCK_HEATMAP, False)
@@ -0,0 +1,205 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, TextIO
+
+from approvaltests import Writer
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+WRITE_RECEIVED = "write_received"
+DIGEST = "digest"
+OPEN = "open"
+SCRUB = "scrub"
+COMPARE_VALUES = "compare_values"
+DIFF_STATS = "diff_stats"
+REPORT = "report"
+
+PROC_IO = "/proc/self/io"
+
+
+@dataclass
+class VerificationRecord:
+    """
+    What one verification spent its time and resources on. `phases` holds the exclusive seconds of every
+    phase, i.e. without nested phases, and `other` the remaining seconds spent in approvaltests and the plugin.
+    Byte counts are read and written bytes of the whole process, and `peak_rss_growth` is how much the peak
+    resident set size of the process grew; both are None where the platform does not provide them.
+    """
+    name: str
+    test: str = ""
+    passed: bool = True
+    seconds: float = 0.0
+    phases: Dict[str, float] = field(default_factory=dict)
+    pixels: int = 0
+    bytes_read: Optional[int] = None
+    bytes_written: Optional[int] = None
+    peak_rss_growth: Optional[int] = None
+
+    @property
+    def other(self) -> float:
+        return max(self.seconds - sum(self.phases.values()), 0.0)
+
+
+VerificationListener = Callable[[VerificationRecord], None]
+
+_listeners: List[VerificationListener] = []
+
+
+def add_verification_listener(listener: VerificationListener) -> None:
+    _listeners.append(listener)
+
+
+def remove_verification_listener(listener: VerificationListener) -> None:
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def has_verification_listeners() -> bool:
+    return len(_listeners) > 0
+
+
+class VerificationRecorder:
+    """
+    Collects a `VerificationRecord` while a verification runs and passes it to all verification listeners
+    when it is finished. Phases may nest and may be entered from several threads at once.
+    """
+
+    def __init__(self, name: str):
+        self.record = VerificationRecord(name, _current_test())
+        self._lock = threading.Lock()
+        self._stacks = threading.local()
+        self._start = time.perf_counter()
+        self._start_io = _io_counters()
+        self._start_peak_rss = _peak_rss()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        stack = self._stack()
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.record.phases[name] = self.record.phases.get(name, 0.0) + elapsed - nested
+
+    def add_pixels(self, n: int) -> None:
+        with self._lock:
+            self.record.pixels += int(n)
+
+    def finish(self, passed: bool) -> VerificationRecord:
+        self.record.passed = passed
+        self.record.seconds = time.perf_counter() - self._start
+        io_counters = _io_counters()
+        if io_counters is not None and self._start_io is not None:
+            self.record.bytes_read = io_counters[0] - self._start_io[0]
+            self.record.bytes_written = io_counters[1] - self._start_io[1]
+        peak_rss = _peak_rss()
+        if peak_rss is not None and self._start_peak_rss is not None:
+            self.record.peak_rss_growth = peak_rss - self._start_peak_rss
+        for listener in list(_listeners):
+            listener(self.record)
+        return self.record
+
+    def _stack(self) -> List[float]:
+        if not hasattr(self._stacks, 'stack'):
+            self._stacks.stack = []
+        return self._stacks.stack
+
+
+def new_verification_recorder(name: str) -> Optional[VerificationRecorder]:
+    return VerificationRecorder(name) if has_verification_listeners() else None
+
+
+class RecordedWriter(Writer):
+    def __init__(self, writer: Writer, recorder: Optional[VerificationRecorder]) -> None:
+        self.writer = writer
+        self.recorder = recorder
+
+    def write_received_file(self, received_file: str) -> str:
+        if self.recorder is None:
+            return self.writer.write_received_file(received_file)
+        with self.recorder.phase(WRITE_RECEIVED):
+            return self.writer.write_received_file(received_file)
+
+
+class VerificationProfile:
+    """
+    A verification listener which keeps all records of a test session for its terminal summary and optionally
+    appends each of them as a JSON line to `log_path`.
+    """
+
+    def __init__(self, log_path: Optional[Path] = None):
+        self.records: List[VerificationRecord] = []
+        self._lock = threading.Lock()
+        self._log: Optional[TextIO] = open(log_path, "a") if log_path is not None else None
+
+    def __call__(self, record: VerificationRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+            if self._log is not None:
+                self._log.write(json.dumps(dict(asdict(record), other=record.other)) + "\n")
+                self._log.flush()
+
+    def add_forwarded(self, records: List[VerificationRecord]) -> None:
+        """Adds records of another process, e.g. a pytest-xdist worker, which logged them itself."""
+        with self._lock:
+            self.records.extend(records)
+
+    def slowest(self, n: int) -> List[VerificationRecord]:
+        records = sorted(self.records, key=lambda r: r.seconds, reverse=True)
+        return records[:n] if n > 0 else records
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+def format_record(record: VerificationRecord) -> List[str]:
+    phases = sorted([*record.phases.items(), ("other", record.other)], key=lambda p: p[1], reverse=True)
+    resources = [f"{record.pixels} px"]
+    if record.bytes_read is not None:
+        resources += [f"read {_megabytes(record.bytes_read)}", f"written {_megabytes(record.bytes_written)}"]
+    if record.peak_rss_growth is not None:
+        resources.append(f"peak rss +{_megabytes(record.peak_rss_growth)}")
+    return [f"{record.seconds:.3f}s {'passed' if record.passed else 'failed'} {record.test or record.name}",
+            f"    {', '.join(f'{name} {seconds:.3f}s' for name, seconds in phases if seconds > 0)}",
+            f"    {', '.join(resources)}; {record.name}"]
+
+
+def _megabytes(n: int) -> str:
+    return f"{n / 2 ** 20:.1f}MB"
+
+
+def _current_test() -> str:
+    return os.environ.get("PYTEST_CURRENT_TEST", "").rsplit(" ", 1)[0]
+
+
+def _io_counters() -> Optional[tuple]:
+    try:
+        with open(PROC_IO) as f:
+            counters = dict(line.split(":") for line in f)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _peak_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
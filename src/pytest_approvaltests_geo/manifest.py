@@ -0,0 +1,127 @@
+import json
+import math
+import os
+import warnings
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from pytest_approvaltests_geo.digests import iter_tree_files
+
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+
+PathConvertible = Union[Path, str]
+
+_unwritable_directories = set()
+
+
+@dataclass
+class ChunkHashes:
+    encoding: Any
+    chunk_shape: List[int]
+    hashes: Dict[str, str]
+
+
+@dataclass
+class ApprovedManifest:
+    """
+    Precomputed facts about an approved artifact, stored next to it, so comparisons do not have to read the
+    approved data again. `signature` records size and modification time of the artifact it was computed from; a
+    manifest whose signature does not match the artifact anymore is stale and ignored.
+    """
+    signature: List[int]
+    digest: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    chunks: Dict[str, ChunkHashes] = field(default_factory=dict)
+    stats: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    version: int = MANIFEST_VERSION
+
+
+def manifest_path(approved_path: PathConvertible) -> Path:
+    approved_path = Path(approved_path)
+    return approved_path.with_name(approved_path.name + MANIFEST_SUFFIX)
+
+
+def stat_signature(path: PathConvertible) -> List[int]:
+    path = Path(path)
+    if path.is_dir():
+        stats = [file_path.stat() for _, file_path in iter_tree_files(path)]
+        return [len(stats), sum(s.st_size for s in stats), max((s.st_mtime_ns for s in stats), default=0)]
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_manifest(approved_path: PathConvertible) -> Optional[ApprovedManifest]:
+    path = manifest_path(approved_path)
+    if not path.is_file() or not Path(approved_path).exists():
+        return None
+    try:
+        fields = json.loads(path.read_text())
+        fields['chunks'] = {name: ChunkHashes(**chunks) for name, chunks in fields.get('chunks', {}).items()}
+        manifest = ApprovedManifest(**fields)
+    except (ValueError, TypeError):
+        return None
+    if manifest.version != MANIFEST_VERSION or manifest.signature != stat_signature(approved_path):
+        return None
+    return manifest
+
+
+def save_manifest(approved_path: PathConvertible, manifest: ApprovedManifest) -> Optional[Path]:
+    """
+    Writes the manifest next to the approved artifact. Approved artifacts on read-only mounts get no manifest,
+    which is warned about once per directory.
+    """
+    path = manifest_path(approved_path)
+    if path.parent in _unwritable_directories:
+        return None
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_path.write_text(json.dumps(asdict(manifest), indent=1))
+        os.replace(tmp_path, path)
+    except OSError as error:
+        _unwritable_directories.add(path.parent)
+        warnings.warn(f"approved manifests are not written to {path.parent}: {error}")
+        return None
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return path
+
+
+def to_json_value(value: Any) -> Any:
+    return json.loads(json.dumps(value, default=str))
+
+
+class ValueStatsAccumulator:
+    """
+    Collects minimum, maximum, mean and the number of NaNs of values which are added chunk by chunk.
+    """
+
+    def __init__(self):
+        self._min = math.inf
+        self._max = -math.inf
+        self._sum = 0.0
+        self._count = 0
+        self._nans = 0
+
+    def add(self, values) -> "ValueStatsAccumulator":
+        values = np.asarray(values)
+        if values.dtype.kind not in 'biuf':
+            return self
+        if values.dtype.kind == 'f':
+            nans = np.isnan(values)
+            self._nans += int(nans.sum())
+            values = values[~nans]
+        if values.size:
+            self._min = min(self._min, float(values.min()))
+            self._max = max(self._max, float(values.max()))
+            self._sum += float(values.sum(dtype=np.float64))
+            self._count += values.size
+        return self
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        if self._count == 0:
+            return dict(min=None, max=None, mean=None, nans=self._nans)
+        return dict(min=self._min, max=self._max, mean=self._sum / self._count, nans=self._nans)
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+from approvaltests import Namer
+
+
+class LocalReceivedNamer(Namer):
+    """
+    Names the received file of an approved file behind a URL, which is read-only, below a local directory which
+    mirrors the URL, e.g. `s3://bucket/test.received.tif` as `<received_directory>/s3/bucket/test.received.tif`.
+    """
+
+    def __init__(self, namer: Namer, received_directory: Path):
+        self._namer = namer
+        self._received_directory = Path(received_directory)
+
+    def get_approved_filename(self) -> str:
+        return self._namer.get_approved_filename()
+
+    def get_received_filename(self) -> str:
+        scheme, path = self._namer.get_received_filename().split("://", 1)
+        received_path = self._received_directory / scheme / path.lstrip("/")
+        received_path.parent.mkdir(parents=True, exist_ok=True)
+        return received_path.as_posix()
@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+import concurrent.futures
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing.util import Finalize
+from typing import Optional, Any, Callable, Hashable, Mapping
+
+import rasterio
+
+from pytest_approvaltests_geo.manifest import stat_signature
+
+DEFAULT_MAX_WORKER_HANDLES = 32
+
+_worker_state = threading.local()
+
+
+@dataclass
+class ParallelVerification:
+    max_workers: Optional[int] = None
+    use_processes: bool = False
+
+    def make_executor(self) -> Executor:
+        if self.use_processes:
+            return ProcessPoolExecutor(self.max_workers, initializer=_enter_worker_process)
+        return WorkerThreadPoolExecutor(self.max_workers)
+
+
+class WorkerResources:
+    """
+    The GDAL environment and the opened raster handles of one worker, reused by everything running on it. Handles
+    are kept for the `max_handles` most recently used sources and closed when they are evicted or the resources
+    are closed, which has to happen on the worker itself as GDAL environments are bound to their thread.
+    """
+
+    def __init__(self, gdal_options: Optional[Mapping[str, Any]] = None,
+                 max_handles: int = DEFAULT_MAX_WORKER_HANDLES):
+        self._env = rasterio.Env(**(gdal_options or {}))
+        self._env.__enter__()
+        self._max_handles = max_handles
+        self._handles: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.opened = 0
+
+    def handle(self, key: Hashable, opener: Callable[[], Any]) -> Any:
+        if key in self._handles:
+            self._handles.move_to_end(key)
+            return self._handles[key]
+        self._handles[key] = opener()
+        self.opened += 1
+        while len(self._handles) > self._max_handles:
+            _, handle = self._handles.popitem(last=False)
+            handle.close()
+        return self._handles[key]
+
+    def close(self) -> None:
+        while self._handles:
+            _, handle = self._handles.popitem()
+            handle.close()
+        self._env.__exit__(None, None, None)
+
+
+def raster_handle_key(source: str, *variant: Hashable) -> Hashable:
+    """Keys handles of local rasters on their size and modification time as well, as they may be rewritten."""
+    return (source, stat_signature(source) if os.path.isfile(source) else None) + variant
+
+
+def worker_resources() -> Optional[WorkerResources]:
+    return getattr(_worker_state, 'resources', None)
+
+
+def enter_worker_resources(gdal_options: Optional[Mapping[str, Any]] = None) -> None:
+    if worker_resources() is None:
+        _worker_state.resources = WorkerResources(gdal_options)
+
+
+def exit_worker_resources() -> None:
+    resources = worker_resources()
+    if resources is not None:
+        _worker_state.resources = None
+        resources.close()
+
+
+def _enter_worker_process() -> None:
+    enter_worker_resources()
+    Finalize(None, exit_worker_resources, exitpriority=10)
+
+
+class WorkerThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    A thread pool whose threads each keep their `WorkerResources` from their first to their last task. On shutdown
+    every thread runs exactly one closing task, as all of them wait for each other before closing their resources.
+    Threads ended by the interpreter shutting down cannot run them and leave their resources to the process exit.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, gdal_options: Optional[Mapping[str, Any]] = None):
+        super().__init__(max_workers, initializer=enter_worker_resources, initargs=(gdal_options,))
+
+    def shutdown(self, wait: bool = True, **kwargs) -> None:
+        if wait and self._threads:
+            barrier = threading.Barrier(len(self._threads))
+            try:
+                concurrent.futures.wait([self.submit(_exit_worker_resources_together, barrier)
+                                         for _ in range(len(self._threads))])
+            except RuntimeError:
+                barrier.abort()
+        super().shutdown(wait, **kwargs)
+
+
+def _exit_worker_resources_together(barrier: threading.Barrier) -> None:
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        return
+    exit_worker_resources()
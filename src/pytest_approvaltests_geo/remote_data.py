@@ -0,0 +1,222 @@
+"""
+Approved data which lives behind an fsspec URL, e.g. `s3://bucket/approved` or `https://host/approved`, instead
+of a local directory. Approved artifacts are read with range requests in fixed-size blocks, which are kept in a
+persistent on-disk `BlockCache`, so later test runs only fetch blocks they have not seen before.
+
+GeoTIFFs are opened by GDAL through a file-like opener and Zarr stores through a key-value mapper. NetCDF files
+are opened as file-like objects, which needs the h5netcdf engine of xarray.
+"""
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from rasterio.io import DatasetReader
+    from pytest_approvaltests_geo.block_cached_file_system import BlockCachedFileSystem
+
+REMOTE_BLOCK_SIZE = 2 ** 20
+DEFAULT_CACHE_BYTES = 2 ** 30
+DEFAULT_CACHE_DIRECTORY = Path.home() / ".cache" / "pytest-approvaltests-geo" / "blocks"
+DEFAULT_RECEIVED_DIRECTORY = Path.home() / ".cache" / "pytest-approvaltests-geo" / "received"
+
+PathConvertible = Union[Path, str]
+
+
+def is_remote(path: Any) -> bool:
+    return isinstance(path, RemotePath) or (isinstance(path, str) and "://" in path)
+
+
+def artifact_path(path: Any) -> Union[Path, "RemotePath"]:
+    """
+    >>> artifact_path("s3://bucket/approved/a.tif")
+    RemotePath(url='s3://bucket/approved/a.tif')
+    >>> artifact_path("approved/a.tif")
+    PosixPath('approved/a.tif')
+    """
+    if isinstance(path, RemotePath):
+        return path
+    return RemotePath(path) if is_remote(path) else Path(path)
+
+
+@dataclass(frozen=True)
+class RemotePath:
+    """
+    The URL of a remote approved artifact or directory, with as much of the `Path` interface as the plugin uses.
+
+    >>> root = RemotePath("s3://bucket/approved/")
+    >>> root / "tiles" / "a.tif"
+    RemotePath(url='s3://bucket/approved/tiles/a.tif')
+    >>> (root / "a.tif").name, (root / "a.tif").suffix
+    ('a.tif', '.tif')
+    """
+    url: str
+
+    def __post_init__(self):
+        object.__setattr__(self, 'url', self.url.rstrip("/"))
+
+    def __truediv__(self, other: PathConvertible) -> "RemotePath":
+        other = Path(other).as_posix().strip("/")
+        return RemotePath(f"{self.url}/{other}") if other not in ("", ".") else self
+
+    def __str__(self) -> str:
+        return self.url
+
+    def as_posix(self) -> str:
+        return self.url
+
+    @property
+    def name(self) -> str:
+        return self.url.rsplit("/", 1)[-1]
+
+    @property
+    def suffix(self) -> str:
+        return Path(self.name).suffix
+
+    def exists(self) -> bool:
+        fs, path = remote_filesystem(self.url)
+        return fs.exists(path)
+
+    def is_file(self) -> bool:
+        fs, path = remote_filesystem(self.url)
+        return fs.isfile(path)
+
+    def is_dir(self) -> bool:
+        fs, path = remote_filesystem(self.url)
+        return fs.isdir(path)
+
+
+def remote_approval_text(received_path: PathConvertible, approved_path: "RemotePath") -> str:
+    return f"To approve upload:\n {Path(received_path).as_posix()} to {approved_path}"
+
+
+class BlockCache:
+    """
+    A persistent least recently used cache of fixed-size blocks of remote files, stored as one file per block
+    below `directory`. A block is keyed on the remote file, including its size and modification time or ETag,
+    and its index, so a changed remote file never serves stale blocks. Reading a block marks it as recently used
+    by touching it. Whenever the blocks exceed `max_bytes` the least recently used ones are evicted; blocks are
+    written atomically, so several processes can share one cache directory.
+
+    The sizes and order of use of the blocks are indexed in memory, starting from the blocks found in `directory`
+    on the first fetch. Every process evicts the blocks it knows of, i.e. those it found, fetched or read.
+    """
+
+    def __init__(self, directory: PathConvertible = DEFAULT_CACHE_DIRECTORY, max_bytes: int = DEFAULT_CACHE_BYTES,
+                 block_size: int = REMOTE_BLOCK_SIZE):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.fetched_blocks = 0
+        self._lock = threading.Lock()
+        self._blocks: Optional["OrderedDict[Path, int]"] = None
+        self._size = 0
+
+    def block(self, file_key: str, index: int, fetch: Callable[[], bytes]) -> bytes:
+        path = self.directory / file_key[:2] / f"{file_key}.{self.block_size}.{index}"
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        else:
+            with self._lock:
+                if self._blocks is not None and path in self._blocks:
+                    self._blocks.move_to_end(path)
+            return data
+        data = fetch()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.fetched_blocks += 1
+            blocks = self._indexed_blocks()
+            self._size += len(data) - blocks.pop(path, 0)
+            blocks[path] = len(data)
+            self._evict(blocks)
+        return data
+
+    def size(self) -> int:
+        return sum(stat.st_size for _, stat in self._iter_blocks())
+
+    def _indexed_blocks(self) -> "OrderedDict[Path, int]":
+        if self._blocks is None:
+            found = sorted(self._iter_blocks(), key=lambda b: b[1].st_mtime_ns)
+            self._blocks = OrderedDict((path, stat.st_size) for path, stat in found)
+            self._size = sum(self._blocks.values())
+        return self._blocks
+
+    def _evict(self, blocks: "OrderedDict[Path, int]") -> None:
+        while self._size > self.max_bytes and blocks:
+            path, n_bytes = blocks.popitem(last=False)
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self._size -= n_bytes
+
+    def _iter_blocks(self) -> Iterator[Tuple[Path, os.stat_result]]:
+        for path in self.directory.glob("*/*"):
+            if not path.name.startswith("."):
+                try:
+                    yield path, path.stat()
+                except FileNotFoundError:
+                    pass
+
+
+_block_cache: Optional[BlockCache] = None
+_remote_rasters: Dict[str, str] = {}
+
+
+def set_block_cache(cache: Optional[BlockCache]) -> None:
+    global _block_cache
+    _block_cache = cache
+
+
+def get_block_cache() -> BlockCache:
+    global _block_cache
+    if _block_cache is None:
+        _block_cache = BlockCache()
+    return _block_cache
+
+
+def remote_filesystem(url: str, cache: Optional[BlockCache] = None) -> Tuple["BlockCachedFileSystem", str]:
+    """Returns the file system for `url`, reading through `cache` or the block cache set for the session."""
+    from fsspec.core import url_to_fs
+    from pytest_approvaltests_geo.block_cached_file_system import BlockCachedFileSystem
+    fs, path = url_to_fs(url)
+    return BlockCachedFileSystem(fs, cache or get_block_cache()), path
+
+
+def open_raster(path: Any, **kwargs) -> "DatasetReader":
+    import rasterio
+    if not is_remote(path):
+        return rasterio.open(path, **kwargs)
+    fs, remote_path = remote_filesystem(str(path))
+    rds = rasterio.open(remote_path, opener=fs, **kwargs)
+    _remote_rasters[rds.name] = str(path)
+    weakref.finalize(rds, _remote_rasters.pop, rds.name, None)
+    return rds
+
+
+def reopenable_source(name: str) -> str:
+    """
+    What a raster which GDAL knows as `name` can be opened again from in another thread. The opener of a remote
+    raster is only registered in the thread which opened it, so it is opened again from its URL.
+    """
+    return _remote_rasters.get(name, name)
+
+
+def dataset_source(path: Any) -> Any:
+    """
+    What xarray opens the dataset at `path` from: the path itself for local data, a key-value mapper for a remote
+    directory like a Zarr store and a file-like object for any other remote file.
+    """
+    if not is_remote(path):
+        return path
+    fs, remote_path = remote_filesystem(str(path))
+    return fs.get_mapper(remote_path) if fs.isdir(remote_path) else fs.open(remote_path)
@@ -7,20 +7,30 @@ from xarray import Dataset
 
 from pytest_approvaltests_geo.differs.differ_of_geo_ncs import DifferOfGeoNcs
 from pytest_approvaltests_geo.differs.difference import print_diffs
+from pytest_approvaltests_geo.instrumentation import REPORT
+from pytest_approvaltests_geo.remote_data import artifact_path, is_remote, remote_approval_text
 
 
 class ReportGeoNcs(Reporter, DifferOfGeoNcs):
     def report(self, received_path: str, approved_path: str) -> bool:
         received_path = Path(received_path)
-        approved_path = Path(approved_path)
-
-        if not approved_path.is_file():
+        approved_path = artifact_path(approved_path)
+
+        if is_remote(approved_path) and not approved_path.exists():
+            with self.phase(REPORT):
+                print(f"There is no approved file at {approved_path}")
+                print(remote_approval_text(received_path, approved_path))
+            return True
+        if not is_remote(approved_path) and not approved_path.is_file():
             self._create_empty_geo_nc(approved_path)
 
-        diffs = self.diffs(received_path, approved_path)
+        diffs = self.shared_diffs(received_path, approved_path)
+        self.release_shared(received_path, approved_path)
         if len(diffs) > 0:
-            print_diffs(diffs)
-            print(f"To approve run:\n {get_command_text(received_path.as_posix(), approved_path.as_posix())}")
+            with self.phase(REPORT):
+                print_diffs(diffs)
+                print(remote_approval_text(received_path, approved_path) if is_remote(approved_path) else
+                      f"To approve run:\n {get_command_text(received_path.as_posix(), approved_path.as_posix())}")
 
         return True
 
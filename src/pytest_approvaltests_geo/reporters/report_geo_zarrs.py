@@ -6,20 +6,30 @@ from xarray import Dataset
 
 from pytest_approvaltests_geo.differs.differ_of_geo_zarrs import DifferOfGeoZarrs
 from pytest_approvaltests_geo.differs.difference import print_diffs
+from pytest_approvaltests_geo.instrumentation import REPORT
+from pytest_approvaltests_geo.remote_data import artifact_path, is_remote, remote_approval_text
 
 
 class ReportGeoZarrs(Reporter, DifferOfGeoZarrs):
     def report(self, received_path: str, approved_path: str) -> bool:
         received_path = Path(received_path)
-        approved_path = Path(approved_path)
-
-        if not approved_path.exists():
+        approved_path = artifact_path(approved_path)
+
+        if is_remote(approved_path) and not approved_path.exists():
+            with self.phase(REPORT):
+                print(f"There is no approved file at {approved_path}")
+                print(remote_approval_text(received_path, approved_path))
+            return True
+        if not is_remote(approved_path) and not approved_path.exists():
             self._create_empty_ds(approved_path)
 
-        diffs = self.diffs(received_path, approved_path)
+        diffs = self.shared_diffs(received_path, approved_path)
+        self.release_shared(received_path, approved_path)
         if len(diffs) > 0:
-            print_diffs(diffs)
-            print(f"To approve run:\nrm -rf {approved_path} && mv -f {received_path} {approved_path}")
+            with self.phase(REPORT):
+                print_diffs(diffs)
+                print(remote_approval_text(received_path, approved_path) if is_remote(approved_path) else
+                      f"To approve run:\nrm -rf {approved_path} && mv -f {received_path} {approved_path}")
 
         return True
 
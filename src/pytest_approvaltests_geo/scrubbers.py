@@ -1,9 +1,17 @@
+import re
+from collections import defaultdict
 from typing import Callable, Dict, Union, List, Tuple, get_args, Any, Sequence
 
 import numpy as np
-from approvaltests.scrubbers.scrubbers import Scrubber, create_regex_scrubber, combine_scrubbers, scrub_all_dates, \
-    scrub_all_guids
+from approvaltests.scrubbers.scrubbers import Scrubber, create_regex_scrubber
 
+DATE_REGEX = r"\d{4}-\d{2}-\d{2}\ \d{2}:\d{2}:\d{2}"
+YEODA_DATE_REGEX = r"\d{4}\d{2}\d{2}T\d{2}\d{2}\d{2}"
+GUID_REGEX = r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+SHORT_COMMIT_REGEX = r"g?[0-9a-fA-F]{7}"
+TAG_REGEX = r"v\d\.\d\.\d"
+
+ScrubRule = Tuple[str, Union[Callable[[int], str], str]]
 JsonLikeCollection = Union[Dict, List, Tuple]
 RecursiveScrubber = Callable[[JsonLikeCollection], JsonLikeCollection]
 SequenceScrubber = Callable[[Sequence], Sequence]
@@ -52,8 +60,20 @@ def make_scrubber_recurse(scrubber: Scrubber) -> RecursiveScrubber:
     return lambda elems: scrub_recursive(elems, scrubber)
 
 
+class ElementwiseSequenceScrubber:
+    """
+    A sequence scrubber which scrubs every element on its own, so repeated elements only need to be scrubbed once.
+    """
+
+    def __init__(self, scrubber: Scrubber):
+        self.scrubber = scrubber
+
+    def __call__(self, elems: Sequence) -> Sequence:
+        return scrub_sequential(elems, self.scrubber)
+
+
 def make_scrubber_sequential(scrubber: Scrubber) -> SequenceScrubber:
-    return lambda elems: scrub_sequential(elems, scrubber)
+    return ElementwiseSequenceScrubber(scrubber)
 
 
 def identity_recursive_scrubber(tags: Dict) -> Dict:
@@ -75,39 +95,123 @@ def scrub_xarray_metadata(a, tags_scrubber):
 
 
 def scrub_xarray_coordinates(a, coords_scrubber):
+    if coords_scrubber is identity_sequence_scrubber:
+        return a
+    scrubbed_coords = {}
     for coord in a.coords:
         cv = a[coord]
         if cv.dtype.type is np.str_:
-            a = a.assign_coords({coord: (cv.dims[0], coords_scrubber(cv.values))})
-    return a
+            scrubbed_coords[coord] = (cv.dims, scrub_coordinate_values(cv.values, coords_scrubber))
+    return a.assign_coords(scrubbed_coords) if scrubbed_coords else a
+
+
+def scrub_coordinate_values(values: np.ndarray, coords_scrubber: SequenceScrubber) -> Sequence:
+    if not isinstance(coords_scrubber, ElementwiseSequenceScrubber):
+        return coords_scrubber(values)
+    unique_values, inverse = np.unique(values, return_inverse=True)
+    return np.asarray(coords_scrubber(unique_values), dtype=str)[inverse.ravel()].reshape(values.shape)
+
+
+class CompiledScrubber:
+    r"""
+    Applies regex scrub rules in order, like chaining `create_regex_scrubber`s with `combine_scrubbers`, and
+    produces identical output. The patterns are compiled once, and strings none of them matches are returned
+    without substituting anything. Scrubbed strings are memoized, as tags repeat a lot across keys and files.
+    Pickled scrubbers keep their rules only, so callable replacements have to be picklable, e.g. module functions.
+
+    >>> scrubber = CompiledScrubber((r"\d+", lambda i: f"<n{i}>"), (r"v<n0>", "<version>"))
+    >>> scrubber("v1, v2 and v1")
+    '<version>, v<n1> and <version>'
+    """
+
+    def __init__(self, *rules: ScrubRule, max_cached: int = 1 << 16):
+        self._rules = rules
+        self._max_cached = max_cached
+        self._compile()
+
+    def _compile(self) -> None:
+        self._patterns = [re.compile(regex) for regex, _ in self._rules]
+        self._cache: Dict[str, str] = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return dict(rules=self._rules, max_cached=self._max_cached)
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self._rules = state['rules']
+        self._max_cached = state['max_cached']
+        self._compile()
+
+    def __call__(self, data: str) -> str:
+        scrubbed = self._cache.get(data)
+        if scrubbed is None:
+            scrubbed = self._scrub(data)
+            if len(self._cache) >= self._max_cached:
+                self._cache.clear()
+            self._cache[data] = scrubbed
+        return scrubbed
+
+    def _scrub(self, data: str) -> str:
+        if not any(pattern.search(data) for pattern in self._patterns):
+            return data
+        for pattern, (_, replacement) in zip(self._patterns, self._rules):
+            matches = defaultdict(lambda: len(matches))
+            data = pattern.sub(lambda m: _replacement_of(replacement, matches[m.group(0)]), data)
+        return data
+
+
+def _replacement_of(replacement: Union[Callable[[int], str], str], index: int) -> str:
+    return replacement if isinstance(replacement, str) else replacement(index)
 
 
 def scrub_all_yeoda_dates(data: str) -> str:
     return create_regex_scrubber(
-        r"\d{4}\d{2}\d{2}T\d{2}\d{2}\d{2}",
+        YEODA_DATE_REGEX,
         lambda t: f"<yeoda_date{t}>",
     )(data)
 
 
 def scrub_all_short_commits(data: str) -> str:
     return create_regex_scrubber(
-        r"g?[0-9a-fA-F]{7}",
+        SHORT_COMMIT_REGEX,
         lambda t: f"<short_commit_{t}>",
     )(data)
 
 
 def scrub_all_tags(data: str) -> str:
     return create_regex_scrubber(
-        r"v\d\.\d\.\d",
+        TAG_REGEX,
         lambda t: f"<tag_{t}>",
     )(data)
 
 
+def _date_placeholder(t: int) -> str:
+    return f"<date{t}>"
+
+
+def _yeoda_date_placeholder(t: int) -> str:
+    return f"<yeoda_date{t}>"
+
+
+def _guid_placeholder(t: int) -> str:
+    return f"<guid_{t}>"
+
+
+def _short_commit_placeholder(t: int) -> str:
+    return f"<short_commit_{t}>"
+
+
+def _tag_placeholder(t: int) -> str:
+    return f"<tag_{t}>"
+
+
+yeoda_datacube_metadata_scrubber = CompiledScrubber(
+    (DATE_REGEX, _date_placeholder),
+    (YEODA_DATE_REGEX, _yeoda_date_placeholder),
+    (GUID_REGEX, _guid_placeholder),
+    (SHORT_COMMIT_REGEX, _short_commit_placeholder),
+    (TAG_REGEX, _tag_placeholder),
+)
+
+
 def scrub_yeoda_datacube_metadata(data: str) -> str:
-    return combine_scrubbers(
-        scrub_all_dates,
-        scrub_all_yeoda_dates,
-        scrub_all_guids,
-        scrub_all_short_commits,
-        scrub_all_tags,
-    )(data)
+    return yeoda_datacube_metadata_scrubber(data)
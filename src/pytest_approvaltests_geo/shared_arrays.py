@@ -0,0 +1,204 @@
+"""
+Decoded approved arrays which are shared between processes, e.g. the workers of `pytest -n 32` which compare
+against the same approved raster or datacube. The first process which needs an approved array decodes it into an
+`.npy` file of a `SharedArrayCache`, all others map that file into memory read-only, without copying or decoding it.
+"""
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from pytest_approvaltests_geo.manifest import stat_signature
+
+DEFAULT_SHARED_ARRAY_BYTES = 4 * 2 ** 30
+LOCK_POLL_SECONDS = 0.05
+_PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+_ERROR_ACCESS_DENIED = 5
+_STILL_ACTIVE = 259
+
+PathConvertible = Union[Path, str]
+
+
+def default_shared_array_directory() -> Path:
+    """A new directory in shared memory, if the platform has one, else in the temporary directory."""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return Path(tempfile.mkdtemp(prefix="pytest-approvaltests-geo-arrays-", dir=base))
+
+
+def approved_array_key(approved_path: PathConvertible, *variant) -> Optional[Tuple]:
+    """
+    Identifies the decoded array `variant` of a local approved artifact, e.g. an overview level or a data variable
+    with the opener it was decoded with. A changed artifact gets a new key through the sizes and modification times
+    of its files.
+    """
+    try:
+        signature = stat_signature(approved_path)
+    except OSError:
+        return None
+    return (os.path.abspath(approved_path), *signature, *variant)
+
+
+class SharedArrayCache:
+    """
+    A cache of decoded arrays in `directory`, which all processes sharing the directory attach to. Arrays are
+    stored as `<key>.npy` files and attached as read-only memory maps.
+
+    Every attached array holds a reference file in `directory/refs` while it is in use. Whenever the arrays exceed
+    `max_bytes` the least recently attached ones without references, or only with references of processes which
+    are gone, are evicted. Arrays larger than `max_bytes` or of object dtype are decoded but never shared.
+    """
+
+    def __init__(self, directory: PathConvertible, max_bytes: int = DEFAULT_SHARED_ARRAY_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.decoded_arrays = 0
+        self._references = itertools.count()
+        (self.directory / "refs").mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def attached(self, key: Sequence, decode: Callable[[], np.ndarray],
+                 n_bytes: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        Yields the array of `key`, which `decode` is called for if no process has decoded it yet. `n_bytes`, if
+        known up front, avoids decoding arrays which are too large to be shared into the cache at all.
+        """
+        if n_bytes is not None and n_bytes > self.max_bytes:
+            yield self._decode(decode)
+            return
+        name = hashlib.sha256(json.dumps([str(k) for k in key]).encode()).hexdigest()
+        reference = self.directory / "refs" / f"{name}.{os.getpid()}.{threading.get_ident()}.{next(self._references)}"
+        reference.touch()
+        try:
+            yield self._attach(name, decode)
+        finally:
+            reference.unlink()
+
+    def size(self) -> int:
+        return sum(path.stat().st_size for path in self.directory.glob("*.npy"))
+
+    def close(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _decode(self, decode: Callable[[], np.ndarray]) -> np.ndarray:
+        self.decoded_arrays += 1
+        return decode()
+
+    def _attach(self, name: str, decode: Callable[[], np.ndarray]) -> np.ndarray:
+        path = self.directory / f"{name}.npy"
+        while not path.exists():
+            lock = self.directory / f"{name}.lock"
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not _is_held(lock):
+                    _unlink(lock)
+                time.sleep(LOCK_POLL_SECONDS)
+                continue
+            try:
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                array = self._decode(decode)
+                if array.dtype.hasobject or array.size == 0 or array.nbytes > self.max_bytes:
+                    return array
+                tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                np.save(tmp_path, np.ascontiguousarray(array))
+                os.replace(tmp_path, path)
+                self._evict()
+            finally:
+                _unlink(lock)
+        try:
+            os.utime(path)
+            return np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            return self._attach(name, decode)
+
+    def _evict(self) -> None:
+        arrays = sorted(((path, path.stat()) for path in self.directory.glob("*.npy")),
+                        key=lambda a: a[1].st_mtime_ns)
+        size = sum(stat.st_size for _, stat in arrays)
+        referenced = self._referenced_names()
+        for path, stat in arrays:
+            if size <= self.max_bytes:
+                break
+            if path.stem not in referenced and _unlink(path):
+                size -= stat.st_size
+
+    def _referenced_names(self) -> set:
+        names = set()
+        for reference in (self.directory / "refs").iterdir():
+            name, pid, _ = reference.name.split(".", 2)
+            if _is_alive(int(pid)):
+                names.add(name)
+            else:
+                _unlink(reference)
+        return names
+
+
+def _is_held(lock: Path) -> bool:
+    try:
+        pid = lock.read_text()
+    except FileNotFoundError:
+        return True
+    return not pid or _is_alive(int(pid))
+
+
+def _is_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return _is_alive_on_windows(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_alive_on_windows(pid: int) -> bool:
+    """`os.kill` terminates processes on Windows whatever the signal, so processes are looked up instead."""
+    import ctypes
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    handle = kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        return ctypes.get_last_error() == _ERROR_ACCESS_DENIED
+    try:
+        exit_code = ctypes.c_ulong()
+        return not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)) or exit_code.value == _STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _unlink(path: Path) -> bool:
+    """
+    Removes a file unless another process removed it already or, on Windows, still has it open, e.g. as memory
+    map. Returns whether it is gone.
+    """
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        return False
+    return True
+
+
+_shared_array_cache: Optional[SharedArrayCache] = None
+
+
+def set_shared_array_cache(cache: Optional[SharedArrayCache]) -> None:
+    global _shared_array_cache
+    _shared_array_cache = cache
+
+
+def get_shared_array_cache() -> Optional[SharedArrayCache]:
+    """The cache set for the session, if decoded approved arrays are shared at all."""
+    return _shared_array_cache
@@ -0,0 +1,214 @@
+import pickle
+from copy import deepcopy
+from pathlib import Path
+from typing import Optional, Union, Callable
+
+import rasterio
+from approval_utilities.utilities.exceptions.exception_collector import gather_all_exceptions_and_throw
+from approvaltests import verify_with_namer_and_writer, ScenarioNamer, Writer, Namer
+from approvaltests.namer import NamerBase
+from rasterio.io import MemoryFile
+from xarray import DataArray, Dataset
+
+from pytest_approvaltests_geo.comparators.compare_geo_ncs import CompareGeoNcs
+from pytest_approvaltests_geo.comparators.compare_geo_tiffs import CompareGeoTiffs
+from pytest_approvaltests_geo.comparators.compare_geo_zarrs import CompareGeoZarrs
+from pytest_approvaltests_geo.deferred_artifacts import DeferredReceivedWriter, MemoryFileArtifact, DatasetArtifact, \
+    DatasetWriter, DATASET_FORMATS, has_value_changing_encoding
+from pytest_approvaltests_geo.differs.diff_session import DiffSession
+from pytest_approvaltests_geo.existing_dir_writer import ExistingDirWriter
+from pytest_approvaltests_geo.existing_file_link_writer import ExistingFileLinkWriter
+from pytest_approvaltests_geo.geo_options import GeoOptions
+from pytest_approvaltests_geo.instrumentation import RecordedWriter, new_verification_recorder
+from pytest_approvaltests_geo.namer.local_received_namer import LocalReceivedNamer
+from pytest_approvaltests_geo.namer.stack_frame_namer_with_external_data_dir import StackFrameNamerWithExternalDataDir
+from pytest_approvaltests_geo.remote_data import is_remote
+from pytest_approvaltests_geo.reporters.report_geo_ncs import ReportGeoNcs
+from pytest_approvaltests_geo.reporters.report_geo_tiffs import ReportGeoTiffs
+from pytest_approvaltests_geo.reporters.report_geo_zarrs import ReportGeoZarrs
+
+PathConvertible = Union[Path, str]
+TifFile = Union[PathConvertible, MemoryFile]
+
+
+def geo_data_namer_factory(approved_geo_directory: Optional[Path] = None):
+    if approved_geo_directory is not None:
+        return lambda: StackFrameNamerWithExternalDataDir(approved_geo_directory.as_posix())
+    else:
+        from approvaltests.namer.default_name import get_default_namer
+        return get_default_namer
+
+
+def _with_local_received(namer: Namer, options: GeoOptions) -> Namer:
+    if not is_remote(namer.get_approved_filename()):
+        return namer
+    return LocalReceivedNamer(namer, options.received_directory)
+
+
+def _tif_source(tile_file: TifFile) -> PathConvertible:
+    return tile_file.name if isinstance(tile_file, MemoryFile) else tile_file
+
+
+def verify_geo_tif(tile_file: TifFile,
+                   *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
+                   options: Optional[GeoOptions] = None):
+    geo_data_namer = options.namer if options else None
+    geo_approved_dir = options.approved_directory if options else None
+    geo_data_namer = geo_data_namer or geo_data_namer_factory(geo_approved_dir)()
+    geo_data_namer.set_extension(Path(_tif_source(tile_file)).suffix)
+    verify_geo_tif_with_namer(tile_file, geo_data_namer, options=options)
+
+
+def verify_geo_tif_with_namer(tile_file: TifFile,
+                              namer: NamerBase,
+                              *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
+                              options: Optional[GeoOptions] = None):
+    options = options or GeoOptions()
+    if options.has_scenario_by_tags():
+        with rasterio.open(_tif_source(tile_file)) as rds:
+            namer = options.wrap_namer_in_tags_scenario(namer, rds.tags())
+    namer = _with_local_received(namer, options)
+    link_modes = options.received_link_modes
+    with DiffSession(new_verification_recorder(namer.get_approved_filename())) as session:
+        tif_comparator = CompareGeoTiffs(options.scrub_tags, options.tolerance,
+                                         session=session, memory_limit=options.memory_limit,
+                                         approved_manifests=options.approved_manifests,
+                                         decode_threads=options.decode_threads,
+                                         compare_overviews=options.overview_comparison,
+                                         worst_pixels=options.worst_pixels)
+        tif_reporter = ReportGeoTiffs(options.scrub_tags, options.tolerance,
+                                      session=session, memory_limit=options.memory_limit,
+                                      decode_threads=options.decode_threads,
+                                      compare_overviews=options.overview_comparison,
+                                      worst_pixels=options.worst_pixels,
+                                      block_heatmap=options.block_heatmap)
+        options = options.with_comparator(tif_comparator)
+        options = options.with_reporter(tif_reporter)
+        if isinstance(tile_file, MemoryFile):
+            writer = DeferredReceivedWriter(session, MemoryFileArtifact(tile_file))
+        else:
+            writer = ExistingFileLinkWriter(tile_file, options, link_modes)
+        verify_with_namer_and_writer(
+            namer=namer,
+            writer=RecordedWriter(writer, session.recorder),
+            options=options)
+
+
+def verify_raster_as_geo_tif(tile: DataArray, *, options: Optional[GeoOptions] = None):
+    options = options or GeoOptions()
+    if not options.raster_in_memory:
+        tile_file = options.tmp_directory / "raster.tif"
+        options.tif_writer(tile_file, tile)
+        verify_geo_tif(tile_file, options=options)
+        return
+    with MemoryFile(ext=".tif") as tile_file:
+        options.tif_writer(tile_file.name, tile)
+        verify_geo_tif(tile_file, options=options)
+
+
+def verify_geo_zarr(zarr_archive: PathConvertible,
+                    *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
+                    options: Optional[GeoOptions] = None):
+    options = options or GeoOptions()
+    geo_data_namer = options.namer if options else None
+    geo_approved_dir = options.approved_directory if options else None
+    geo_data_namer = geo_data_namer or geo_data_namer_factory(geo_approved_dir)()
+    geo_data_namer.set_extension(Path(zarr_archive).suffix)
+    writer = ExistingDirWriter(zarr_archive, options.received_link_modes)
+    _verify_geo_dataset_with_writer("zarr", geo_data_namer, lambda _: writer, options)
+
+
+def verify_geo_nc(nc_file: PathConvertible,
+                  *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
+                  options: Optional[GeoOptions] = None):
+    options = options or GeoOptions()
+    geo_data_namer = options.namer if options else None
+    geo_approved_dir = options.approved_directory if options else None
+    geo_data_namer = geo_data_namer or geo_data_namer_factory(geo_approved_dir)()
+    geo_data_namer.set_extension(Path(nc_file).suffix)
+    writer = ExistingFileLinkWriter(nc_file, options, options.received_link_modes)
+    _verify_geo_dataset_with_writer("nc", geo_data_namer, lambda _: writer, options)
+
+
+def verify_geo_dataset(dataset: Dataset,
+                       format: str = "zarr",
+                       *,  # enforce keyword arguments - https://www.python.org/dev/peps/pep-3102/
+                       options: Optional[GeoOptions] = None):
+    options = options or GeoOptions()
+    dataset_format = format
+    if dataset_format not in DATASET_FORMATS:
+        raise ValueError(f"unknown dataset format {dataset_format}, expected one of {DATASET_FORMATS}")
+    geo_data_namer = options.namer if options else None
+    geo_approved_dir = options.approved_directory if options else None
+    geo_data_namer = geo_data_namer or geo_data_namer_factory(geo_approved_dir)()
+    geo_data_namer.set_extension(f".{dataset_format}")
+    if has_value_changing_encoding(dataset):
+        _verify_geo_dataset_with_writer(dataset_format, geo_data_namer,
+                                        lambda _: DatasetWriter(dataset, dataset_format), options)
+    else:
+        _verify_geo_dataset_with_writer(dataset_format, geo_data_namer, lambda session: DeferredReceivedWriter(
+            session, DatasetArtifact(dataset, dataset_format)), options)
+
+
+def _verify_geo_dataset_with_writer(dataset_format: str, namer: NamerBase,
+                                    make_writer: Callable[[DiffSession], Writer], options: GeoOptions):
+    comparator_type, reporter_type = {"zarr": (CompareGeoZarrs, ReportGeoZarrs),
+                                      "nc": (CompareGeoNcs, ReportGeoNcs)}[dataset_format]
+    namer = _with_local_received(namer, options)
+    with DiffSession(new_verification_recorder(namer.get_approved_filename())) as session:
+        comparator = comparator_type(options.scrub_tags, options.scrub_coords, options.tolerance,
+                                     session=session, lazy=options.lazy_comparison,
+                                     approved_manifests=options.approved_manifests,
+                                     worst_pixels=options.worst_pixels,
+                                     memory_limit=options.memory_limit)
+        reporter = reporter_type(options.scrub_tags, options.scrub_coords, options.tolerance,
+                                 session=session, lazy=options.lazy_comparison,
+                                 worst_pixels=options.worst_pixels,
+                                 block_heatmap=options.block_heatmap,
+                                 memory_limit=options.memory_limit)
+        writer = make_writer(session)
+        options = options.with_comparator(comparator)
+        options = options.with_reporter(reporter)
+        verify_with_namer_and_writer(
+            namer=namer,
+            writer=RecordedWriter(writer, session.recorder),
+            options=options)
+
+
+def verify_data_frame_using(verify_fn, *columns, approved_geo_directory: Optional[Path] = None):
+    def _verify_data_frame(data_frame, *, options: Optional[GeoOptions] = None):
+        options = options or GeoOptions()
+        geo_approved_dir = options.approved_directory or approved_geo_directory
+        base_namer = options.namer or geo_data_namer_factory(geo_approved_dir)()
+
+        rows = [(row['filepath'], GeoOptions.from_options(options.with_namer(
+            ScenarioNamer(deepcopy(base_namer), *tuple(row[c] for c in columns))
+        ))) for _, row in data_frame.iterrows()]
+
+        parallel = options.parallel_verification
+        if parallel is None:
+            gather_all_exceptions_and_throw(rows, lambda r: verify_fn(r[0], options=r[1]))
+            return
+
+        if parallel.use_processes:
+            _check_picklable(verify_fn, rows[0][1] if rows else options)
+        with parallel.make_executor() as executor:
+            verifications = [executor.submit(verify_fn, file, options=row_options) for file, row_options in rows]
+            gather_all_exceptions_and_throw(verifications, lambda v: v.result())
+
+    return _verify_data_frame
+
+
+def _check_picklable(verify_fn, options: GeoOptions) -> None:
+    """
+    Rows verified by worker processes receive the verify function and their options pickled, so anything which
+    cannot be pickled, like the closures of the plugin's fixtures or lambdas, is named before any row is verified.
+    """
+    parts = [("verify function", verify_fn)] + [(f"option '{name}'", value) for name, value in options.fields.items()]
+    for part, value in parts:
+        try:
+            pickle.dumps(value)
+        except (pickle.PicklingError, AttributeError, TypeError) as error:
+            raise ValueError(f"verifying rows in worker processes requires a picklable {part}, e.g. a module level "
+                             f"function instead of a fixture, closure or lambda, but {value!r} is not: {error}") \
+                from error
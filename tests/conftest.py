@@ -1,6 +1,23 @@
 import sys
 from pathlib import Path
 
+import pytest
+
 pytest_plugins = 'pytester'
 
 sys.path.append((Path(__file__).parent / "helpers").as_posix())
+
+
+@pytest.fixture
+def compared_arrays(monkeypatch):
+    """Records the received and approved arrays of every window or chunk the compare kernel checks."""
+    from pytest_approvaltests_geo.differs.compare_kernel import CompareKernel
+    compared = []
+    count_violations = CompareKernel.count_violations
+
+    def _recording_count(kernel, received, approved):
+        compared.append((received, approved))
+        return count_violations(kernel, received, approved)
+
+    monkeypatch.setattr(CompareKernel, 'count_violations', _recording_count)
+    return compared
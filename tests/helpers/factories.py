@@ -1,16 +1,25 @@
 from pathlib import Path
 
+import rasterio
 import rioxarray  # noqa # pylint: disable=unused-import
 from xarray import Dataset
 
 from pytest_approvaltests_geo.factories import make_raster
 
 
-def make_raster_at(values, file_path: Path, tags=None, array_attrs=None, coords=None, extra_coords=None) -> Path:
+def make_raster_at(values, file_path: Path, tags=None, array_attrs=None, coords=None, extra_coords=None,
+                   **profile) -> Path:
     array = make_raster(values, coords=coords, attrs=array_attrs)
     if extra_coords:
         array = array.assign_coords(extra_coords)
-    array.rio.to_raster(file_path, tags=tags)
+    array.rio.to_raster(file_path, tags=tags, **profile)
+    return file_path
+
+
+def make_raster_with_overviews_at(values, file_path: Path, factors=(2, 4, 8)) -> Path:
+    make_raster_at(values, file_path, tiled=True, blockxsize=16, blockysize=16)
+    with rasterio.open(file_path, 'r+') as rds:
+        rds.build_overviews(list(factors), rasterio.enums.Resampling.average)
     return file_path
 
 
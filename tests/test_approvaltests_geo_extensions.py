@@ -1,7 +1,11 @@
+import subprocess
+import sys
 from datetime import datetime
 from pathlib import Path
 
 import pytest
+import rasterio
+import xarray as xr
 from approval_utilities.utilities.multiline_string_utils import remove_indentation_from
 from pytest import ExitCode
 
@@ -271,6 +275,72 @@ def test_verify_raster_as_geo_tif_with_custom_tif_writer(testdir, tmp_path):
     assert result.ret == ExitCode.OK
 
 
+def test_custom_tif_writer_writes_to_the_file_system(testdir, tmp_path):
+    _, _, approved_dir = make_standard_geo_data_setting(testdir, tmp_path)
+    name = "test_approvaltests_geo_extensions.test_custom_tif_writer_writes_to_the_file_system"
+    make_raster_at([[1.0]], approved_dir / f"{name}.approved.tif")
+
+    testdir.makepyfile(f"""
+            from pathlib import Path
+            from pytest_approvaltests_geo.geo_options import GeoOptions
+            from pytest_approvaltests_geo.factories import make_raster
+            def write_to_file(f, a):
+                assert Path(f).parent.is_dir()
+                a.rio.to_raster(f)
+            def test_custom_tif_writer_writes_to_the_file_system(verify_raster_as_geo_tif):
+                verify_raster_as_geo_tif(make_raster([[1.0]]), options=GeoOptions().with_tif_writer(write_to_file))
+        """)
+
+    assert testdir.runpytest(Path(testdir.tmpdir), '-v').ret == ExitCode.OK
+
+
+def test_verify_raster_as_geo_tif_in_memory(testdir, tmp_path):
+    _, _, approved_dir = make_standard_geo_data_setting(testdir, tmp_path)
+    approved = "test_approvaltests_geo_extensions.test_verify_raster_as_geo_tif_in_memory.approved.tif"
+    make_raster_at([[1.0]], approved_dir / approved)
+
+    testdir.makepyfile(f"""
+            from pytest_approvaltests_geo.factories import make_raster
+            def test_verify_raster_as_geo_tif_in_memory(verify_raster_as_geo_tif):
+                verify_raster_as_geo_tif(make_raster([[1.0]]))
+        """)
+
+    assert testdir.runpytest(Path(testdir.tmpdir), '-v').ret == ExitCode.OK
+    assert [p.name for p in approved_dir.iterdir()] == [approved]
+
+
+def test_verify_raster_as_geo_tif_in_memory_writes_received_on_failure(testdir, tmp_path):
+    _, _, approved_dir = make_standard_geo_data_setting(testdir, tmp_path)
+    name = "test_approvaltests_geo_extensions.test_verify_raster_as_geo_tif_in_memory_writes_received_on_failure"
+    make_raster_at([[1.0]], approved_dir / f"{name}.approved.tif")
+
+    testdir.makepyfile(f"""
+            from pytest_approvaltests_geo.factories import make_raster
+            def test_verify_raster_as_geo_tif_in_memory_writes_received_on_failure(verify_raster_as_geo_tif):
+                verify_raster_as_geo_tif(make_raster([[2.0]]))
+        """)
+
+    assert testdir.runpytest(Path(testdir.tmpdir), '-v').ret == ExitCode.TESTS_FAILED
+    with rasterio.open(approved_dir / f"{name}.received.tif") as rds:
+        assert rds.read(1).tolist() == [[2.0]]
+
+
+def test_verify_raster_as_geo_tif_through_tmp_directory(testdir, tmp_path):
+    _, _, approved_dir = make_standard_geo_data_setting(testdir, tmp_path)
+    make_raster_at([[1.0]], approved_dir /
+                   "test_approvaltests_geo_extensions.test_verify_raster_as_geo_tif_through_tmp_directory.approved.tif")
+
+    testdir.makepyfile(f"""
+            from pytest_approvaltests_geo.geo_options import GeoOptions
+            from pytest_approvaltests_geo.factories import make_raster
+            def test_verify_raster_as_geo_tif_through_tmp_directory(verify_raster_as_geo_tif):
+                verify_raster_as_geo_tif(make_raster([[1.0]]), options=GeoOptions().with_raster_in_memory(False))
+        """)
+
+    result = testdir.runpytest(Path(testdir.tmpdir), '-v')
+    assert result.ret == ExitCode.OK
+
+
 def test_verify_multiple_rasters_as_geo_tif(testdir, make_tmp_approval_tif):
     make_tmp_approval_tif([[1]],
                           "test_approvaltests_geo_extensions.test_verify_multiple_rasters_as_geo_tif.0.approved.tif")
@@ -374,6 +444,41 @@ def test_verify_geo_nc(testdir, tmp_path):
     assert result.ret == ExitCode.OK
 
 
+def test_verify_geo_dataset_as_zarr(testdir, tmp_path):
+    _, _, approved_dir = make_standard_geo_data_setting(testdir, tmp_path)
+    approved = "test_approvaltests_geo_extensions.test_verify_geo_dataset_as_zarr.approved.zarr"
+    make_zarr_at([[1.0]], approved_dir / approved, dict(some='tag'))
+
+    testdir.makepyfile(f"""
+            from xarray import Dataset
+            from pytest_approvaltests_geo.factories import make_raster
+            def test_verify_geo_dataset_as_zarr(verify_geo_dataset):
+                verify_geo_dataset(Dataset(dict(var_name=make_raster([[1.0]])), attrs=dict(some='tag')), "zarr")
+        """)
+
+    assert testdir.runpytest(Path(testdir.tmpdir), '-v').ret == ExitCode.OK
+    assert [p.name for p in approved_dir.iterdir()] == [approved]
+
+
+def test_verify_geo_dataset_as_nc_writes_received_on_failure(testdir, tmp_path):
+    _, _, approved_dir = make_standard_geo_data_setting(testdir, tmp_path)
+    name = "test_approvaltests_geo_extensions.test_verify_geo_dataset_as_nc_writes_received_on_failure"
+    make_nc_at([[1.0]], approved_dir / f"{name}.approved.nc")
+
+    testdir.makepyfile(f"""
+            from xarray import Dataset
+            from pytest_approvaltests_geo.factories import make_raster
+            def test_verify_geo_dataset_as_nc_writes_received_on_failure(verify_geo_dataset):
+                verify_geo_dataset(Dataset(dict(var_name=make_raster([[2.0]]))), format="nc")
+        """)
+
+    result = testdir.runpytest(Path(testdir.tmpdir), '-v')
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.stdout.fnmatch_lines(["*var_name: min=1.0, max=1.0*"])
+    with xr.open_dataset(approved_dir / f"{name}.received.nc") as received:
+        assert received.var_name.values.tolist() == [[[2.0]]]
+
+
 def test_doc_tests_still_working(pytester, tmp_path):
     make_standard_geo_data_setting(pytester, tmp_path)
 
@@ -390,3 +495,66 @@ def test_doc_tests_still_working(pytester, tmp_path):
 
     result = pytester.runpytest(Path(pytester.path), '--doctest-modules')
     assert result.ret == ExitCode.OK
+
+
+def test_verification_profile_options(testdir, tmp_path):
+    _, _, approved_dir = make_standard_geo_data_setting(testdir, tmp_path)
+    tif_file = make_raster_at([[42]], tmp_path / "a_tif_to_test.tif")
+    make_raster_at([[42]], approved_dir / "test_approvaltests_geo_extensions.test_verification_profile_options"
+                                          ".approved.tif")
+
+    testdir.makepyfile(f"""
+            def test_verification_profile_options(verify_geo_tif):
+                verify_geo_tif("{tif_file.as_posix()}")
+        """)
+
+    log_path = tmp_path / "profile.jsonl"
+    result = testdir.runpytest('--approval-test-geo-durations=5',
+                               f'--approval-test-geo-profile-log={log_path.as_posix()}')
+    assert result.ret == ExitCode.OK
+    result.stdout.fnmatch_lines(["*slowest 5 geo verifications*",
+                                 "*s passed *::test_verification_profile_options"])
+    assert len(log_path.read_text().splitlines()) == 1
+
+
+def test_verification_profile_summarizes_records_of_xdist_workers(testdir, tmp_path):
+    pytest.importorskip("xdist")
+    make_standard_geo_data_setting(testdir, tmp_path)
+    tif_file = make_raster_at([[42]], tmp_path / "a_tif_to_test.tif")
+
+    testdir.makepyfile(f"""
+            def test_verify_0(verify_geo_tif):
+                verify_geo_tif("{tif_file.as_posix()}")
+
+            def test_verify_1(verify_geo_tif):
+                verify_geo_tif("{tif_file.as_posix()}")
+        """)
+
+    log_path = tmp_path / "profile.jsonl"
+    result = testdir.runpytest('-n', '2', '--approval-test-geo-durations=0',
+                               f'--approval-test-geo-profile-log={log_path.as_posix()}')
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.stdout.fnmatch_lines(["*slowest all geo verifications*"])
+    result.stdout.fnmatch_lines_random(["*s failed *::test_verify_0", "*s failed *::test_verify_1"])
+    assert len(log_path.read_text().splitlines()) == 2
+
+
+def test_plugin_registers_without_geo_libraries(testdir, tmp_path, monkeypatch):
+    make_standard_geo_data_setting(testdir, tmp_path)
+    monkeypatch.setenv("PYTEST_DISABLE_PLUGIN_AUTOLOAD", "1")
+    testdir.makepyfile("""
+            import sys
+
+            def test_plugin_registers_without_geo_libraries(approved_geo_directory, verify_geo_tif):
+                assert approved_geo_directory is not None
+                assert not {'rasterio', 'rioxarray', 'xarray', 'numpy'} & set(sys.modules)
+        """)
+
+    result = testdir.runpytest_subprocess('-p', 'pytest_approvaltests_geo', '-p', 'no:cacheprovider')
+    assert result.ret == ExitCode.OK
+
+
+def test_plugin_imports_geo_libraries_on_first_verification():
+    script = "import sys, pytest_approvaltests_geo as p; " \
+             "assert 'rasterio' not in sys.modules; p.verify_geo_tif; assert 'rasterio' in sys.modules"
+    subprocess.run([sys.executable, "-c", script], check=True)
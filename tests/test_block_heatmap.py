@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import rasterio
+
+from factories import make_raster_at, make_zarr_at, make_nc_at, make_raster_with_overviews_at
+from pytest_approvaltests_geo.differs.block_heatmap import iter_block_regions, HEATMAP_BANDS
+from pytest_approvaltests_geo.differs.lazy_comparison import LazyComparison
+from pytest_approvaltests_geo.reporters.report_geo_ncs import ReportGeoNcs
+from pytest_approvaltests_geo.reporters.report_geo_tiffs import ReportGeoTiffs
+from pytest_approvaltests_geo.reporters.report_geo_zarrs import ReportGeoZarrs
+
+
+def read_heatmap(path):
+    with rasterio.open(path) as rds:
+        return rds.read(), rds.transform, rds.descriptions
+
+
+def test_windows_are_split_along_block_borders():
+    assert list(iter_block_regions(8, 0, 24, 20, (16, 16))) == [
+        (8, 0, slice(0, 8), slice(0, 16)), (8, 16, slice(0, 8), slice(16, 20)),
+        (16, 0, slice(8, 24), slice(0, 16)), (16, 16, slice(8, 24), slice(16, 20))]
+
+
+def test_report_writes_block_heatmap_of_geo_tiffs(tmp_path, capsys):
+    profile = dict(tiled=True, blockxsize=16, blockysize=16)
+    received = make_raster_at(np.zeros((64, 64)), tmp_path / "received.tif", **profile)
+    approved_values = np.zeros((64, 64))
+    approved_values[20, 40] = 3
+    approved_values[50, 5] = np.nan
+    approved = make_raster_at(approved_values, tmp_path / "approved.tif", **profile)
+    ReportGeoTiffs(memory_limit=32 * 32 * 8 * 6, block_heatmap=True).report(received.as_posix(), approved.as_posix())
+
+    heatmap_path = tmp_path / "received.heatmap.tif"
+    assert f"block difference heatmap: {heatmap_path}" in capsys.readouterr().out
+    bands, transform, descriptions = read_heatmap(heatmap_path)
+    assert bands.shape == (3, 4, 4) and descriptions == HEATMAP_BANDS
+    assert (transform.a, transform.e) == (16, 16)
+    assert bands[0, 1, 2] == 3 and bands[1, 1, 2] == 1 / 256 and bands[2, 1, 2] == 0
+    assert bands[0, 3, 0] == 0 and bands[1, 3, 0] == 1 / 256 and bands[2, 3, 0] == -1
+    assert np.count_nonzero(bands[1]) == 2
+
+
+def test_report_writes_no_block_heatmap_by_default(tmp_path):
+    received = make_raster_at(np.zeros((16, 16)), tmp_path / "received.tif")
+    approved = make_raster_at(np.ones((16, 16)), tmp_path / "approved.tif")
+    ReportGeoTiffs().report(received.as_posix(), approved.as_posix())
+    assert not (tmp_path / "received.heatmap.tif").exists()
+
+
+def test_report_writes_block_heatmap_only_at_full_resolution(tmp_path):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_raster_with_overviews_at(values, tmp_path / "received.tif")
+    approved = make_raster_with_overviews_at(values + 1, tmp_path / "approved.tif")
+    ReportGeoTiffs(compare_overviews=True, block_heatmap=True).report(received.as_posix(), approved.as_posix())
+    bands, transform, _ = read_heatmap(tmp_path / "received.heatmap.tif")
+    assert bands.shape == (3, 4, 4) and transform.a == 16
+    assert list(tmp_path.glob("*.heatmap.tif")) == [tmp_path / "received.heatmap.tif"]
+
+
+def test_report_writes_block_heatmap_of_each_data_variable(tmp_path):
+    values = np.zeros((32, 32))
+    received = make_nc_at(values, tmp_path / "received.nc")
+    values[20, 30] = 2
+    approved = make_nc_at(values, tmp_path / "approved.nc")
+    ReportGeoNcs(block_heatmap=True).report(received.as_posix(), approved.as_posix())
+
+    bands, _, _ = read_heatmap(tmp_path / "received.var_name.heatmap.tif")
+    assert bands[:, 0, 0].tolist() == [2, 1 / 1024, 0]
+
+
+def test_lazy_report_writes_block_heatmap_of_dask_chunks(tmp_path):
+    pytest.importorskip("dask")
+    values = np.zeros((32, 32))
+    received = make_zarr_at(values, tmp_path / "received.zarr")
+    values[20, 30] = 2
+    approved = make_zarr_at(values, tmp_path / "approved.zarr")
+    reporter = ReportGeoZarrs(lazy=LazyComparison(chunks={'y': 8, 'x': 8}), block_heatmap=True)
+    reporter.report(received.as_posix(), approved.as_posix())
+
+    bands, transform, _ = read_heatmap(tmp_path / "received.var_name.heatmap.tif")
+    assert bands.shape == (3, 4, 4) and transform.a == 8
+    assert bands[0, 2, 3] == 2 and bands[1, 2, 3] == 1 / 64
+    assert np.nansum(bands[0]) == 2
@@ -6,6 +6,7 @@ from xarray import DataArray
 
 from factories import make_nc_at
 from pytest_approvaltests_geo.comparators.compare_geo_ncs import CompareGeoNcs
+from pytest_approvaltests_geo.differs.difference import PixelDiffStatsAccumulator
 from pytest_approvaltests_geo.float_utils import Tolerance
 from pytest_approvaltests_geo.scrubbers import make_scrubber_recurse
 
@@ -67,3 +68,10 @@ def test_compare_geo_ncs_floats_with_tolerances(tmp_path):
     received = make_nc_at([[-1.01]], tmp_path / "received.nc")
     approved = make_nc_at([[-1.0]], tmp_path / "approved.nc")
     assert tolerant_comparator.compare(received.as_posix(), approved.as_posix())
+
+
+def test_compare_geo_ncs_does_not_calculate_statistics(comparator, tmp_path, monkeypatch):
+    received = make_nc_at([[42]], tmp_path / "received.nc")
+    approved = make_nc_at([[21]], tmp_path / "approved.nc")
+    monkeypatch.setattr(PixelDiffStatsAccumulator, 'add', lambda *args: pytest.fail("compare calculated statistics"))
+    assert not comparator.compare(received.as_posix(), approved.as_posix())
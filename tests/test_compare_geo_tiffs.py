@@ -1,12 +1,16 @@
 from datetime import datetime
 
+import numpy as np
 import pytest
 from approvaltests.scrubbers import create_regex_scrubber
 from xarray import DataArray
 
-from factories import make_raster_at
+from factories import make_raster_at, make_raster_with_overviews_at
 from pytest_approvaltests_geo.comparators.compare_geo_tiffs import CompareGeoTiffs
+from pytest_approvaltests_geo.differs import differ_of_geo_tiffs
+from pytest_approvaltests_geo.differs.difference import PixelDiffStatsAccumulator
 from pytest_approvaltests_geo.float_utils import Tolerance
+from pytest_approvaltests_geo.geo_io import iter_block_windows
 from pytest_approvaltests_geo.scrubbers import make_scrubber_recurse, make_scrubber_sequential
 
 
@@ -63,3 +67,97 @@ def test_compare_geo_tiffs_floats_with_tolerances(tmp_path):
     received = make_raster_at([[-1.01]], tmp_path / "received.tif")
     approved = make_raster_at([[-1.0]], tmp_path / "approved.tif")
     assert tolerant_comparator.compare(received.as_posix(), approved.as_posix())
+
+
+def test_compare_geo_tiffs_with_differing_pixels_in_last_window(tmp_path):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_raster_at(values, tmp_path / "received.tif", tiled=True, blockxsize=16, blockysize=16)
+    values[-1, -1] = 1
+    approved = make_raster_at(values, tmp_path / "approved.tif", tiled=True, blockxsize=16, blockysize=16)
+    assert not CompareGeoTiffs(memory_limit=16 * 16 * 4).compare(received.as_posix(), approved.as_posix())
+
+
+def test_compare_geo_tiffs_with_different_shapes(comparator, tmp_path):
+    received = make_raster_at([[42, 42]], tmp_path / "received.tif")
+    approved = make_raster_at([[42]], tmp_path / "approved.tif")
+    assert not comparator.compare(received.as_posix(), approved.as_posix())
+
+
+def test_compare_geo_tiffs_stops_at_first_differing_window(tmp_path, monkeypatch, compared_arrays):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_raster_at(values, tmp_path / "received.tif", tiled=True, blockxsize=16, blockysize=16)
+    values[0, 0] = 1
+    values[-1, -1] = 1
+    approved = make_raster_at(values, tmp_path / "approved.tif", tiled=True, blockxsize=16, blockysize=16)
+
+    monkeypatch.setattr(PixelDiffStatsAccumulator, 'add', lambda *args: pytest.fail("compare calculated statistics"))
+    assert not CompareGeoTiffs(memory_limit=16 * 16 * 4).compare(received.as_posix(), approved.as_posix())
+    assert [r.shape for r, _ in compared_arrays] == [(1, 16, 16)]
+
+
+def test_compare_geo_tiffs_of_differing_encodings_stops_at_first_decoded_differing_window(tmp_path, monkeypatch):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_raster_at(values, tmp_path / "received.tif", tiled=True, blockxsize=16, blockysize=16,
+                              compress="deflate")
+    values[0, 0] = 1
+    approved = make_raster_at(values, tmp_path / "approved.tif", tiled=True, blockxsize=16, blockysize=16)
+    visited_windows = []
+
+    def _recording_windows(rds, max_window_bytes):
+        for window in iter_block_windows(rds, max_window_bytes):
+            visited_windows.append(window)
+            yield window
+
+    monkeypatch.setattr(differ_of_geo_tiffs, 'iter_block_windows', _recording_windows)
+    monkeypatch.setattr(PixelDiffStatsAccumulator, 'add', lambda *args: pytest.fail("compare calculated statistics"))
+    assert not CompareGeoTiffs(memory_limit=16 * 16 * 4).compare(received.as_posix(), approved.as_posix())
+    assert len(visited_windows) == 1
+
+
+@pytest.mark.parametrize('differing_band', [None, 0, 5])
+def test_compare_geo_tiffs_decoding_bands_concurrently(tmp_path, differing_band):
+    values = np.zeros((6, 64, 64), dtype=np.float32)
+    received = make_raster_at(values, tmp_path / "received.tif", tiled=True, blockxsize=16, blockysize=16)
+    if differing_band is not None:
+        values[differing_band, -1, -1] = 1
+    approved = make_raster_at(values, tmp_path / "approved.tif", tiled=True, blockxsize=16, blockysize=16,
+                              compress='deflate')
+    comparator = CompareGeoTiffs(memory_limit=16 * 16 * 4, decode_threads=3)
+    assert comparator.compare(received.as_posix(), approved.as_posix()) == (differing_band is None)
+
+
+def test_compare_geo_tiffs_overviews_from_coarsest_to_full_resolution(tmp_path, compared_arrays):
+    values = np.random.default_rng(0).normal(size=(64, 64)).astype(np.float32)
+    received = make_raster_with_overviews_at(values, tmp_path / "received.tif")
+    approved = make_raster_with_overviews_at(values + 1e-4, tmp_path / "approved.tif")
+    comparator = CompareGeoTiffs(float_tolerance=Tolerance(abs=1e-3), compare_overviews=True)
+    assert comparator.compare(received.as_posix(), approved.as_posix())
+    assert [r.shape for r, _ in compared_arrays] == [(1, 8, 8), (1, 16, 16), (1, 32, 32)] + [(1, 16, 16)] * 16
+
+
+@pytest.mark.parametrize('decode_threads', [None, 2])
+def test_compare_geo_tiffs_confirms_coarsest_violating_overview_at_full_resolution(tmp_path, compared_arrays,
+                                                                                   decode_threads):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_raster_with_overviews_at(values, tmp_path / "received.tif")
+    approved = make_raster_with_overviews_at(values + 1, tmp_path / "approved.tif")
+    comparator = CompareGeoTiffs(compare_overviews=True, decode_threads=decode_threads)
+    assert not comparator.compare(received.as_posix(), approved.as_posix())
+    assert [r.shape for r, _ in compared_arrays] == [(1, 8, 8), (1, 64, 64)]
+
+
+def test_compare_geo_tiffs_does_not_fail_on_overviews_violating_the_tolerance_alone(tmp_path):
+    approved_values = np.tile(np.array([100, -100], dtype=np.float32), (64, 32))
+    received = make_raster_with_overviews_at(approved_values + 0.5, tmp_path / "received.tif")
+    approved = make_raster_with_overviews_at(approved_values, tmp_path / "approved.tif")
+    comparator = CompareGeoTiffs(float_tolerance=Tolerance(rel=0.01), compare_overviews=True)
+    assert comparator.compare(received.as_posix(), approved.as_posix())
+
+
+def test_compare_geo_tiffs_without_shared_overviews_compares_full_resolution(tmp_path, compared_arrays):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_raster_with_overviews_at(values, tmp_path / "received.tif", factors=(2,))
+    approved = make_raster_with_overviews_at(values + 1e-4, tmp_path / "approved.tif")
+    comparator = CompareGeoTiffs(float_tolerance=Tolerance(abs=1e-3), compare_overviews=True)
+    assert comparator.compare(received.as_posix(), approved.as_posix())
+    assert [r.shape for r, _ in compared_arrays] == [(1, 16, 16)] * 16
@@ -0,0 +1,87 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from pytest_approvaltests_geo.differs.compare_kernel import CompareKernel
+from pytest_approvaltests_geo.differs.difference import PixelDiffStatsAccumulator, WorstPixelsAccumulator
+from pytest_approvaltests_geo.float_utils import Tolerance, count_tolerance_violations
+
+
+def make_pixels(dtype, n, rng):
+    received = (rng.normal(size=n) * 100).astype(dtype)
+    approved = received.copy()
+    perturbed = rng.random(n) < 0.01
+    approved[perturbed] += 1
+    if approved.dtype.kind == 'f':
+        received[rng.random(n) < 0.01] = np.nan
+        approved[rng.random(n) < 0.01] = np.nan
+        received[:4] = np.inf
+        approved[2:6] = [np.inf, -np.inf, np.inf, 1]
+    return received, approved
+
+
+@pytest.mark.parametrize('tolerance', [Tolerance(), Tolerance(rel=1e-3, abs=0.5)])
+@pytest.mark.parametrize('received_dtype, approved_dtype', [
+    ('float32', 'float32'), ('float64', 'float32'), ('float32', 'float64'), ('int16', 'int16'), ('uint8', 'uint8'),
+    ('float32', 'int16'), ('complex64', 'complex64')])
+def test_kernel_equals_tolerance_check_and_statistics(received_dtype, approved_dtype, tolerance):
+    received, approved = make_pixels(received_dtype, 100_003, np.random.default_rng(42))
+    approved = approved.astype(approved_dtype)
+    stats = PixelDiffStatsAccumulator()
+    kernel = CompareKernel(tolerance, chunk_size=4096)
+
+    assert kernel.compare(received, approved, stats) == count_tolerance_violations(received, approved, tolerance)
+    assert str(stats.stats()) == str(PixelDiffStatsAccumulator().add(approved, received).stats())
+
+
+def test_kernel_counts_violations_of_non_numeric_values():
+    received = np.array(['a', 'b', 'c', 'd'])
+    assert CompareKernel(Tolerance()).count_violations(received, np.array(['a', 'x', 'c', 'y'])) == 2
+
+
+def test_kernel_reverses_nan_difference():
+    stats = PixelDiffStatsAccumulator()
+    CompareKernel(Tolerance(), reverse_nans=True).compare([np.nan, 1.0], [0.0, 1.0], stats)
+    assert stats.nans == -1
+
+
+def test_kernel_collects_worst_violating_pixels_at_their_indices():
+    received = np.zeros((2, 3, 4))
+    approved = received.copy()
+    approved[0, 1, 2] = 5
+    approved[1, 2, 3] = np.nan
+    approved[0, 0, 1] = 1
+    approved[1, 0, 0] = 0.1
+    worst = WorstPixelsAccumulator(2)
+
+    assert CompareKernel(Tolerance(abs=0.5), chunk_size=5).compare(received, approved, worst=worst,
+                                                                   origin=(1, 10, 20)) == 3
+    assert [(p.index, p.approved) for p in worst.pixels()][1:] == [((1, 11, 22), 5.0)]
+    assert worst.pixels()[0].index == (2, 12, 23) and np.isnan(worst.pixels()[0].abs_diff)
+
+
+def test_worst_pixels_of_chunks_equal_those_of_all_pixels():
+    rng = np.random.default_rng(42)
+    received = rng.normal(size=(7, 1001))
+    approved = received + rng.normal(size=(7, 1001))
+    worst = WorstPixelsAccumulator(20)
+    CompareKernel(Tolerance(), chunk_size=512).compare(received, approved, worst=worst)
+
+    expected = np.argsort(-np.abs(received - approved), axis=None)[:20]
+    assert [p.index for p in worst.pixels()] == [tuple(i) for i in zip(*np.unravel_index(expected, received.shape))]
+
+
+def test_kernel_allocates_no_full_size_temporaries():
+    received = np.zeros((4, 512, 512), dtype=np.float32)
+    approved = received + 1
+    kernel = CompareKernel(Tolerance(), chunk_size=4096)
+    kernel.compare(received, approved, PixelDiffStatsAccumulator(exact_limit=0))
+
+    tracemalloc.start()
+    try:
+        kernel.compare(received, approved, PixelDiffStatsAccumulator(exact_limit=0))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < received.nbytes / 16
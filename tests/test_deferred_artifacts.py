@@ -0,0 +1,76 @@
+import tempfile
+
+import pytest
+import rasterio
+from rasterio.io import MemoryFile
+from xarray import Dataset
+
+from factories import make_raster_at, make_zarr_at
+from pytest_approvaltests_geo.comparators.compare_geo_tiffs import CompareGeoTiffs
+from pytest_approvaltests_geo.comparators.compare_geo_zarrs import CompareGeoZarrs
+from pytest_approvaltests_geo.deferred_artifacts import DeferredReceivedWriter, MemoryFileArtifact, DatasetArtifact, \
+    has_value_changing_encoding
+from pytest_approvaltests_geo.differs.diff_session import DiffSession
+from pytest_approvaltests_geo.factories import make_raster
+from pytest_approvaltests_geo.geo_options import GeoOptions
+from pytest_approvaltests_geo.scrubbers import make_scrubber_recurse
+
+
+@pytest.fixture
+def memory_tif():
+    with MemoryFile(ext=".tif") as memory_file:
+        make_raster([[1.0]]).rio.to_raster(memory_file.name)
+        yield memory_file
+
+
+def test_deferred_received_file_is_compared_from_memory(memory_tif, tmp_path):
+    received = tmp_path / "received.tif"
+    approved = make_raster_at([[1.0]], tmp_path / "approved.tif")
+    with DiffSession() as session:
+        DeferredReceivedWriter(session, MemoryFileArtifact(memory_tif)).write_received_file(received.as_posix())
+        assert received.stat().st_size == 0
+        assert CompareGeoTiffs(session=session).compare(received.as_posix(), approved.as_posix())
+        received.unlink()
+    assert not received.exists()
+
+
+def test_deferred_received_file_is_written_if_placeholder_remains(memory_tif, tmp_path):
+    received = tmp_path / "received.tif"
+    approved = make_raster_at([[2.0]], tmp_path / "approved.tif")
+    with DiffSession() as session:
+        DeferredReceivedWriter(session, MemoryFileArtifact(memory_tif)).write_received_file(received.as_posix())
+        assert not CompareGeoTiffs(session=session).compare(received.as_posix(), approved.as_posix())
+    with rasterio.open(received) as rds:
+        assert rds.read(1).tolist() == [[1.0]]
+
+
+def test_byte_identical_memory_file(memory_tif, tmp_path):
+    approved = tmp_path / "approved.tif"
+    approved.write_bytes(memory_tif.getbuffer())
+    assert MemoryFileArtifact(memory_tif).is_byte_identical(approved)
+    assert not MemoryFileArtifact(memory_tif).is_byte_identical(make_raster_at([[2.0]], tmp_path / "other.tif"))
+
+
+def test_tmp_directory_is_only_created_when_not_given(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'mkdtemp', lambda: pytest.fail("created a temporary directory"))
+    assert GeoOptions().with_tmp_directory(tmp_path).tmp_directory == tmp_path
+
+
+def test_deferred_dataset_is_scrubbed_without_changing_it(tmp_path):
+    received = tmp_path / "received.zarr"
+    approved = make_zarr_at([[1.0]], tmp_path / "approved.zarr", dict(date='2022-01-02'))
+    dataset = Dataset(dict(var_name=make_raster([[1.0]])), attrs=dict(date='2022-01-01'))
+    with DiffSession() as session:
+        DeferredReceivedWriter(session, DatasetArtifact(dataset, "zarr")).write_received_file(received.as_posix())
+        comparator = CompareGeoZarrs(make_scrubber_recurse(lambda t: "<date>"), session=session)
+        assert comparator.compare(received.as_posix(), approved.as_posix())
+        received.unlink()
+    assert dataset.attrs == dict(date='2022-01-01')
+
+
+def test_value_changing_encodings():
+    dataset = Dataset(dict(var_name=make_raster([[1.0]])))
+    assert not has_value_changing_encoding(dataset)
+    dataset.var_name.encoding.update(dtype='int16', scale_factor=0.1)
+    assert has_value_changing_encoding(dataset)
+    assert has_value_changing_encoding(Dataset(dict(var_name=make_raster([[1]], attrs=dict(_FillValue=-1)))))
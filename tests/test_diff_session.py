@@ -0,0 +1,83 @@
+import pytest
+from xarray import Dataset
+
+from factories import make_raster_at, make_nc_at
+from pytest_approvaltests_geo.comparators.compare_geo_ncs import CompareGeoNcs
+from pytest_approvaltests_geo.comparators.compare_geo_tiffs import CompareGeoTiffs
+from pytest_approvaltests_geo.differs import differ_of_geo_tiffs
+from pytest_approvaltests_geo.differs.differ_of_geo_dataset import DifferOfGeoDataset
+from pytest_approvaltests_geo.differs.diff_session import DiffSession
+from pytest_approvaltests_geo.reporters.report_geo_ncs import ReportGeoNcs
+from pytest_approvaltests_geo.reporters.report_geo_tiffs import ReportGeoTiffs
+
+
+@pytest.fixture
+def count_tif_reads(monkeypatch):
+    reads = []
+    read_array_and_tags = differ_of_geo_tiffs.read_array_and_tags
+
+    def _counting_read(file_path):
+        reads.append(file_path)
+        return read_array_and_tags(file_path)
+
+    monkeypatch.setattr(differ_of_geo_tiffs, 'read_array_and_tags', _counting_read)
+    return reads
+
+
+def test_reporter_reuses_artifacts_of_failed_comparison(tmp_path, count_tif_reads, capsys):
+    received = make_raster_at([[42]], tmp_path / "received.tif")
+    approved = make_raster_at([[21]], tmp_path / "approved.tif")
+    with DiffSession() as session:
+        assert not CompareGeoTiffs(session=session).compare(received.as_posix(), approved.as_posix())
+        assert ReportGeoTiffs(session=session).report(received.as_posix(), approved.as_posix())
+    assert len(count_tif_reads) == 2
+    assert "min=21, max=21" in capsys.readouterr().out
+
+
+def test_reporter_releases_session_after_reporting(tmp_path, count_tif_reads, capsys):
+    received = make_raster_at([[42]], tmp_path / "received.tif")
+    approved = make_raster_at([[21]], tmp_path / "approved.tif")
+    with DiffSession() as session:
+        reporter = ReportGeoTiffs(session=session)
+        reporter.report(received.as_posix(), approved.as_posix())
+        reporter.report(received.as_posix(), approved.as_posix())
+    assert len(count_tif_reads) == 4
+
+
+def test_session_is_keyed_on_differ_options(tmp_path, count_tif_reads, capsys):
+    received = make_raster_at([[42]], tmp_path / "received.tif")
+    approved = make_raster_at([[21]], tmp_path / "approved.tif")
+    with DiffSession() as session:
+        CompareGeoTiffs(session=session).compare(received.as_posix(), approved.as_posix())
+        CompareGeoTiffs(lambda t: t, session=session).compare(received.as_posix(), approved.as_posix())
+    assert len(count_tif_reads) == 4
+
+
+def test_comparator_without_session_releases_artifacts(tmp_path, monkeypatch):
+    opened, closed = [], []
+    open_dataset, close_dataset = DifferOfGeoDataset._open, Dataset.close
+
+    def _recording_open(differ, path):
+        opened.append(open_dataset(differ, path))
+        return opened[-1]
+
+    def _recording_close(ds):
+        closed.append(ds)
+        close_dataset(ds)
+
+    monkeypatch.setattr(DifferOfGeoDataset, '_open', _recording_open)
+    monkeypatch.setattr(Dataset, 'close', _recording_close)
+    received = make_nc_at([[42]], tmp_path / "received.nc")
+    approved = make_nc_at([[21]], tmp_path / "approved.nc")
+    assert not CompareGeoNcs().compare(received.as_posix(), approved.as_posix())
+    assert len(opened) == 2
+    assert all(any(ds is c for c in closed) for ds in opened)
+
+
+def test_shared_session_reports_dataset_differences_of_comparison(tmp_path, capsys):
+    received = make_nc_at([[42]], tmp_path / "received.nc")
+    approved = make_nc_at([[21]], tmp_path / "approved.nc")
+    with DiffSession() as session:
+        assert not CompareGeoNcs(session=session).compare(received.as_posix(), approved.as_posix())
+        assert ReportGeoNcs(session=session).report(received.as_posix(), approved.as_posix())
+    assert "var_name: min=21, max=21" in capsys.readouterr().out
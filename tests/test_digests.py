@@ -0,0 +1,58 @@
+import pytest
+
+from factories import make_raster_at, make_zarr_at, make_nc_at
+from pytest_approvaltests_geo.comparators.compare_geo_ncs import CompareGeoNcs
+from pytest_approvaltests_geo.comparators.compare_geo_tiffs import CompareGeoTiffs
+from pytest_approvaltests_geo.comparators.compare_geo_zarrs import CompareGeoZarrs
+from pytest_approvaltests_geo.digests import are_byte_identical, file_digest, tree_digest
+
+
+@pytest.fixture
+def forbid_decoding(monkeypatch):
+    def _fail(*args):
+        raise AssertionError("byte identical artifacts must not be decoded")
+
+    for comparator_type in [CompareGeoTiffs, CompareGeoNcs, CompareGeoZarrs]:
+        monkeypatch.setattr(comparator_type, 'open_artifacts', _fail)
+
+
+def test_identical_file_bytes_have_equal_digests(tmp_path):
+    a = tmp_path / "a.bin"
+    b = tmp_path / "b.bin"
+    a.write_bytes(b"some bytes" * 1000)
+    b.write_bytes(b"some bytes" * 1000)
+    assert file_digest(a, chunk_size=7) == file_digest(b)
+    b.write_bytes(b"other bytes" * 1000)
+    assert file_digest(a) != file_digest(b)
+
+
+def test_tree_digest_depends_on_file_names_and_content(tmp_path):
+    (tmp_path / "a" / "sub").mkdir(parents=True)
+    (tmp_path / "b" / "sub").mkdir(parents=True)
+    (tmp_path / "a" / "sub" / "0.0").write_bytes(b"chunk")
+    (tmp_path / "b" / "sub" / "0.1").write_bytes(b"chunk")
+    assert tree_digest(tmp_path / "a") != tree_digest(tmp_path / "b")
+    (tmp_path / "b" / "sub" / "0.1").rename(tmp_path / "b" / "sub" / "0.0")
+    assert tree_digest(tmp_path / "a") == tree_digest(tmp_path / "b")
+
+
+def test_files_and_directories_are_never_byte_identical(tmp_path):
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "file").write_bytes(b"")
+    assert not are_byte_identical(tmp_path / "dir", tmp_path / "file")
+
+
+def test_byte_identical_artifacts_are_equal_without_decoding(tmp_path, forbid_decoding):
+    tif = make_raster_at([[42]], tmp_path / "geo.tif")
+    nc = make_nc_at([[42]], tmp_path / "geo.nc")
+    zarr = make_zarr_at([[42]], tmp_path / "geo.zarr")
+    assert CompareGeoTiffs().compare(tif.as_posix(), tif.as_posix())
+    assert CompareGeoNcs().compare(nc.as_posix(), nc.as_posix())
+    assert CompareGeoZarrs().compare(zarr.as_posix(), zarr.as_posix())
+
+
+def test_byte_differing_artifacts_are_decoded(tmp_path):
+    received = make_raster_at([[42]], tmp_path / "received.tif", dict(some='tag'))
+    approved = make_raster_at([[42]], tmp_path / "approved.tif", dict(some='other'))
+    assert not are_byte_identical(received, approved)
+    assert CompareGeoTiffs(lambda t: {}).compare(received.as_posix(), approved.as_posix())
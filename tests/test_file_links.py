@@ -0,0 +1,77 @@
+import os
+
+import pytest
+from approvaltests import Options
+
+from pytest_approvaltests_geo import file_links
+from pytest_approvaltests_geo.existing_dir_writer import ExistingDirWriter
+from pytest_approvaltests_geo.existing_file_link_writer import ExistingFileLinkWriter
+from pytest_approvaltests_geo.file_links import link_or_copy_file, link_or_copy_tree, HARDLINK, SYMLINK, REFLINK
+
+
+@pytest.fixture
+def src_file(tmp_path):
+    src = tmp_path / "src.bin"
+    src.write_bytes(b"some geo data")
+    return src
+
+
+def test_link_or_copy_file_falls_back_to_copy(src_file, tmp_path, monkeypatch):
+    def _unsupported(src, dst):
+        raise OSError("not supported")
+
+    monkeypatch.setitem(file_links._LINKERS, HARDLINK, _unsupported)
+    dst = tmp_path / "dst.bin"
+    link_or_copy_file(src_file, dst, [REFLINK, HARDLINK])
+    assert dst.read_bytes() == b"some geo data"
+    assert not os.path.samefile(src_file, dst)
+
+
+def test_link_or_copy_file_as_hardlink_replaces_existing_file(src_file, tmp_path):
+    dst = tmp_path / "dst.bin"
+    dst.write_bytes(b"stale")
+    link_or_copy_file(src_file, dst, [HARDLINK])
+    assert os.path.samefile(src_file, dst)
+    assert dst.read_bytes() == b"some geo data"
+
+
+def test_link_or_copy_file_as_symlink(src_file, tmp_path):
+    dst = tmp_path / "dst.bin"
+    link_or_copy_file(src_file, dst, [SYMLINK])
+    assert dst.is_symlink() and dst.read_bytes() == b"some geo data"
+
+
+def test_link_or_copy_file_rejects_unknown_modes(src_file, tmp_path):
+    with pytest.raises(ValueError, match="unknown link modes"):
+        link_or_copy_file(src_file, tmp_path / "dst.bin", ["junction"])
+
+
+def test_link_or_copy_tree_links_every_file(tmp_path):
+    src = tmp_path / "src.zarr"
+    (src / "var").mkdir(parents=True)
+    (src / ".zgroup").write_text("{}")
+    (src / "var" / "0.0").write_bytes(b"chunk")
+    link_or_copy_tree(src, tmp_path / "dst.zarr", [HARDLINK])
+    assert os.path.samefile(src / "var" / "0.0", tmp_path / "dst.zarr" / "var" / "0.0")
+    assert (tmp_path / "dst.zarr" / ".zgroup").read_text() == "{}"
+
+
+def test_existing_dir_writer_replaces_received_tree(tmp_path):
+    src = tmp_path / "src.zarr"
+    src.mkdir()
+    (src / "chunk").write_bytes(b"new")
+    received = tmp_path / "received.zarr"
+    received.mkdir()
+    (received / "stale").write_bytes(b"old")
+    ExistingDirWriter(src.as_posix(), [HARDLINK]).write_received_file(received.as_posix())
+    assert sorted(p.name for p in received.iterdir()) == ["chunk"]
+
+
+def test_existing_file_link_writer_scrubs_instead_of_linking(tmp_path):
+    src = tmp_path / "src.txt"
+    src.write_text("secret")
+    received = tmp_path / "received.txt"
+    options = Options().with_scrubber(lambda t: t.replace("secret", "<scrubbed>"))
+    ExistingFileLinkWriter(src.as_posix(), options, [HARDLINK]).write_received_file(received.as_posix())
+    assert received.read_text() == "<scrubbed>"
+    assert not os.path.samefile(src, received)
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+import rasterio
+from xarray import Dataset
+
+from factories import make_raster_at
+from pytest_approvaltests_geo.geo_io import iter_block_windows, iter_windows_read_concurrently, band_groups_of, \
+    memmap_raster, memmap_netcdf3_variable
+from pytest_approvaltests_geo.parallel import WorkerThreadPoolExecutor, worker_resources
+
+
+def covered_pixels(windows):
+    return sum(w.width * w.height for w in windows)
+
+
+def test_block_windows_of_tiled_raster_are_block_aligned(tmp_path):
+    tif = make_raster_at(np.zeros((2, 40, 50), dtype=np.float32), tmp_path / "tiled.tif",
+                         tiled=True, blockxsize=16, blockysize=16)
+    with rasterio.open(tif) as rds:
+        windows = list(iter_block_windows(rds, 2 * 4 * 16 * 32))
+    assert covered_pixels(windows) == 40 * 50
+    assert all(w.col_off % 16 == 0 and w.row_off % 16 == 0 for w in windows)
+    assert max(w.width * w.height for w in windows) == 16 * 32
+
+
+def test_block_windows_group_whole_rows_when_they_fit(tmp_path):
+    tif = make_raster_at(np.zeros((40, 50), dtype=np.uint8), tmp_path / "striped.tif", blockysize=5)
+    with rasterio.open(tif) as rds:
+        windows = list(iter_block_windows(rds, 50 * 10))
+    assert [(w.row_off, w.height, w.width) for w in windows] == [(0, 10, 50), (10, 10, 50), (20, 10, 50),
+                                                                 (30, 10, 50)]
+
+
+def test_block_windows_are_never_smaller_than_a_block(tmp_path):
+    tif = make_raster_at(np.zeros((40, 50), dtype=np.float64), tmp_path / "tiled.tif",
+                         tiled=True, blockxsize=16, blockysize=16)
+    with rasterio.open(tif) as rds:
+        windows = list(iter_block_windows(rds, 1))
+    assert len(windows) == 3 * 4
+    assert covered_pixels(windows) == 40 * 50
+
+
+def test_windows_read_concurrently_equal_sequential_reads(tmp_path):
+    values = np.arange(3 * 40 * 50, dtype=np.float32).reshape(3, 40, 50)
+    tif = make_raster_at(values, tmp_path / "bands.tif", tiled=True, blockxsize=16, blockysize=16,
+                         interleave='band')
+    other = make_raster_at(values + 1, tmp_path / "other.tif", tiled=True, blockxsize=16, blockysize=16)
+    with rasterio.open(tif) as rds:
+        windows = list(iter_block_windows(rds, 2 * 4 * 16 * 16))
+        assert band_groups_of(rds) == [[1], [2], [3]]
+    with WorkerThreadPoolExecutor(3) as executor:
+        reads = list(iter_windows_read_concurrently(executor, [tif.as_posix(), other.as_posix()], windows,
+                                                    band_groups_of(rds), max_in_flight=2))
+        assert executor.submit(lambda: worker_resources().opened).result() <= 2
+    assert [window for window, _ in reads] == windows
+    for window, (tif_values, other_values) in reads:
+        np.testing.assert_array_equal(tif_values, values[:, window.toslices()[0], window.toslices()[1]])
+        np.testing.assert_array_equal(other_values, tif_values + 1)
+
+
+def test_pixel_interleaved_bands_are_read_together(tmp_path):
+    tif = make_raster_at(np.zeros((3, 4, 4), dtype=np.uint8), tmp_path / "pixels.tif", interleave='pixel')
+    with rasterio.open(tif) as rds:
+        assert band_groups_of(rds) == [None]
+
+
+@pytest.mark.parametrize('interleave', ['band', 'pixel'])
+def test_uncompressed_striped_rasters_are_memory_mapped(tmp_path, interleave):
+    values = np.arange(3 * 40 * 50, dtype=np.int16).reshape(3, 40, 50)
+    tif = make_raster_at(values, tmp_path / "bands.tif", interleave=interleave, blockysize=7)
+    with rasterio.open(tif) as rds:
+        mapped = memmap_raster(rds)
+        np.testing.assert_array_equal(mapped, rds.read())
+    assert not mapped.flags.owndata and not mapped.flags.writeable
+
+
+def test_compressed_or_tiled_rasters_are_not_memory_mapped(tmp_path):
+    values = np.zeros((40, 50), dtype=np.float32)
+    compressed = make_raster_at(values, tmp_path / "compressed.tif", compress="deflate")
+    tiled = make_raster_at(values, tmp_path / "tiled.tif", tiled=True, blockxsize=16, blockysize=16)
+    for tif in [compressed, tiled]:
+        with rasterio.open(tif) as rds:
+            assert memmap_raster(rds) is None
+
+
+def test_netcdf3_variables_are_memory_mapped(tmp_path):
+    values = np.arange(12, dtype=np.float32).reshape(3, 4)
+    ds = Dataset(dict(plain=(('y', 'x'), values), scaled=(('y', 'x'), values, dict(scale_factor=2.0))))
+    ds.to_netcdf(tmp_path / "v3.nc", format="NETCDF3_64BIT")
+    ds.to_netcdf(tmp_path / "v4.nc", format="NETCDF4")
+
+    mapped = memmap_netcdf3_variable(tmp_path / "v3.nc", 'plain')
+    assert isinstance(mapped, np.memmap) and not mapped.flags.writeable
+    np.testing.assert_array_equal(mapped, values)
+    np.testing.assert_array_equal(memmap_netcdf3_variable(tmp_path / "v3.nc", 'plain', (slice(1, 3),)), values[1:])
+    assert memmap_netcdf3_variable(tmp_path / "v3.nc", 'scaled') is None
+    assert memmap_netcdf3_variable(tmp_path / "v4.nc", 'plain') is None
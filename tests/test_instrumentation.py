@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+import pytest
+from approvaltests.approval_exception import ApprovalException
+
+from factories import make_raster_at, make_nc_at
+from pytest_approvaltests_geo import verify_geo_tif, verify_geo_nc
+from pytest_approvaltests_geo.geo_options import GeoOptions
+from pytest_approvaltests_geo.instrumentation import VerificationRecorder, VerificationProfile, \
+    add_verification_listener, remove_verification_listener, new_verification_recorder, format_record, \
+    WRITE_RECEIVED, DIGEST, OPEN, COMPARE_VALUES, DIFF_STATS, REPORT
+
+
+@pytest.fixture
+def records():
+    records = []
+    add_verification_listener(records.append)
+    yield records
+    remove_verification_listener(records.append)
+
+
+def test_nested_phases_record_exclusive_seconds(records):
+    recorder = VerificationRecorder("approved.tif")
+    with recorder.phase("outer"):
+        with recorder.phase("inner"):
+            sum(range(100000))
+    recorder.add_pixels(42)
+    record = recorder.finish(passed=False)
+
+    assert records == [record]
+    assert not record.passed and record.pixels == 42
+    assert record.phases["inner"] > 0 and record.phases["outer"] >= 0
+    assert sum(record.phases.values()) + record.other == pytest.approx(record.seconds)
+    assert record.test.endswith("test_nested_phases_record_exclusive_seconds")
+
+
+def test_no_recorder_without_listeners():
+    assert new_verification_recorder("approved.tif") is None
+
+
+def test_passing_verification_is_recorded(tmp_path, records):
+    tif = make_raster_at(np.zeros((8, 8)), tmp_path / "input.tif", tiled=True, blockxsize=16, blockysize=16)
+    make_raster_at(np.zeros((8, 8)), tmp_path / "test_instrumentation.test_passing_verification_is_recorded"
+                                                 ".approved.tif")
+    verify_geo_tif(tif, options=GeoOptions().with_approved_directory(tmp_path))
+
+    record, = records
+    assert record.passed and record.name.endswith(".approved.tif")
+    assert {WRITE_RECEIVED, DIGEST} <= set(record.phases)
+    assert record.bytes_read is None or record.bytes_read > 0
+
+
+def test_failing_verification_is_recorded(tmp_path, records):
+    nc = make_nc_at(np.ones((4, 4)), tmp_path / "input.nc")
+    make_nc_at(np.zeros((4, 4)), tmp_path / "test_instrumentation.test_failing_verification_is_recorded.approved.nc")
+    with pytest.raises(ApprovalException):
+        verify_geo_nc(nc, options=GeoOptions().with_approved_directory(tmp_path))
+
+    record, = records
+    assert not record.passed
+    assert {WRITE_RECEIVED, DIGEST, OPEN, COMPARE_VALUES, DIFF_STATS, REPORT} <= set(record.phases)
+    assert record.pixels == 2 * 16
+    assert "failed" in format_record(record)[0]
+
+
+def test_verification_profile_writes_json_lines(tmp_path):
+    profile = VerificationProfile(tmp_path / "profile.jsonl")
+    for name, seconds in [("a", 1.0), ("b", 3.0), ("c", 2.0)]:
+        recorder = VerificationRecorder(name)
+        recorder.record.seconds = seconds
+        profile(recorder.record)
+    profile.close()
+
+    assert [r.name for r in profile.slowest(2)] == ["b", "c"]
+    assert [r.name for r in profile.slowest(0)] == ["b", "c", "a"]
+    lines = [json.loads(line) for line in (tmp_path / "profile.jsonl").read_text().splitlines()]
+    assert [line["name"] for line in lines] == ["a", "b", "c"]
+    assert set(lines[0]) >= {"phases", "pixels", "bytes_read", "bytes_written", "peak_rss_growth", "other"}
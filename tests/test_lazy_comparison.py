@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from factories import make_zarr_at, make_nc_at
+from pytest_approvaltests_geo.comparators.compare_geo_ncs import CompareGeoNcs
+from pytest_approvaltests_geo.comparators.compare_geo_zarrs import CompareGeoZarrs
+from pytest_approvaltests_geo.differs.diff_session import DiffSession
+from pytest_approvaltests_geo.differs.lazy_comparison import LazyComparison
+from pytest_approvaltests_geo.float_utils import Tolerance
+from pytest_approvaltests_geo.reporters.report_geo_zarrs import ReportGeoZarrs
+
+pytest.importorskip("dask")
+
+
+@pytest.fixture(params=["threads", "synchronous"])
+def lazy(request):
+    return LazyComparison(scheduler=request.param, num_workers=2, chunks={'y': 8, 'x': 8})
+
+
+def test_lazy_compare_identical_geo_zarrs(lazy, tmp_path):
+    received = make_zarr_at(np.arange(32 * 32).reshape(32, 32), tmp_path / "received.zarr")
+    approved = make_zarr_at(np.arange(32 * 32).reshape(32, 32), tmp_path / "approved.zarr", dict(other='attrs'))
+    assert CompareGeoZarrs(lambda t: {}, lazy=lazy).compare(received.as_posix(), approved.as_posix())
+
+
+def test_lazy_compare_geo_ncs_with_differing_pixel_in_one_chunk(lazy, tmp_path):
+    values = np.zeros((32, 32))
+    received = make_nc_at(values, tmp_path / "received.nc")
+    values[31, 31] = 1
+    approved = make_nc_at(values, tmp_path / "approved.nc")
+    assert not CompareGeoNcs(lazy=lazy).compare(received.as_posix(), approved.as_posix())
+
+
+def test_lazy_compare_geo_zarrs_with_tolerance(lazy, tmp_path):
+    received = make_zarr_at(np.full((16, 16), -1.01), tmp_path / "received.zarr")
+    approved = make_zarr_at(np.full((16, 16), -1.0), tmp_path / "approved.zarr")
+    comparator = CompareGeoZarrs(float_tolerance=Tolerance(rel=0.008, abs=0.0021), lazy=lazy)
+    assert comparator.compare(received.as_posix(), approved.as_posix())
+
+
+def test_lazy_compare_geo_zarrs_with_differing_shapes(lazy, tmp_path):
+    received = make_zarr_at(np.zeros((16, 16)), tmp_path / "received.zarr")
+    approved = make_zarr_at(np.zeros((16, 8)), tmp_path / "approved.zarr")
+    assert not CompareGeoZarrs(lazy=lazy).compare(received.as_posix(), approved.as_posix())
+
+
+def test_lazy_report_merges_statistics_of_all_chunks(lazy, tmp_path, capsys):
+    received = make_zarr_at([[0, 0], [0, np.nan]], tmp_path / "received.zarr")
+    approved = make_zarr_at([[2, 6], [-1, 2]], tmp_path / "approved.zarr")
+    lazy.chunks = {'y': 1, 'x': 1}
+    assert ReportGeoZarrs(lazy=lazy).report(received.as_posix(), approved.as_posix())
+    output = capsys.readouterr().out
+    assert "var_name: min=1.0, max=6.0, mean=3.0, median=2.0, nans=-1" in output
+    assert "var_name: 4 of 4 values differ beyond tolerance" in output
+
+
+def test_lazy_report_lists_worst_values_over_all_chunks(lazy, tmp_path, capsys):
+    values = np.zeros((32, 32))
+    received = make_zarr_at(values, tmp_path / "received.zarr")
+    values[3, 4] = 1
+    values[20, 30] = 2
+    approved = make_zarr_at(values, tmp_path / "approved.zarr")
+    ReportGeoZarrs(lazy=lazy, worst_pixels=2).report(received.as_posix(), approved.as_posix())
+    output = capsys.readouterr().out
+    assert "    band=0, y=20, x=30 (at band=1, y=20, x=30): received=0.0, approved=2.0, abs diff=2.0\n" \
+           "    band=0, y=3, x=4 (at band=1, y=3, x=4): received=0.0, approved=1.0, abs diff=1.0" in output
+
+
+def test_eager_and_lazy_differs_do_not_share_session_artifacts(lazy, tmp_path):
+    received = make_zarr_at(np.zeros((16, 16)), tmp_path / "received.zarr")
+    approved = make_zarr_at(np.ones((16, 16)), tmp_path / "approved.zarr")
+    with DiffSession() as session:
+        eager_comparator = CompareGeoZarrs(session=session)
+        lazy_comparator = CompareGeoZarrs(session=session, lazy=lazy)
+        assert not eager_comparator.compare(received.as_posix(), approved.as_posix())
+        eager_artifacts = session.artifacts(eager_comparator, received, approved)
+        lazy_artifacts = session.artifacts(lazy_comparator, received, approved)
+    assert lazy_artifacts is not eager_artifacts
+    assert lazy_artifacts.received_ds["var_name"].chunks[1:] == ((8, 8), (8, 8))
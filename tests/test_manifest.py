@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from factories import make_raster_at
+from pytest_approvaltests_geo.comparators.compare_geo_ncs import CompareGeoNcs
+from pytest_approvaltests_geo.comparators.compare_geo_tiffs import CompareGeoTiffs
+from pytest_approvaltests_geo.comparators.compare_geo_zarrs import CompareGeoZarrs
+from pytest_approvaltests_geo.differs import differ_of_geo_tiffs
+from pytest_approvaltests_geo.differs.differ_of_geo_dataset import DifferOfGeoDataset
+from pytest_approvaltests_geo.differs.differ_of_geo_tiffs import DifferOfGeoTiffs
+from pytest_approvaltests_geo.differs.raw_chunks import zarr_chunk_hashes
+from pytest_approvaltests_geo.digests import file_digest
+from pytest_approvaltests_geo.float_utils import Tolerance
+from pytest_approvaltests_geo.manifest import ApprovedManifest, load_manifest, save_manifest, manifest_path, \
+    stat_signature
+from test_raw_chunks import make_tiled_raster_at, make_chunked_dataset
+
+
+def test_manifests_are_stale_once_the_approved_artifact_changes(tmp_path):
+    approved = make_raster_at(np.zeros((4, 4)), tmp_path / "approved.tif")
+    save_manifest(approved, ApprovedManifest(stat_signature(approved), "digest", dict(some='meta')))
+    assert manifest_path(approved) == tmp_path / "approved.tif.manifest.json"
+    assert load_manifest(approved).metadata == dict(some='meta')
+
+    make_raster_at(np.ones((8, 8)), approved)
+    assert load_manifest(approved) is None
+
+
+def test_invalid_manifests_are_ignored(tmp_path):
+    approved = make_raster_at(np.zeros((4, 4)), tmp_path / "approved.tif")
+    manifest_path(approved).write_text("{not json")
+    assert load_manifest(approved) is None
+
+
+def test_passing_tif_comparison_writes_manifest(tmp_path):
+    values = np.arange(64 * 64, dtype=np.float32).reshape(64, 64)
+    values[1, 1] = np.nan
+    received = make_tiled_raster_at(values, tmp_path / "received.tif", tags=dict(some='tag'))
+    approved = make_tiled_raster_at(values, tmp_path / "approved.tif", tags=dict(some='tag'))
+    assert CompareGeoTiffs(approved_manifests=True).compare(received.as_posix(), approved.as_posix())
+
+    manifest = load_manifest(approved)
+    assert manifest.metadata['tags'] == dict(some='tag')
+    assert manifest.metadata['shape'] == [1, 64, 64]
+    assert len(manifest.chunks['pixels'].hashes) == 16
+    assert manifest.stats == dict(band_1=dict(min=0.0, max=4095.0, mean=pytest.approx(np.nanmean(values)), nans=1))
+
+
+def test_passing_comparison_against_read_only_approved_directory_writes_no_manifest(tmp_path, recwarn):
+    approved_dir = tmp_path / "approved"
+    approved_dir.mkdir()
+    received = make_tiled_raster_at(np.ones((32, 32)), tmp_path / "received.tif")
+    approved = make_tiled_raster_at(np.ones((32, 32)), approved_dir / "approved.tif")
+    approved_dir.chmod(0o555)
+    try:
+        if os.access(approved_dir, os.W_OK):
+            pytest.skip("read-only directories are writable for this user")
+        for _ in range(2):
+            assert CompareGeoTiffs(approved_manifests=True).compare(received.as_posix(), approved.as_posix())
+    finally:
+        approved_dir.chmod(0o755)
+
+    assert sorted(p.name for p in approved_dir.iterdir()) == ["approved.tif"]
+    assert len([w for w in recwarn if "approved manifests are not written" in str(w.message)]) == 1
+
+
+def test_manifest_takes_digest_of_byte_comparison(tmp_path, monkeypatch):
+    received = make_tiled_raster_at(np.ones((32, 32)), tmp_path / "received.tif")
+    approved = make_tiled_raster_at(np.ones((32, 32)), tmp_path / "approved.tif")
+    digest = file_digest(approved)
+    monkeypatch.setattr(differ_of_geo_tiffs, 'artifact_digest', lambda path: pytest.fail("approved digested again"))
+    assert CompareGeoTiffs(approved_manifests=True).compare(received.as_posix(), approved.as_posix())
+    assert load_manifest(approved).digest == digest
+
+
+def test_manifest_takes_stats_of_decoding_comparison(tmp_path, monkeypatch):
+    values = np.arange(32 * 32, dtype=np.float32).reshape(32, 32)
+    received = make_tiled_raster_at(values, tmp_path / "received.tif", compress="lzw")
+    approved = make_tiled_raster_at(values, tmp_path / "approved.tif")
+    monkeypatch.setattr(DifferOfGeoTiffs, '_read_band_stats', lambda self, rds: pytest.fail("approved decoded again"))
+    assert CompareGeoTiffs(approved_manifests=True).compare(received.as_posix(), approved.as_posix())
+    assert load_manifest(approved).stats == dict(band_1=dict(min=0.0, max=1023.0, mean=511.5, nans=0))
+
+
+def test_tif_comparison_with_manifest_reads_only_changed_blocks(tmp_path, monkeypatch, compared_arrays):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_tiled_raster_at(values, tmp_path / "received.tif")
+    values[0, 0] = 0.5
+    approved = make_tiled_raster_at(values, tmp_path / "approved.tif")
+    CompareGeoTiffs(approved_manifests=True).update_approved_manifest(approved)
+
+    def _no_raw_approved_blocks(received_rds, approved_rds):
+        raise AssertionError("approved blocks should be known from the manifest")
+
+    monkeypatch.setattr(differ_of_geo_tiffs, 'differing_tiff_blocks', _no_raw_approved_blocks)
+    assert CompareGeoTiffs(float_tolerance=Tolerance(abs=1), approved_manifests=True) \
+        .compare(received.as_posix(), approved.as_posix())
+    assert [r.shape for r, _ in compared_arrays] == [(1, 16, 16)]
+
+
+def test_tif_comparison_is_rejected_by_manifest_without_opening_approved(tmp_path, monkeypatch):
+    approved = make_raster_at(np.zeros((4, 4)), tmp_path / "approved.tif", tags=dict(some='tag'))
+    CompareGeoTiffs(approved_manifests=True).update_approved_manifest(approved)
+    other_tags = make_raster_at(np.zeros((4, 4)), tmp_path / "other_tags.tif", tags=dict(some='other'))
+    other_shape = make_raster_at(np.zeros((4, 5)), tmp_path / "other_shape.tif", tags=dict(some='tag'))
+
+    def _no_artifacts(self, received_path, approved_path, resources):
+        raise AssertionError("the comparison should be rejected by the manifest")
+
+    monkeypatch.setattr(DifferOfGeoTiffs, 'open_artifacts', _no_artifacts)
+    comparator = CompareGeoTiffs(approved_manifests=True)
+    assert not comparator.compare(other_tags.as_posix(), approved.as_posix())
+    assert not comparator.compare(other_shape.as_posix(), approved.as_posix())
+
+
+def test_manifests_are_not_written_without_option(tmp_path):
+    received = make_raster_at(np.zeros((4, 4)), tmp_path / "received.tif")
+    approved = make_raster_at(np.zeros((4, 4)), tmp_path / "approved.tif")
+    assert CompareGeoTiffs().compare(received.as_posix(), approved.as_posix())
+    assert not os.path.exists(manifest_path(approved))
+
+
+def test_zarr_comparison_uses_chunk_hashes_of_manifest(tmp_path, compared_arrays):
+    values = np.zeros((40, 40))
+    make_chunked_dataset(values).to_zarr(tmp_path / "received.zarr")
+    values[35, 20] = 0.5
+    make_chunked_dataset(values).to_zarr(tmp_path / "approved.zarr")
+    received, approved = (tmp_path / "received.zarr").as_posix(), (tmp_path / "approved.zarr").as_posix()
+    comparator = CompareGeoZarrs(float_tolerance=Tolerance(abs=1), approved_manifests=True)
+    comparator.update_approved_manifest(approved)
+
+    manifest = load_manifest(approved)
+    assert manifest.metadata['variables'] == dict(var_name=dict(dims=['y', 'x'], shape=[40, 40], dtype='float64'))
+    assert len(manifest.chunks['var_name'].hashes) == 9
+    assert manifest.stats['var_name'] == dict(min=0.0, max=0.5, mean=0.5 / 1600, nans=0)
+
+    def _no_raw_approved_chunks(received_path, approved_path, name):
+        raise AssertionError("approved chunks should be known from the manifest")
+
+    differ = DifferOfGeoDataset(xr.open_zarr, lambda d: d, lambda s: s, Tolerance(abs=1),
+                                raw_chunk_differ=_no_raw_approved_chunks, raw_chunk_hasher=zarr_chunk_hashes,
+                                approved_manifests=True)
+    assert differ.shared_is_equal(received, approved)
+    assert [r.shape for r, _ in compared_arrays] == [(8, 16)]
+    assert not CompareGeoZarrs(approved_manifests=True).compare(received, approved)
+    assert comparator.compare(received, approved)
+
+
+def test_nc_comparison_is_rejected_by_manifest_with_other_variables(tmp_path):
+    pytest.importorskip("h5py")
+    values = np.zeros((40, 40))
+    encoding = dict(var_name=dict(chunksizes=(16, 16), zlib=True))
+    make_chunked_dataset(values).to_netcdf(tmp_path / "approved.nc", encoding=encoding)
+    make_chunked_dataset(values).rename(var_name='other_name').to_netcdf(tmp_path / "received.nc")
+    received, approved = (tmp_path / "received.nc").as_posix(), (tmp_path / "approved.nc").as_posix()
+    comparator = CompareGeoNcs(approved_manifests=True)
+    comparator.update_approved_manifest(approved)
+
+    assert len(load_manifest(approved).chunks['var_name'].hashes) == 9
+    assert comparator.is_rejected_by_approved_manifest(received, approved)
+    assert not comparator.compare(received, approved)
@@ -0,0 +1,97 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+from approval_utilities.utilities.exceptions.multiple_exceptions import MultipleExceptions
+from pandas import DataFrame
+from pytest import ExitCode
+
+from factories import make_raster_at
+from pytest_approvaltests_geo import verify_data_frame_using
+from pytest_approvaltests_geo.differs.differ_of_geo_tiffs import DifferOfGeoTiffs
+from pytest_approvaltests_geo.geo_options import GeoOptions
+from pytest_approvaltests_geo.parallel import WorkerThreadPoolExecutor, worker_resources
+from test_approvaltests_geo_extensions import make_standard_geo_data_setting
+
+
+def test_parallel_verification_gathers_failures_in_row_order(tmp_path):
+    verified = []
+
+    def _verify(file, *, options):
+        verified.append((file, options.namer.get_received_filename()))
+        if file % 2 == 0:
+            raise AssertionError(f"row {file} failed")
+
+    df = DataFrame(dict(filepath=[0, 1, 2, 3], param=['A', 'B', 'C', 'D']))
+    with pytest.raises(MultipleExceptions) as failures:
+        verify_data_frame_using(_verify, 'param', approved_geo_directory=tmp_path)(
+            df, options=GeoOptions().with_parallel_verification(max_workers=4))
+
+    assert str(failures.value).index("row 0 failed") < str(failures.value).index("row 2 failed")
+    received_names = {file: Path(name).name for file, name in verified}
+    assert received_names == {i: f"test_parallel_verification.test_parallel_verification_gathers_failures_in_row_"
+                                 f"order.{p}.received.txt" for i, p in enumerate("ABCD")}
+
+
+def _fail_in_worker_process(file, *, options):
+    raise AssertionError(f"row {file} failed in process {os.getpid()}")
+
+
+def test_parallel_verification_in_processes(tmp_path):
+    df = DataFrame(dict(filepath=[0, 1], param=['A', 'B']))
+    options = GeoOptions().with_parallel_verification(max_workers=2, use_processes=True)
+    with pytest.raises(MultipleExceptions) as failures:
+        verify_data_frame_using(_fail_in_worker_process, 'param', approved_geo_directory=tmp_path)(df, options=options)
+
+    assert "row 0 failed" in str(failures.value) and "row 1 failed" in str(failures.value)
+    assert f"in process {os.getpid()}" not in str(failures.value)
+
+    with pytest.raises(ValueError, match="picklable verify function"):
+        verify_data_frame_using(lambda file, *, options: None, 'param', approved_geo_directory=tmp_path)(
+            df, options=options)
+    with pytest.raises(ValueError, match="picklable option 'tif_writer'"):
+        verify_data_frame_using(_fail_in_worker_process, 'param', approved_geo_directory=tmp_path)(
+            df, options=options.with_tif_writer(lambda f, a: None))
+
+
+def test_worker_reuses_approved_raster_handle_until_shutdown(tmp_path):
+    approved = make_raster_at(np.zeros((4, 4)), tmp_path / "approved.tif")
+    received = [make_raster_at(np.full((4, 4), i), tmp_path / f"{i}.tif") for i in range(3)]
+
+    def _compare(received_path):
+        return DifferOfGeoTiffs().shared_is_equal(received_path, approved), worker_resources()
+
+    with WorkerThreadPoolExecutor(1) as executor:
+        results = list(executor.map(_compare, received))
+        worker = results[0][1]
+        handle = next(iter(worker._handles.values()))
+    assert [equal for equal, _ in results] == [True, False, False]
+    assert all(resources is worker for _, resources in results)
+    assert worker.opened == 1
+    assert handle.closed
+
+
+def test_verify_data_frame_in_parallel_using_geo_tif_verification(testdir, tmp_path):
+    make_standard_geo_data_setting(testdir, tmp_path)
+
+    tifs = [make_raster_at([[i]], tmp_path / f"{i}.tif").as_posix() for i in range(4)]
+
+    testdir.makepyfile(f"""
+            from pandas import DataFrame
+            from pytest_approvaltests_geo.geo_options import GeoOptions
+            def test_verify_geo_tif_data_frame(verify_data_frame_using, verify_geo_tif):
+                df = DataFrame(dict(filepath={tifs}, param=['A', 'B', 'C', 'D']))
+                verify_data_frame_using(verify_geo_tif, 'param')(
+                    df, options=GeoOptions().with_parallel_verification(max_workers=2))
+        """)
+
+    result = testdir.runpytest('-v')
+
+    result.stdout.fnmatch_lines([
+        "*.A.received.tif*",
+        "*.B.received.tif*",
+        "*.C.received.tif*",
+        "*.D.received.tif*",
+    ])
+    assert result.ret == ExitCode.TESTS_FAILED
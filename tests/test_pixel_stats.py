@@ -1,6 +1,7 @@
 import numpy as np
+import pytest
 
-from pytest_approvaltests_geo.differs.difference import calculate_pixel_diff_stats, Stats
+from pytest_approvaltests_geo.differs.difference import calculate_pixel_diff_stats, Stats, PixelDiffStatsAccumulator
 
 
 def test_empty_arrays():
@@ -22,3 +23,42 @@ def test_identical_pixels():
 def test_pixel_stats():
     stats = calculate_pixel_diff_stats(np.array([[1, 2], [3, 4]]), np.array([[2, 4], [4, 3]]))
     assert stats == Stats(min=1, max=2, mean=1.25, median=1.0, nans=0)
+
+
+def test_unsigned_pixels_do_not_wrap_around():
+    stats = calculate_pixel_diff_stats(np.array([3], dtype=np.uint8), np.array([1], dtype=np.uint8))
+    assert stats == Stats(min=2, max=2, mean=2.0, median=2.0, nans=0)
+
+
+def test_merged_accumulators_equal_accumulator_of_all_pixels():
+    rng = np.random.default_rng(42)
+    approved = rng.normal(size=(3, 50, 40))
+    received = approved + rng.normal(size=approved.shape)
+    received[0, 0, :5] = np.nan
+    merged = PixelDiffStatsAccumulator()
+    for band in range(3):
+        merged.merge(PixelDiffStatsAccumulator().add(approved[band], received[band]))
+    assert merged.stats() == calculate_pixel_diff_stats(approved, received)
+
+
+def test_median_of_many_pixels_is_estimated_within_relative_accuracy():
+    rng = np.random.default_rng(42)
+    approved = rng.uniform(0, 100, size=200_000)
+    received = approved + rng.exponential(3, size=approved.shape)
+    accumulator = PixelDiffStatsAccumulator(relative_accuracy=0.01).add(approved, received)
+    assert not accumulator.is_exact
+    exact = np.abs(received - approved)
+    ranked = np.sort(exact)
+    for q in [0.1, 0.5, 0.9]:
+        assert accumulator.quantile(q) == pytest.approx(ranked[int(q * (exact.size - 1))], rel=0.01)
+    assert accumulator.stats().mean == pytest.approx(np.mean(exact))
+    assert accumulator.stats().max == np.max(exact)
+
+
+def test_merge_exact_with_sketched_accumulator():
+    small = PixelDiffStatsAccumulator(exact_limit=10).add(np.zeros(5), np.ones(5))
+    large = PixelDiffStatsAccumulator(exact_limit=10).add(np.zeros(20), np.full(20, 3.0))
+    merged = small.merge(large)
+    assert not merged.is_exact
+    assert merged.quantile(0.5) == pytest.approx(3.0, rel=0.01)
+    assert merged.quantile(0.1) == pytest.approx(1.0, rel=0.01)
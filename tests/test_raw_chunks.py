@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.windows import Window
+from xarray import Dataset
+
+from factories import make_raster_at
+from pytest_approvaltests_geo.comparators.compare_geo_ncs import CompareGeoNcs
+from pytest_approvaltests_geo.comparators.compare_geo_tiffs import CompareGeoTiffs
+from pytest_approvaltests_geo.comparators.compare_geo_zarrs import CompareGeoZarrs
+from pytest_approvaltests_geo.differs.raw_chunks import differing_tiff_blocks, differing_zarr_chunks, \
+    differing_hdf5_chunks, memmap_zarr_chunk
+from pytest_approvaltests_geo.float_utils import Tolerance
+
+
+def make_tiled_raster_at(values, file_path, **profile):
+    return make_raster_at(values, file_path, tiled=True, blockxsize=16, blockysize=16, **profile)
+
+
+def make_chunked_dataset(values, attrs=None, chunks=(16, 16)):
+    ds = Dataset(dict(var_name=(('y', 'x'), values, attrs or {})),
+                 coords=dict(y=np.arange(values.shape[0]), x=np.arange(values.shape[1])))
+    ds.var_name.encoding['chunks'] = chunks
+    return ds
+
+
+def differing_tiff_blocks_of(received, approved):
+    with rasterio.open(received) as received_rds, rasterio.open(approved) as approved_rds:
+        return differing_tiff_blocks(received_rds, approved_rds)
+
+
+def test_differing_tiff_blocks_only_contain_blocks_with_changed_bytes(tmp_path):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_tiled_raster_at(values, tmp_path / "received.tif", tags=dict(some='tag'), compress='deflate')
+    values[20, 40] = 1
+    approved = make_tiled_raster_at(values, tmp_path / "approved.tif", tags=dict(some='other'), compress='deflate')
+    assert differing_tiff_blocks_of(received, received) == []
+    assert differing_tiff_blocks_of(received, approved) == [Window(32, 16, 16, 16)]
+
+
+def test_tiff_blocks_are_not_comparable_with_differing_encodings(tmp_path):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_tiled_raster_at(values, tmp_path / "received.tif", compress='deflate')
+    approved = make_tiled_raster_at(values, tmp_path / "approved.tif")
+    assert differing_tiff_blocks_of(received, approved) is None
+
+
+def test_compare_geo_tiffs_only_decodes_blocks_with_changed_bytes(tmp_path, compared_arrays):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_tiled_raster_at(values, tmp_path / "received.tif")
+    values[0, 0] = 0.5
+    approved = make_tiled_raster_at(values, tmp_path / "approved.tif")
+    assert CompareGeoTiffs(float_tolerance=Tolerance(abs=1)).compare(received.as_posix(), approved.as_posix())
+    assert [r.shape for r, _ in compared_arrays] == [(1, 16, 16)]
+
+
+@pytest.mark.parametrize('zarr_format', [2, 3])
+def test_differing_zarr_chunks_only_contain_chunks_with_changed_bytes(tmp_path, zarr_format):
+    values = np.zeros((40, 40))
+    make_chunked_dataset(values, dict(some='tag')).to_zarr(tmp_path / "received.zarr", zarr_format=zarr_format)
+    values[35, 20] = 1
+    make_chunked_dataset(values, dict(some='other')).to_zarr(tmp_path / "approved.zarr", zarr_format=zarr_format)
+    assert differing_zarr_chunks(tmp_path / "received.zarr", tmp_path / "received.zarr", 'var_name') == []
+    assert differing_zarr_chunks(tmp_path / "received.zarr", tmp_path / "approved.zarr", 'var_name') == \
+           [(slice(32, 48), slice(16, 32))]
+
+
+def test_zarr_chunks_are_not_comparable_with_differing_encodings(tmp_path):
+    values = np.zeros((40, 40))
+    make_chunked_dataset(values).to_zarr(tmp_path / "received.zarr")
+    make_chunked_dataset(values, chunks=(8, 8)).to_zarr(tmp_path / "approved.zarr")
+    make_chunked_dataset(values, dict(scale_factor=2.0)).to_zarr(tmp_path / "scaled.zarr")
+    assert differing_zarr_chunks(tmp_path / "received.zarr", tmp_path / "approved.zarr", 'var_name') is None
+    assert differing_zarr_chunks(tmp_path / "received.zarr", tmp_path / "scaled.zarr", 'var_name') is None
+
+
+def test_compare_geo_zarrs_with_a_changed_chunk_within_tolerance(tmp_path):
+    values = np.zeros((40, 40))
+    make_chunked_dataset(values).to_zarr(tmp_path / "received.zarr")
+    values[35, 20] = 0.5
+    make_chunked_dataset(values).to_zarr(tmp_path / "approved.zarr")
+    received, approved = (tmp_path / "received.zarr").as_posix(), (tmp_path / "approved.zarr").as_posix()
+    assert not CompareGeoZarrs().compare(received, approved)
+    assert CompareGeoZarrs(float_tolerance=Tolerance(abs=1)).compare(received, approved)
+
+
+def test_differing_hdf5_chunks_only_contain_chunks_with_changed_bytes(tmp_path):
+    pytest.importorskip("h5py")
+    values = np.zeros((40, 40))
+    encoding = dict(var_name=dict(chunksizes=(16, 16), zlib=True))
+    make_chunked_dataset(values).to_netcdf(tmp_path / "received.nc", encoding=encoding)
+    values[35, 20] = 0.5
+    make_chunked_dataset(values).to_netcdf(tmp_path / "approved.nc", encoding=encoding)
+    assert differing_hdf5_chunks(tmp_path / "received.nc", tmp_path / "approved.nc", 'var_name') == \
+           [(slice(32, 48), slice(16, 32))]
+    received, approved = (tmp_path / "received.nc").as_posix(), (tmp_path / "approved.nc").as_posix()
+    assert not CompareGeoNcs().compare(received, approved)
+    assert CompareGeoNcs(float_tolerance=Tolerance(abs=1)).compare(received, approved)
+
+
+def test_uncompressed_zarr_chunks_are_memory_mapped(tmp_path):
+    values = np.arange(40 * 40, dtype=np.float32).reshape(40, 40)
+    uncompressed = make_chunked_dataset(values)
+    uncompressed.var_name.encoding['compressor'] = None
+    uncompressed.to_zarr(tmp_path / "uncompressed.zarr", zarr_format=2)
+    make_chunked_dataset(values).to_zarr(tmp_path / "compressed.zarr", zarr_format=2)
+    region = (slice(32, 48), slice(16, 32))
+
+    mapped = memmap_zarr_chunk(tmp_path / "uncompressed.zarr", 'var_name', region)
+    assert isinstance(mapped, np.memmap) and not mapped.flags.writeable
+    np.testing.assert_array_equal(mapped, values[region])
+    assert memmap_zarr_chunk(tmp_path / "uncompressed.zarr", 'var_name', (slice(0, 8), slice(0, 16))) is None
+    assert memmap_zarr_chunk(tmp_path / "compressed.zarr", 'var_name', region) is None
+
+
+def test_compare_geo_ncs_reads_netcdf3_values_from_memory_maps(tmp_path, compared_arrays):
+    values = np.zeros((40, 40))
+    make_chunked_dataset(values).to_netcdf(tmp_path / "received.nc", format="NETCDF3_64BIT")
+    values[35, 20] = 0.5
+    make_chunked_dataset(values).to_netcdf(tmp_path / "approved.nc", format="NETCDF3_64BIT")
+    received, approved = (tmp_path / "received.nc").as_posix(), (tmp_path / "approved.nc").as_posix()
+    assert not CompareGeoNcs().compare(received, approved)
+    assert CompareGeoNcs(float_tolerance=Tolerance(abs=1)).compare(received, approved)
+    assert [(type(r), type(a)) for r, a in compared_arrays] == [(np.memmap, np.memmap)] * 2
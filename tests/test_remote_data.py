@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+from approvaltests.approval_exception import ApprovalException
+from rasterio.windows import Window
+
+pytest.importorskip("fsspec")
+
+from factories import make_raster_at, make_zarr_at
+from pytest_approvaltests_geo import verify_geo_tif, verify_geo_zarr
+from pytest_approvaltests_geo.differs.differ_of_geo_tiffs import DifferOfGeoTiffs
+from pytest_approvaltests_geo.geo_options import GeoOptions
+from pytest_approvaltests_geo.remote_data import BlockCache, RemotePath, set_block_cache, open_raster, \
+    dataset_source
+
+
+@pytest.fixture
+def block_cache(tmp_path):
+    cache = BlockCache(tmp_path / "cache", block_size=4096)
+    set_block_cache(cache)
+    yield cache
+    set_block_cache(None)
+
+
+def make_tiled_raster_at(values, file_path):
+    return make_raster_at(values, file_path, tiled=True, blockxsize=64, blockysize=64)
+
+
+def test_block_cache_evicts_least_recently_used_blocks(tmp_path):
+    cache = BlockCache(tmp_path, max_bytes=3 * 1024, block_size=1024)
+    for index in range(3):
+        cache.block("ab", index, lambda: bytes(1024))
+        os.utime(tmp_path / "ab" / f"ab.1024.{index}", ns=(index, index))
+    cache.block("ab", 0, lambda: pytest.fail("cached block fetched again"))
+
+    cache.block("ab", 3, lambda: bytes(1024))
+
+    assert sorted(p.name for p in (tmp_path / "ab").iterdir()) == ["ab.1024.0", "ab.1024.2", "ab.1024.3"]
+    assert cache.size() == 3 * 1024
+
+
+def test_block_cache_evicts_without_scanning_its_directory_again(tmp_path, monkeypatch):
+    cache = BlockCache(tmp_path, max_bytes=2 * 1024, block_size=1024)
+    cache.block("ab", 0, lambda: bytes(1024))
+    monkeypatch.setattr(BlockCache, '_iter_blocks', lambda self: pytest.fail("cache directory scanned again"))
+    for index in range(1, 4):
+        cache.block("ab", index, lambda: bytes(1024))
+    assert sorted(p.name for p in (tmp_path / "ab").iterdir()) == ["ab.1024.2", "ab.1024.3"]
+
+
+def test_remote_raster_is_read_in_the_needed_blocks_only(tmp_path, block_cache):
+    tif = make_tiled_raster_at(np.arange(512 * 512, dtype=np.float32).reshape(512, 512), tmp_path / "a.tif")
+    url = f"file://{tif.as_posix()}"
+
+    with open_raster(url) as rds:
+        window = rds.read(1, window=Window(0, 0, 64, 64))
+    assert np.array_equal(window, np.arange(512 * 512).reshape(512, 512)[:64, :64])
+    assert 0 < block_cache.fetched_blocks < tif.stat().st_size // block_cache.block_size // 4
+
+    persisted_cache = BlockCache(block_cache.directory, block_size=block_cache.block_size)
+    set_block_cache(persisted_cache)
+    with open_raster(url) as rds:
+        rds.read(1, window=Window(0, 0, 64, 64))
+    assert persisted_cache.fetched_blocks == 0
+
+
+def test_changed_remote_file_is_not_read_from_stale_blocks(tmp_path, block_cache):
+    tif = make_tiled_raster_at(np.zeros((64, 64), dtype=np.float32), tmp_path / "a.tif")
+    with open_raster(f"file://{tif.as_posix()}") as rds:
+        rds.read()
+    make_tiled_raster_at(np.ones((64, 64), dtype=np.float32), tif)
+    os.utime(tif, ns=(0, 0))
+    with open_raster(f"file://{tif.as_posix()}") as rds:
+        assert rds.read().min() == 1
+
+
+def test_remote_zarr_is_opened_through_a_mapper(tmp_path, block_cache):
+    zarr = make_zarr_at(np.arange(16.).reshape(4, 4), tmp_path / "a.zarr")
+    with xr.open_zarr(dataset_source(RemotePath(f"file://{zarr.as_posix()}"))) as ds:
+        assert ds["var_name"].values.sum() == 120
+    assert block_cache.fetched_blocks > 0
+
+
+@pytest.mark.parametrize("decode_threads", [None, 4])
+def test_verify_geo_tif_against_remote_approved_tif(tmp_path, block_cache, decode_threads, capsys):
+    approved_dir = tmp_path / "approved"
+    approved_dir.mkdir()
+    make_tiled_raster_at(np.zeros((256, 256), dtype=np.float32), approved_dir / (
+        "test_remote_data.test_verify_geo_tif_against_remote_approved_tif.approved.tif"))
+    options = GeoOptions().with_approved_directory(RemotePath(f"file://{approved_dir.as_posix()}")) \
+        .with_received_directory(tmp_path / "received").with_decode_threads(decode_threads)
+    passing = make_tiled_raster_at(np.zeros((256, 256), dtype=np.float32), tmp_path / "same.tif")
+    failing = make_tiled_raster_at(np.ones((256, 256), dtype=np.float32), tmp_path / "different.tif")
+
+    verify_geo_tif(passing, options=options)
+    with pytest.raises(ApprovalException):
+        verify_geo_tif(failing, options=options)
+
+    received, = (tmp_path / "received").rglob("*.received.tif")
+    assert received.parent == tmp_path / "received" / "file" / approved_dir.relative_to("/")
+    assert f"To approve upload:\n {received.as_posix()} to file://" in capsys.readouterr().out
+    assert not list(approved_dir.glob("*.received.*"))
+
+
+def test_missing_remote_approved_tif_is_reported(tmp_path, block_cache, capsys):
+    options = GeoOptions().with_approved_directory(RemotePath(f"file://{tmp_path.as_posix()}/approved")) \
+        .with_received_directory(tmp_path / "received")
+    tif = make_tiled_raster_at(np.zeros((64, 64), dtype=np.float32), tmp_path / "a.tif")
+
+    with pytest.raises(ApprovalException):
+        verify_geo_tif(tif, options=options)
+
+    assert "There is no approved file at file://" in capsys.readouterr().out
+    assert not (tmp_path / "approved").exists()
+
+
+def test_verify_geo_zarr_against_remote_approved_zarr(tmp_path, block_cache):
+    approved_dir = tmp_path / "approved"
+    make_zarr_at(np.zeros((8, 8)), approved_dir / (
+        "test_remote_data.test_verify_geo_zarr_against_remote_approved_zarr.approved.zarr"))
+    options = GeoOptions().with_approved_directory(RemotePath(f"file://{approved_dir.as_posix()}")) \
+        .with_received_directory(tmp_path / "received")
+
+    verify_geo_zarr(make_zarr_at(np.zeros((8, 8)), tmp_path / "same.zarr"), options=options)
+
+
+def test_remote_approved_tif_is_compared_by_overviews(tmp_path, block_cache):
+    values = np.zeros((256, 256), dtype=np.float32)
+    received = make_tiled_raster_at(values, tmp_path / "received.tif")
+    approved = make_tiled_raster_at(values, tmp_path / "approved.tif")
+    for tif in [received, approved]:
+        with open_raster(tif, mode="r+") as rds:
+            rds.build_overviews([2, 4])
+
+    differ = DifferOfGeoTiffs(compare_overviews=True, decode_threads=2)
+    assert differ.shared_is_equal(received, RemotePath(f"file://{approved.as_posix()}"))
@@ -51,3 +51,25 @@ def test_report_scrubbed_data(tmp_path, capsys):
     output = capsys.readouterr().out
     assert 'other: <date0>' in output and '<date0>: 42' in output
     assert 'some: <date0>' in output and '<date0>: 21' in output
+
+
+def test_report_worst_values_with_their_coordinates(tmp_path, capsys):
+    values = np.zeros((4, 4))
+    received = make_nc_at(values, tmp_path / "received.nc")
+    values[2, 1] = 3
+    values[0, 0] = 1
+    approved = make_nc_at(values, tmp_path / "approved.nc")
+    ReportGeoNcs(worst_pixels=1).report(received.as_posix(), approved.as_posix())
+    output = capsys.readouterr().out
+    assert "var_name: 2 of 16 values differ beyond tolerance (rtol=1e-09, atol=0.0)\n" \
+           "  1 largest differences:\n" \
+           "    band=0, y=2, x=1 (at band=1, y=2, x=1): received=0.0, approved=3.0, abs diff=3.0" in output
+
+
+def test_report_of_unaligned_values_is_bounded(tmp_path, capsys):
+    received = make_nc_at(np.zeros((64, 64)), tmp_path / "received.nc")
+    approved = make_nc_at(np.ones((64, 32)), tmp_path / "approved.nc")
+    ReportGeoNcs(worst_pixels=3).report(received.as_posix(), approved.as_posix())
+    output = capsys.readouterr().out
+    assert "var_name: 2048 of 2048 values differ beyond tolerance" in output
+    assert len(output.splitlines()) < 60
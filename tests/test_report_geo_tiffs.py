@@ -4,7 +4,7 @@ import numpy as np
 import pytest
 from approvaltests.scrubbers import create_regex_scrubber
 
-from factories import make_raster_at
+from factories import make_raster_at, make_raster_with_overviews_at
 from pytest_approvaltests_geo.reporters.report_geo_tiffs import ReportGeoTiffs
 from pytest_approvaltests_geo.scrubbers import make_scrubber_recurse
 
@@ -60,3 +60,54 @@ def test_report_has_maximum_length_when_reporting_differing_pixels(reporter, tmp
     assert reporter.report(received.as_posix(), approved.as_posix())
     diff_pixel_lines = [line for line in capsys.readouterr().out.splitlines() if PIXEL_DIFF_REPORT_PATTERN in line]
     assert len(diff_pixel_lines) < 10
+
+
+def test_report_pixel_difference_statistics_over_all_windows(tmp_path, capsys):
+    received = make_raster_at(np.zeros((32, 32)), tmp_path / "received.tif", tiled=True, blockxsize=16, blockysize=16)
+    approved_values = np.zeros((32, 32))
+    approved_values[:16, :16] = 1
+    approved_values[-1, -1] = 5
+    approved = make_raster_at(approved_values, tmp_path / "approved.tif", tiled=True, blockxsize=16, blockysize=16)
+    assert ReportGeoTiffs(memory_limit=16 * 16 * 8).report(received.as_posix(), approved.as_posix())
+    output = capsys.readouterr().out
+    assert f"min=0.0, max=5.0, mean={(256 + 5) / 1024}" in output
+    assert "257 of 1024 pixels differ beyond tolerance" in output
+
+
+def test_report_of_concurrently_decoded_bands_is_unchanged(tmp_path, capsys):
+    received_values = np.zeros((4, 64, 64), dtype=np.float32)
+    approved_values = np.random.default_rng(42).normal(size=(4, 64, 64)).astype(np.float32)
+    approved_values[2, 3, 4] = np.nan
+    profile = dict(tiled=True, blockxsize=16, blockysize=16, compress='deflate')
+    received = make_raster_at(received_values, tmp_path / "received.tif", **profile)
+    approved = make_raster_at(approved_values, tmp_path / "approved.tif", **profile)
+    ReportGeoTiffs(memory_limit=16 * 64 * 4).report(received.as_posix(), approved.as_posix())
+    sequential = capsys.readouterr().out
+    ReportGeoTiffs(memory_limit=16 * 64 * 4, decode_threads=4).report(received.as_posix(), approved.as_posix())
+    assert capsys.readouterr().out == sequential
+
+
+def test_report_differences_at_full_resolution_when_comparing_overviews(tmp_path, capsys):
+    values = np.zeros((64, 64), dtype=np.float32)
+    received = make_raster_with_overviews_at(values, tmp_path / "received.tif")
+    values[:, :32] = 2
+    approved = make_raster_with_overviews_at(values, tmp_path / "approved.tif")
+    ReportGeoTiffs(compare_overviews=True).report(received.as_posix(), approved.as_posix())
+    output = capsys.readouterr().out
+    assert "pixel differences statistics:\nmin=0.0, max=2.0, mean=1.0" in output
+    assert "2048 of 4096 pixels differ beyond tolerance" in output
+    assert "overview" not in output
+
+
+def test_report_worst_pixels_with_map_coordinates(tmp_path, capsys):
+    received = make_raster_at(np.zeros((32, 32)), tmp_path / "received.tif", tiled=True, blockxsize=16, blockysize=16)
+    approved_values = np.zeros((32, 32))
+    approved_values[20, 30] = 7
+    approved_values[3, 4] = -2
+    approved_values[0, 0] = 1
+    approved = make_raster_at(approved_values, tmp_path / "approved.tif", tiled=True, blockxsize=16, blockysize=16)
+    ReportGeoTiffs(memory_limit=16 * 16 * 8, worst_pixels=2).report(received.as_posix(), approved.as_posix())
+    output = capsys.readouterr().out
+    assert "2 largest differences:\n" \
+           "  band=1, y=20, x=30 (at map x=30.0, y=20.0): received=0.0, approved=7.0, abs diff=7.0\n" \
+           "  band=1, y=3, x=4 (at map x=4.0, y=3.0): received=0.0, approved=-2.0, abs diff=2.0" in output
@@ -0,0 +1,37 @@
+import numpy as np
+from xarray import Dataset
+
+from pytest_approvaltests_geo.scrubbers import make_scrubber_sequential, scrub_xarray_coordinates, \
+    identity_sequence_scrubber
+
+
+def make_dataset_with_string_coords():
+    return Dataset(dict(var_name=(('tile', 'x'), np.zeros((4, 2)))),
+                   coords=dict(tile=['E042N012T3', 'E042N015T3', 'E042N012T3', 'E045N012T3'],
+                               sensor=('tile', ['S1A', 'S1B', 'S1A', 'S1A']), x=[0, 1]))
+
+
+def test_scrub_xarray_coordinates_scrubs_each_unique_value_once():
+    scrubbed_values = []
+
+    def _scrub(value):
+        scrubbed_values.append(value)
+        return value[:4]
+
+    ds = make_dataset_with_string_coords()
+    scrubbed = scrub_xarray_coordinates(ds, make_scrubber_sequential(_scrub))
+    assert scrubbed.tile.values.tolist() == ['E042', 'E042', 'E042', 'E045']
+    assert scrubbed.sensor.values.tolist() == ['S1A', 'S1B', 'S1A', 'S1A']
+    assert sorted(scrubbed_values) == ['E042N012T3', 'E042N015T3', 'E045N012T3', 'S1A', 'S1B']
+    assert np.shares_memory(scrubbed.var_name.values, ds.var_name.values)
+
+
+def test_scrub_xarray_coordinates_passes_whole_sequence_to_other_scrubbers():
+    scrubbed = scrub_xarray_coordinates(make_dataset_with_string_coords(),
+                                        lambda values: [f"{i}" for i, _ in enumerate(values)])
+    assert scrubbed.tile.values.tolist() == ['0', '1', '2', '3']
+
+
+def test_identity_coordinate_scrubber_keeps_dataset():
+    ds = make_dataset_with_string_coords()
+    assert scrub_xarray_coordinates(ds, identity_sequence_scrubber) is ds
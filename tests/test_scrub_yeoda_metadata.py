@@ -1,4 +1,11 @@
-from pytest_approvaltests_geo.scrubbers import scrub_all_short_commits, scrub_yeoda_datacube_metadata
+import pickle
+
+import pytest
+from approvaltests.scrubbers.scrubbers import combine_scrubbers, scrub_all_dates, scrub_all_guids, \
+    create_regex_scrubber
+
+from pytest_approvaltests_geo.scrubbers import scrub_all_short_commits, scrub_yeoda_datacube_metadata, \
+    scrub_all_yeoda_dates, scrub_all_tags, make_scrubber_recurse, yeoda_datacube_metadata_scrubber, CompiledScrubber
 
 
 def test_scrub_all_yeoda_metadata():
@@ -8,3 +15,46 @@ def test_scrub_all_yeoda_metadata():
 
 def test_g_prefixed_short_commit_is_scrubbed_like_bare_hash():
     assert scrub_all_short_commits("gae2df71") == "<short_commit_0>"
+
+
+YEODA_METADATA = [
+    "2018-09-12 12:00:00;20220101T235959;ae2df71;v1.0.2",
+    "created 2018-09-12 12:00:00, updated 2018-09-13 12:00:00, again 2018-09-12 12:00:00",
+    "run 3f2504e0-4f89-11d3-9a0c-0305e82c3301 at gae2df71 and ae2df71, then ffffff0",
+    "plain text without anything to scrub",
+    "v1.0.2v1.0.3 20220101T23595920220101T235959",
+    "",
+]
+
+
+@pytest.mark.parametrize('metadata', YEODA_METADATA)
+def test_compiled_yeoda_scrubber_matches_chained_scrubbers(metadata):
+    chained = combine_scrubbers(scrub_all_dates, scrub_all_yeoda_dates, scrub_all_guids, scrub_all_short_commits,
+                                scrub_all_tags)
+    assert scrub_yeoda_datacube_metadata(metadata) == chained(metadata)
+
+
+def test_compiled_scrubber_recurses_into_tags():
+    tags = {"2018-09-12 12:00:00": ["ae2df71", ("v1.0.2", 42)], "nested": {"id": "20220101T235959"}}
+    assert make_scrubber_recurse(yeoda_datacube_metadata_scrubber)(tags) == \
+           {"<date0>": ["<short_commit_0>", ("<tag_0>", 42)], "nested": {"id": "<yeoda_date0>"}}
+
+
+def test_compiled_scrubber_memoizes_within_its_limit():
+    scrubber = CompiledScrubber((r"\d", "<digit>"), max_cached=2)
+    assert [scrubber(t) for t in ["a1", "b2", "a1", "c3"]] == ["a<digit>", "b<digit>", "a<digit>", "c<digit>"]
+    assert len(scrubber._cache) <= 2
+
+
+def test_compiled_scrubber_survives_pickling():
+    scrubber = pickle.loads(pickle.dumps(CompiledScrubber((r"\d", "<digit>"))))
+    assert scrubber("a1b2") == "a<digit>b<digit>"
+    yeoda_scrubber = pickle.loads(pickle.dumps(yeoda_datacube_metadata_scrubber))
+    assert yeoda_scrubber(YEODA_METADATA[0]) == scrub_yeoda_datacube_metadata(YEODA_METADATA[0])
+
+
+def test_compiled_scrubber_keeps_flags_and_backreferences_of_each_rule():
+    rules = [("a", "x"), (r"(?i)b", "y"), (r"(\w)\1", "<double>")]
+    chained = combine_scrubbers(*(create_regex_scrubber(regex, replacement) for regex, replacement in rules))
+    for data in ["aB", "abb 11", "cc"]:
+        assert CompiledScrubber(*rules)(data) == chained(data)
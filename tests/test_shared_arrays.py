@@ -0,0 +1,166 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pytest
+from xarray import Dataset
+
+from factories import make_raster_at, make_zarr_at
+from pytest_approvaltests_geo.differs.differ_of_geo_tiffs import DifferOfGeoTiffs
+from pytest_approvaltests_geo.differs.differ_of_geo_zarrs import DifferOfGeoZarrs
+from pytest_approvaltests_geo.shared_arrays import SharedArrayCache, set_shared_array_cache, approved_array_key, \
+    get_shared_array_cache
+
+
+@pytest.fixture
+def shared_arrays(tmp_path):
+    cache = SharedArrayCache(tmp_path / "arrays")
+    set_shared_array_cache(cache)
+    yield cache
+    set_shared_array_cache(None)
+
+
+def _attached_sum(directory):
+    cache = SharedArrayCache(directory)
+    with cache.attached(["a"], lambda: pytest.fail("decoded again")) as array:
+        return int(array.sum()), cache.decoded_arrays
+
+
+def test_other_processes_attach_to_a_decoded_array(tmp_path):
+    cache = SharedArrayCache(tmp_path)
+    with cache.attached(["a"], lambda: np.arange(16).reshape(4, 4)) as array:
+        assert isinstance(array, np.memmap) and not array.flags.writeable
+
+    with ProcessPoolExecutor(2) as executor:
+        assert list(executor.map(_attached_sum, [tmp_path, tmp_path])) == [(120, 0), (120, 0)]
+    assert cache.decoded_arrays == 1
+
+
+def test_least_recently_used_arrays_without_references_are_evicted(tmp_path):
+    array_bytes = np.zeros(1024).nbytes
+    cache = SharedArrayCache(tmp_path, max_bytes=3 * array_bytes)
+    with cache.attached(["in use"], lambda: np.zeros(1024)):
+        for key in ["a", "b", "c"]:
+            with cache.attached([key], lambda: np.zeros(1024)):
+                pass
+        with cache.attached(["in use"], lambda: pytest.fail("referenced array evicted")):
+            pass
+
+    assert len(list(tmp_path.glob("*.npy"))) == 2
+    with cache.attached(["c"], lambda: pytest.fail("most recent array evicted")):
+        pass
+
+
+def test_arrays_larger_than_the_cache_are_not_shared(tmp_path):
+    cache = SharedArrayCache(tmp_path, max_bytes=8)
+    with cache.attached(["a"], lambda: np.zeros(2)) as array:
+        assert not isinstance(array, np.memmap)
+    assert cache.size() == 0
+
+
+def test_arrays_still_open_elsewhere_are_kept(tmp_path, monkeypatch):
+    cache = SharedArrayCache(tmp_path, max_bytes=np.zeros(1024).nbytes)
+    with cache.attached(["a"], lambda: np.zeros(1024)):
+        pass
+
+    def _unlink_open_file(path, *args, **kwargs):
+        if path.suffix == ".npy":
+            raise PermissionError(path)
+        return unlink(path, *args, **kwargs)
+
+    unlink = Path.unlink
+    monkeypatch.setattr(Path, "unlink", _unlink_open_file)
+    with cache.attached(["b"], lambda: np.zeros(1024)):
+        pass
+    assert len(list(tmp_path.glob("*.npy"))) == 2
+
+
+def test_changed_approved_artifacts_get_new_keys(tmp_path):
+    tif = make_raster_at(np.zeros((4, 4)), tmp_path / "a.tif")
+    key = approved_array_key(tif, "tif", None)
+    make_raster_at(np.ones((8, 8)), tif)
+    assert approved_array_key(tif, "tif", None) != key
+    assert approved_array_key(tmp_path / "missing.tif", "tif", None) is None
+
+
+def test_approved_tif_is_decoded_once_for_all_comparisons(tmp_path, shared_arrays):
+    approved = make_raster_at(np.arange(64, dtype=np.float32).reshape(8, 8), tmp_path / "approved.tif")
+    same = make_raster_at(np.arange(64, dtype=np.float32).reshape(8, 8), tmp_path / "same.tif", compress="lzw")
+    different = make_raster_at(np.zeros((8, 8), dtype=np.float32), tmp_path / "different.tif")
+
+    assert DifferOfGeoTiffs().diffs(same, approved) == []
+    assert len(DifferOfGeoTiffs(decode_threads=2).diffs(different, approved)) == 2
+    assert shared_arrays.decoded_arrays == 1
+
+
+def test_approved_tif_larger_than_the_cache_is_read_by_window(tmp_path):
+    set_shared_array_cache(SharedArrayCache(tmp_path / "arrays", max_bytes=8 * 8 * 4 - 1))
+    try:
+        approved = make_raster_at(np.zeros((8, 8), dtype=np.float32), tmp_path / "approved.tif", compress="lzw")
+        different = make_raster_at(np.ones((8, 8), dtype=np.float32), tmp_path / "different.tif")
+        assert len(DifferOfGeoTiffs(memory_limit=6 * 8 * 4).diffs(different, approved)) == 2
+        assert get_shared_array_cache().decoded_arrays == 0
+    finally:
+        set_shared_array_cache(None)
+
+
+def test_approved_tif_larger_than_the_memory_limit_is_read_by_window(tmp_path, shared_arrays):
+    approved = make_raster_at(np.zeros((128, 128), dtype=np.float32), tmp_path / "approved.tif", compress="lzw")
+    different = make_raster_at(np.ones((128, 128), dtype=np.float32), tmp_path / "different.tif")
+
+    assert len(DifferOfGeoTiffs(memory_limit=6 * 16 * 128 * 4).diffs(different, approved)) == 2
+    assert shared_arrays.decoded_arrays == 0
+
+
+def test_approved_zarr_is_decoded_once_for_all_comparisons(tmp_path, shared_arrays):
+    approved = make_zarr_at(np.arange(16.).reshape(4, 4), tmp_path / "approved.zarr")
+    different = make_zarr_at(np.zeros((4, 4)), tmp_path / "different.zarr")
+
+    for _ in range(2):
+        assert len(DifferOfGeoZarrs().diffs(different, approved)) == 2
+    assert shared_arrays.decoded_arrays == 1
+    assert not list((shared_arrays.directory / "refs").iterdir())
+
+
+def test_approved_zarr_is_only_decoded_in_its_differing_chunks(tmp_path, shared_arrays, compared_arrays):
+    values = np.zeros((40, 40))
+    make_chunked_zarr_at(values, tmp_path / "received.zarr")
+    values[35, 20] = 1
+    approved = make_chunked_zarr_at(values, tmp_path / "approved.zarr")
+
+    assert not DifferOfGeoZarrs().shared_is_equal(tmp_path / "received.zarr", approved)
+    assert [r.shape for r, _ in compared_arrays] == [(8, 16)]
+    assert shared_arrays.decoded_arrays == 0
+
+
+def test_approved_zarr_larger_than_the_memory_limit_is_not_shared(tmp_path, shared_arrays):
+    approved = make_zarr_at(np.arange(16.).reshape(4, 4), tmp_path / "approved.zarr")
+    different = make_zarr_at(np.zeros((4, 4)), tmp_path / "different.zarr")
+
+    assert len(DifferOfGeoZarrs(memory_limit=4 * 4 * 8 - 1).diffs(different, approved)) == 2
+    assert shared_arrays.decoded_arrays == 0
+
+
+def make_chunked_zarr_at(values, file_path):
+    ds = Dataset(dict(var_name=(('y', 'x'), values)),
+                 coords=dict(y=np.arange(values.shape[0]), x=np.arange(values.shape[1])))
+    ds.var_name.encoding['chunks'] = (16, 16)
+    ds.to_zarr(file_path)
+    return file_path
+
+
+def test_shared_arrays_option_removes_its_directory_after_the_run(testdir, tmp_path):
+    testdir.makepyfile(f"""
+        from pytest_approvaltests_geo.shared_arrays import get_shared_array_cache
+
+        def test_shared_arrays():
+            directory = get_shared_array_cache().directory
+            assert directory.is_dir()
+            with open("{(tmp_path / 'directory').as_posix()}", "w") as f:
+                f.write(str(directory))
+    """)
+    result = testdir.runpytest("--approval-test-geo-shared-arrays-size=16")
+
+    result.assert_outcomes(passed=1)
+    assert not os.path.exists((tmp_path / "directory").read_text())